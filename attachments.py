@@ -0,0 +1,251 @@
+"""Media and document attachments: uploads streamed to disk, checked, and stored by content hash"""
+
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+import threading
+import time
+
+from werkzeug.utils import secure_filename
+
+from storage import atomic_write_json
+
+logger = logging.getLogger(__name__)
+
+# Shared by the web workers (which spool uploads) and the browser owner (which stores and sends them)
+ATTACHMENT_DIR = os.path.abspath(os.environ.get('ATTACHMENT_DIR', 'whatsapp_attachments'))
+ATTACHMENT_MAX_BYTES = int(os.environ.get('ATTACHMENT_MAX_BYTES', 64 * 1024 * 1024))
+
+DEFAULT_CONTENT_TYPES = (
+    'image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'video/mp4', 'video/3gpp', 'video/quicktime',
+    'audio/mpeg', 'audio/ogg', 'audio/mp4',
+    'application/pdf', 'text/plain', 'text/csv', 'application/zip',
+    'application/msword', 'application/vnd.ms-excel', 'application/vnd.ms-powerpoint',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+)
+
+# What WhatsApp Web's "Photos & videos" picker accepts; everything else is sent as a document
+MEDIA_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'video/mp4', 'video/3gpp', 'video/quicktime'}
+
+OOXML = b'PK\x03\x04'
+OLE2 = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+
+# Leading bytes a file must start with to be accepted as the declared type
+SIGNATURES = {
+    'image/jpeg': (b'\xff\xd8\xff',),
+    'image/png': (b'\x89PNG\r\n\x1a\n',),
+    'image/gif': (b'GIF87a', b'GIF89a'),
+    'application/pdf': (b'%PDF-',),
+    'application/zip': (OOXML,),
+    'audio/ogg': (b'OggS',),
+    'application/msword': (OLE2,),
+    'application/vnd.ms-excel': (OLE2,),
+    'application/vnd.ms-powerpoint': (OLE2,),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': (OOXML,),
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': (OOXML,),
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': (OOXML,)
+}
+
+# ISO base media files (mp4, mov, 3gp) carry their box type at offset 4
+ISO_MEDIA_TYPES = {'video/mp4', 'video/3gpp', 'video/quicktime', 'audio/mp4'}
+ISO_MEDIA_BOXES = (b'ftyp', b'moov', b'mdat', b'wide', b'free')
+
+# Uploads that never made it into the store (worker killed mid-request) are removed after this long
+SPOOL_MAX_AGE = 3600
+
+
+def spool_dir():
+    """Directory uploads are streamed into before the store adopts them"""
+    path = os.path.join(ATTACHMENT_DIR, '.incoming')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def resolve_content_type(filename, declared):
+    """The declared part type, or one guessed from the filename when the client sent none"""
+    declared = (declared or '').split(';')[0].strip().lower()
+    if declared and declared != 'application/octet-stream':
+        return declared
+    guessed, _ = mimetypes.guess_type(filename or '')
+    return guessed or 'application/octet-stream'
+
+
+def content_matches(path, content_type):
+    """True unless the file's leading bytes contradict content_type"""
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    if content_type == 'image/webp':
+        return head[:4] == b'RIFF' and head[8:12] == b'WEBP'
+    if content_type in ISO_MEDIA_TYPES:
+        return head[4:8] in ISO_MEDIA_BOXES
+    if content_type == 'audio/mpeg':
+        return head[:3] == b'ID3' or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0)
+    signatures = SIGNATURES.get(content_type)
+    return not signatures or head.startswith(signatures)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class AttachmentStore:
+    """Checked uploads stored on disk under their SHA-256, ready to hand to Chrome by path"""
+
+    def __init__(self, directory=None, max_bytes=None, ttl=None, content_types=None):
+        self.directory = os.path.abspath(directory or ATTACHMENT_DIR)
+        self.max_bytes = max_bytes or ATTACHMENT_MAX_BYTES
+        self.ttl = ttl or float(os.environ.get('ATTACHMENT_TTL', 24 * 3600))
+        if content_types is None:
+            configured = os.environ.get('ATTACHMENT_CONTENT_TYPES')
+            content_types = configured.split(',') if configured else DEFAULT_CONTENT_TYPES
+        self.content_types = {content_type.strip().lower() for content_type in content_types if content_type.strip()}
+        self.lock = threading.Lock()
+        self.attachments = {}
+        self.uploads = self.reused = self.rejected = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self.load()
+
+    def load(self):
+        for attachment_id in os.listdir(self.directory):
+            meta_path = os.path.join(self.directory, attachment_id, 'meta.json')
+            if not os.path.exists(meta_path):
+                continue
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if os.path.exists(meta['path']):
+                    self.attachments[attachment_id] = meta
+            except Exception as e:
+                logger.error(f"Error loading attachment {attachment_id}: {e}")
+        if self.attachments:
+            logger.info(f"Loaded {len(self.attachments)} stored attachments")
+
+    def write_meta(self, meta):
+        atomic_write_json(os.path.join(self.directory, meta['id'], 'meta.json'), meta)
+
+    def adopt(self, spooled_path, filename, declared_type=None):
+        """Move (or, if rejected or a duplicate, delete) a spooled upload; returns (attachment, None) or (None, error)"""
+        try:
+            size = os.path.getsize(spooled_path)
+            content_type = resolve_content_type(filename, declared_type)
+            error = None
+            if not size:
+                error = 'Attachment is empty'
+            elif size > self.max_bytes:
+                error = f"Attachment is larger than {self.max_bytes} bytes"
+            elif content_type not in self.content_types:
+                error = f"Content type {content_type} is not allowed"
+            elif not content_matches(spooled_path, content_type):
+                error = f"File content does not match {content_type}"
+            if error:
+                with self.lock:
+                    self.rejected += 1
+                return None, error
+
+            sha256 = file_sha256(spooled_path)
+            attachment_id = sha256[:32]
+            with self.lock:
+                self.cleanup()
+                meta = self.attachments.get(attachment_id)
+                if meta and os.path.exists(meta['path']):
+                    meta['uploaded_at'] = time.time()
+                    self.write_meta(meta)
+                    self.reused += 1
+                    return self.view(meta, reused=True), None
+
+                folder = os.path.join(self.directory, attachment_id)
+                os.makedirs(folder, exist_ok=True)
+                stored_name = secure_filename(filename or '') or f"attachment{mimetypes.guess_extension(content_type) or ''}"
+                path = os.path.join(folder, stored_name)
+                os.replace(spooled_path, path)
+                meta = {
+                    'id': attachment_id,
+                    'filename': stored_name,
+                    'content_type': content_type,
+                    'kind': 'media' if content_type in MEDIA_TYPES else 'document',
+                    'size': size,
+                    'sha256': sha256,
+                    'path': path,
+                    'uploaded_at': time.time()
+                }
+                self.write_meta(meta)
+                self.attachments[attachment_id] = meta
+                self.uploads += 1
+            logger.info(f"Stored attachment {attachment_id} ({stored_name}, {size} bytes)")
+            return self.view(meta), None
+        finally:
+            if os.path.exists(spooled_path):
+                os.unlink(spooled_path)
+
+    def get(self, attachment_id):
+        """Stored attachment including its path, or None if unknown or expired"""
+        with self.lock:
+            meta = self.attachments.get(attachment_id)
+            if not meta:
+                return None
+            if time.time() - meta['uploaded_at'] >= self.ttl or not os.path.exists(meta['path']):
+                self.remove(attachment_id)
+                return None
+            return dict(meta)
+
+    def describe(self, attachment_id):
+        meta = self.get(attachment_id)
+        return self.view(meta) if meta else None
+
+    def delete(self, attachment_id):
+        with self.lock:
+            if attachment_id not in self.attachments:
+                return False
+            self.remove(attachment_id)
+            return True
+
+    def remove(self, attachment_id):
+        """Drop an attachment and its files (caller holds the lock)"""
+        self.attachments.pop(attachment_id, None)
+        shutil.rmtree(os.path.join(self.directory, attachment_id), ignore_errors=True)
+
+    def cleanup(self):
+        """Expire old attachments and abandoned uploads (caller holds the lock)"""
+        now = time.time()
+        for attachment_id, meta in list(self.attachments.items()):
+            if now - meta['uploaded_at'] >= self.ttl:
+                self.remove(attachment_id)
+        incoming = os.path.join(self.directory, '.incoming')
+        if os.path.isdir(incoming):
+            for name in os.listdir(incoming):
+                path = os.path.join(incoming, name)
+                try:
+                    if now - os.path.getmtime(path) >= SPOOL_MAX_AGE:
+                        os.unlink(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def view(meta, reused=False):
+        """Public description of an attachment (without its server path)"""
+        view = {key: meta[key] for key in ('id', 'filename', 'content_type', 'kind', 'size', 'sha256', 'uploaded_at')}
+        if reused:
+            view['reused'] = True
+        return view
+
+    def stats(self):
+        with self.lock:
+            return {
+                'stored': len(self.attachments),
+                'bytes': sum(meta['size'] for meta in self.attachments.values()),
+                'uploads': self.uploads,
+                'reused': self.reused,
+                'rejected': self.rejected,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl
+            }
@@ -0,0 +1,607 @@
+"""Offline benchmark for the WhatsApp sender hot paths
+
+Runs WhatsAppBot and the Flask routes against a stand-in for WhatsApp Web,
+so hot-path changes can be compared run over run without a real account:
+
+    python benchmark.py                          # in-process fake WebDriver
+    python benchmark.py --rtt 0.004 --page-load 0.5 --send-delay 0.2
+    python benchmark.py --driver chrome          # real Chrome against a local stub page
+    python benchmark.py --save after.json --baseline before.json
+
+Each scenario reports throughput, p50/p95/p99 latency and WebDriver round
+trips per operation. Round trips are only counted for the fake driver.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 1x1 transparent PNG handed back for canvas.toDataURL / element screenshots
+FAKE_PNG = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082'
+)).decode('ascii')
+
+# selenium.webdriver.common.keys.Keys values, so the fake does not need selenium to parse keystrokes
+KEY_ENTER, KEY_SHIFT, KEY_CONTROL, KEY_BACKSPACE, KEY_ESCAPE = '\ue007', '\ue008', '\ue009', '\ue003', '\ue00c'
+
+
+class FakeElement:
+    """An element of the fake page, identified by the SELECTORS group that locates it"""
+
+    def __init__(self, driver, group):
+        self.driver = driver
+        self.group = group
+
+    @property
+    def screenshot_as_base64(self):
+        self.driver.round_trip('screenshot')
+        return FAKE_PNG
+
+    def is_displayed(self):
+        self.driver.round_trip('is_displayed')
+        return True
+
+    def is_enabled(self):
+        self.driver.round_trip('is_enabled')
+        return True
+
+    def click(self):
+        self.driver.round_trip('click')
+        if self.group == 'send_button':
+            self.driver.submit()
+
+    def clear(self):
+        self.driver.round_trip('clear')
+        if self.group == 'message_input':
+            self.driver.draft = ''
+
+    def send_keys(self, *keys):
+        self.driver.round_trip('send_keys')
+        self.driver.type_keys(self.group, keys)
+
+
+class FakeWebDriver:
+    """In-process stand-in for a Chrome WebDriver showing WhatsApp Web
+
+    Models the pieces of the page the bot looks for (SELECTORS groups), with
+    artificial latency per WebDriver command (rtt), per page load and per
+    send confirmation.
+    """
+
+    def __init__(self, selectors, base_url, rtt=0.0, page_load=0.2, send_delay=0.1,
+                 logged_in=True, known_chats=(), qr_rotation=20.0):
+        self.base_url = base_url
+        self.rtt = rtt
+        self.page_load = page_load
+        self.send_delay = send_delay
+        self.logged_in = logged_in
+        self.known_chats = set(known_chats)
+        self.qr_rotation = qr_rotation
+        self.groups_for = {}
+        for group, group_selectors in selectors.items():
+            for selector in group_selectors:
+                self.groups_for.setdefault(selector, set()).add(group)
+
+        self.url = 'about:blank'
+        self.view = 'blank'
+        self.chat = None
+        self.loaded_at = 0.0
+        self.draft = ''
+        self.search_text = ''
+        self.sending_until = 0.0
+        self.sent = []
+        self.round_trips = 0
+        self.commands = {}
+        self.lock = threading.Lock()
+
+    def round_trip(self, command):
+        with self.lock:
+            self.round_trips += 1
+            self.commands[command] = self.commands.get(command, 0) + 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+    def visible_groups(self):
+        now = time.time()
+        if self.view == 'blank' or now < self.loaded_at:
+            return set()
+        if not self.logged_in:
+            return {'qr'}
+
+        groups = {'app_loaded', 'logged_in', 'chat_search'}
+        if self.view == 'chat':
+            groups.update(('message_input', 'chat_header'))
+            if self.draft or now < self.sending_until:
+                groups.add('send_button')
+        return groups
+
+    def match(self, selector, group=None):
+        groups = self.groups_for.get(selector, set()) & self.visible_groups()
+        if group:
+            return [FakeElement(self, group)] if group in groups else []
+        return [FakeElement(self, sorted(groups)[-1])] if groups else []
+
+    def element_text(self, group):
+        return f"+{self.chat}" if group == 'chat_header' else ''
+
+    def submit(self):
+        if self.draft:
+            self.sent.append((self.chat, self.draft))
+            # Messaging a number creates its chat, so the in-app search finds it afterwards
+            self.known_chats.add(self.chat)
+            self.draft = ''
+            self.sending_until = time.time() + self.send_delay
+
+    def type_keys(self, group, keys):
+        if group == 'chat_search':
+            if KEY_BACKSPACE in keys or KEY_ESCAPE in keys:
+                self.search_text = ''
+            elif KEY_CONTROL not in keys:
+                self.search_text += ''.join(keys)
+        elif group == 'message_input':
+            if keys == (KEY_ENTER,):
+                self.submit()
+            elif KEY_SHIFT in keys:
+                self.draft += '\n'
+            elif KEY_BACKSPACE in keys:
+                self.draft = ''
+            elif KEY_CONTROL not in keys:
+                self.draft += ''.join(keys)
+
+    # WebDriver surface used by WhatsAppBot
+
+    @property
+    def current_url(self):
+        self.round_trip('current_url')
+        return self.url
+
+    def get(self, url):
+        self.round_trip('get')
+        self.url = url
+        self.loaded_at = time.time() + self.page_load
+        parts = urlsplit(url)
+        query = parse_qs(parts.query)
+        if parts.path.rstrip('/') == '/send':
+            self.view = 'chat'
+            self.chat = query.get('phone', [''])[0]
+            self.draft = query.get('text', [''])[0]
+        else:
+            self.view = 'home'
+            self.chat = None
+            self.draft = ''
+
+    def find_elements(self, by=None, selector=None):
+        self.round_trip('find_elements')
+        return self.match(selector)
+
+    def find_element(self, by=None, selector=None):
+        elements = self.find_elements(by, selector)
+        if not elements:
+            raise LookupError(selector)
+        return elements[0]
+
+    def execute_script(self, script, *args):
+        self.round_trip('execute_script')
+        if 'stopAtFirst' in script:
+            result = {}
+            for group, group_selectors in args[0].items():
+                hits = []
+                for selector in group_selectors:
+                    for element in self.match(selector, group):
+                        hit = {'selector': selector, 'visible': True, 'enabled': True, 'element': element}
+                        if group in (args[2] if len(args) > 2 else ()):
+                            hit['text'] = self.element_text(group)
+                        hits.append(hit)
+                    if hits and args[1]:
+                        break
+                result[group] = hits
+            return result
+        if 'data-ref' in script:
+            return {'ref': f"ref-{int(time.time() // self.qr_rotation)}", 'canvas': FakeElement(self, 'qr')}
+        if 'toDataURL' in script:
+            return FAKE_PNG
+        if 'dispatchEvent' in script:
+            digits = args[0]
+            if 'chat_search' not in self.visible_groups():
+                return {'clicked': False, 'titles': ''}
+            if digits in self.known_chats and digits == self.search_text:
+                self.view, self.chat, self.draft = 'chat', digits, ''
+                return {'clicked': True, 'titles': ''}
+            return {'clicked': False, 'titles': '\n'.join(
+                f"+{chat}" for chat in sorted(self.known_chats) if self.search_text in chat)}
+        if 'click()' in script and args:
+            if args[0].group == 'send_button':
+                self.submit()
+            return None
+        if 'readyState' in script:
+            return 'complete' if time.time() >= self.loaded_at else 'loading'
+        return None
+
+    def get_cookies(self):
+        self.round_trip('get_cookies')
+        return [{'name': 'wa_session', 'value': 'benchmark', 'domain': urlsplit(self.base_url).hostname}]
+
+    def add_cookie(self, cookie):
+        self.round_trip('add_cookie')
+
+    def set_page_load_timeout(self, seconds):
+        pass
+
+    def quit(self):
+        self.view = 'blank'
+
+
+STUB_PAGE = """<!DOCTYPE html>
+<html><head><title>WhatsApp</title></head>
+<body>
+<div id="app"></div>
+<script>
+var config = %(config)s;
+var params = new URLSearchParams(location.search);
+var app = document.getElementById('app');
+
+function renderQR() {
+    var ref = 'ref-' + Math.floor(Date.now() / 1000 / config.qr_rotation);
+    app.innerHTML = '<div data-ref="' + ref + '"><canvas data-testid="qr-code" role="img" width="64" height="64"></canvas></div>';
+    setTimeout(renderQR, config.qr_rotation * 1000);
+}
+
+function renderChat(phone, text) {
+    var main = document.getElementById('main');
+    main.innerHTML = '<header><span dir="auto" title="+' + phone + '">+' + phone + '</span></header>' +
+        '<div data-testid="conversation-compose-box-input" contenteditable="true" data-tab="10"></div>' +
+        '<span id="send-slot"></span>';
+    var box = main.querySelector('[contenteditable]'), slot = document.getElementById('send-slot');
+    function sync() {
+        slot.innerHTML = box.innerText.trim() ? '<button data-testid="send" aria-label="Send">Send</button>' : '';
+        if (slot.firstChild) slot.firstChild.onclick = submit;
+    }
+    function submit() {
+        box.innerText = '';
+        setTimeout(sync, config.send_delay * 1000);
+    }
+    box.addEventListener('input', sync);
+    box.addEventListener('keydown', function (event) {
+        if (event.key === 'Enter' && !event.shiftKey) { event.preventDefault(); submit(); }
+    });
+    box.innerText = text || '';
+    sync();
+}
+
+function renderApp() {
+    var rows = config.known_chats.map(function (digits) {
+        return '<div role="listitem"><div data-testid="cell-frame-container" data-phone="' + digits + '">' +
+            '<span dir="auto" title="+' + digits + '">+' + digits + '</span></div></div>';
+    }).join('');
+    app.innerHTML = '<div id="side" data-testid="side">' +
+        '<div data-testid="chat-list-search" contenteditable="true" data-tab="3"></div>' +
+        '<div id="pane-side" data-testid="chat-list">' + rows + '</div></div><div id="main"></div>';
+    Array.prototype.forEach.call(document.querySelectorAll("[data-testid='cell-frame-container']"), function (cell) {
+        cell.addEventListener('click', function () { renderChat(cell.getAttribute('data-phone'), ''); });
+    });
+    if (location.pathname === '/send') renderChat(params.get('phone'), params.get('text'));
+}
+
+setTimeout(config.logged_in ? renderApp : renderQR, config.page_load * 1000);
+</script>
+</body></html>
+"""
+
+
+class StubServer:
+    """Local HTTP server serving a minimal page with WhatsApp Web's data-testid selectors"""
+
+    def __init__(self, page_load=0.2, send_delay=0.1, logged_in=True, known_chats=(), qr_rotation=20.0):
+        self.config = {
+            'page_load': page_load,
+            'send_delay': send_delay,
+            'logged_in': logged_in,
+            'known_chats': list(known_chats),
+            'qr_rotation': qr_rotation
+        }
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = (STUB_PAGE % {'config': json.dumps(stub.config)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(name, latencies, elapsed, round_trips, failures):
+    latencies = sorted(latencies)
+    ops = len(latencies)
+    return {
+        'scenario': name,
+        'ops': ops,
+        'failures': failures,
+        'seconds': round(elapsed, 3),
+        'ops_per_second': round(ops / elapsed, 2) if elapsed else 0.0,
+        'p50': round(percentile(latencies, 0.50), 4),
+        'p95': round(percentile(latencies, 0.95), 4),
+        'p99': round(percentile(latencies, 0.99), 4),
+        'mean': round(statistics.mean(latencies), 4) if latencies else 0.0,
+        'round_trips_per_op': round(round_trips / ops, 1) if ops and round_trips is not None else None
+    }
+
+
+class Benchmark:
+    def __init__(self, main, args, stub=None):
+        self.main = main
+        self.args = args
+        self.stub = stub
+        self.bot = main.bot
+        self.fakes = []
+        self.logged_in = True
+        self.profile = None
+
+        if args.driver == 'fake':
+            main.webdriver.Chrome = self.fake_chrome
+
+    def fake_chrome(self, options=None, **kwargs):
+        driver = FakeWebDriver(
+            self.main.SELECTORS,
+            self.main.WHATSAPP_WEB_URL,
+            rtt=self.args.rtt,
+            page_load=self.args.page_load,
+            send_delay=self.args.send_delay,
+            logged_in=self.logged_in,
+            known_chats=self.known_chats(),
+            qr_rotation=self.args.qr_rotation
+        )
+        self.fakes.append(driver)
+        return driver
+
+    def phones(self):
+        return [f"91987650{index:04d}" for index in range(self.args.recipients)]
+
+    def known_chats(self):
+        # The first half of the recipients already have a chat, so the in-app switch can find them
+        return self.phones()[:int(self.args.recipients * self.args.known_ratio)]
+
+    def round_trips(self):
+        return sum(driver.round_trips for driver in self.fakes) if self.args.driver == 'fake' else None
+
+    def set_login(self, logged_in):
+        """(Re)start the browser in the given login state"""
+        self.logged_in = logged_in
+        if self.stub:
+            self.stub.config['logged_in'] = logged_in
+        with self.bot.lock:
+            self.bot.restart_driver()
+        self.bot.is_logged_in = False
+        self.bot.clear_qr()
+
+    def measure(self, name, operations, operation):
+        before = self.round_trips()
+        latencies, failures = [], 0
+        started = time.perf_counter()
+        for index in range(operations):
+            op_started = time.perf_counter()
+            if not operation(index):
+                failures += 1
+            latencies.append(time.perf_counter() - op_started)
+        elapsed = time.perf_counter() - started
+        after = self.round_trips()
+        return summarize(name, latencies, elapsed, None if before is None else after - before, failures)
+
+    def run(self):
+        args = self.args
+        phones = self.phones()
+        client = self.main.app.test_client()
+        results = []
+
+        self.set_login(True)
+        self.bot.prepare_session()
+
+        results.append(self.measure(
+            'send_message', args.sends,
+            lambda index: self.bot.send_message(f"+{phones[index % len(phones)]}", f"Benchmark message {index}")[0]
+        ))
+
+        # Notification-style traffic: several messages in a row to the same person
+        results.append(self.measure(
+            'send_same_recipient', args.sends,
+            lambda index: self.bot.send_message(
+                f"+{phones[(index // args.burst) % len(phones)]}", f"Burst message {index}")[0]
+        ))
+
+        results.append(self.measure(
+            'route_send_message', args.sends,
+            lambda index: client.post('/send_message', json={
+                'phone_number': f"+{phones[index % len(phones)]}",
+                'message': f"Route message {index}"
+            }).status_code == 200
+        ))
+
+        results.append(self.bulk(phones))
+
+        results.append(self.measure(
+            'check_login_status', args.checks,
+            lambda index: self.bot.check_login_status()[0]
+        ))
+
+        results.append(self.measure(
+            'route_check_login_live', args.checks,
+            lambda index: client.get('/check_login?live=1').status_code == 200
+        ))
+
+        # Browser launch to first logged-in page; compare PROFILE_SNAPSHOT=1 against a disk profile
+        results.append(self.measure('cold_start', args.cold_starts, lambda index: self.cold_start()))
+        self.profile = self.bot.profile.stats()
+
+        self.set_login(False)
+        results.append(self.measure(
+            'qr_capture', args.qr_captures,
+            lambda index: self.bot.get_qr_code()[2] is not None
+        ))
+
+        return results
+
+    def cold_start(self):
+        self.bot.close_session()
+        with self.bot.lock:
+            return self.bot.restart_driver(planned=True) and self.bot.ensure_logged_in()[0]
+
+    def bulk(self, phones):
+        rows = [
+            {'row': index + 1, 'phone_number': f"+{phones[index % len(phones)]}", 'message': f"Bulk message {index}"}
+            for index in range(self.args.bulk)
+        ]
+        before = self.round_trips()
+        started = time.perf_counter()
+        results = list(self.bot.send_bulk(iter(rows)))
+        elapsed = time.perf_counter() - started
+        after = self.round_trips()
+
+        row_results = [result for result in results if 'summary' not in result]
+        failures = sum(1 for result in row_results if result['status'] != 'success')
+        latencies = [result.get('seconds', 0.0) for result in row_results]
+        return summarize('send_bulk', latencies, elapsed, None if before is None else after - before, failures)
+
+
+def print_table(results, baseline=None):
+    baseline = {result['scenario']: result for result in baseline or []}
+    columns = ['scenario', 'ops', 'failures', 'ops_per_second', 'p50', 'p95', 'p99', 'round_trips_per_op']
+    print('  '.join(f"{column:>18}" for column in columns))
+    for result in results:
+        print('  '.join(f"{str(result[column]):>18}" for column in columns))
+        previous = baseline.get(result['scenario'])
+        if previous:
+            deltas = []
+            for column in ('ops_per_second', 'p50', 'p95', 'p99', 'round_trips_per_op'):
+                if previous.get(column) and result.get(column) is not None:
+                    deltas.append(f"{column} {100.0 * (result[column] - previous[column]) / previous[column]:+.1f}%")
+            print(f"{'vs baseline':>18}  " + ', '.join(deltas))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--driver', choices=['fake', 'chrome'], default='fake',
+                        help='in-process fake WebDriver, or real Chrome against the local stub page')
+    parser.add_argument('--rtt', type=float, default=0.0, help='fake WebDriver latency per command (seconds)')
+    parser.add_argument('--page-load', type=float, default=0.2, help='page load latency (seconds)')
+    parser.add_argument('--send-delay', type=float, default=0.1, help='time until a sent message clears the send button')
+    parser.add_argument('--qr-rotation', type=float, default=20.0, help='seconds between QR code rotations')
+    parser.add_argument('--sends', type=int, default=20, help='single sends per scenario')
+    parser.add_argument('--bulk', type=int, default=50, help='rows in the bulk send')
+    parser.add_argument('--checks', type=int, default=50, help='login checks per scenario')
+    parser.add_argument('--qr-captures', type=int, default=20, help='QR captures')
+    parser.add_argument('--inbound', type=float, default=0.0,
+                        help='run the inbound message drainer at this INBOUND_POLL_INTERVAL (seconds) during the run')
+    parser.add_argument('--cold-starts', type=int, default=3, help='browser restarts timed up to the logged-in page')
+    parser.add_argument('--burst', type=int, default=3, help='consecutive messages per recipient in send_same_recipient')
+    parser.add_argument('--recipients', type=int, default=10, help='distinct recipients to cycle through')
+    parser.add_argument('--known-ratio', type=float, default=0.5,
+                        help='fraction of recipients with an existing chat (in-app switch path)')
+    parser.add_argument('--save', help='write results as JSON to this path')
+    parser.add_argument('--baseline', help='compare against a JSON file written by --save')
+    parser.add_argument('--verbose', action='store_true', help='keep the app logging at INFO')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    stub = None
+    if args.driver == 'chrome':
+        stub = StubServer(args.page_load, args.send_delay, True, [], args.qr_rotation).start()
+        os.environ['WHATSAPP_WEB_URL'] = stub.url
+
+    # Isolate profile, cookies and outbox from the real ones, and take pacing out of the measurement
+    workdir = tempfile.mkdtemp(prefix='whatsapp-benchmark-')
+    os.chdir(workdir)
+    os.environ.setdefault('OUTBOX_PATH', '')
+    os.environ.setdefault('RATE_LIMIT_PER_MINUTE', '0')
+    os.environ.setdefault('LOGIN_WATCH_INTERVAL', '3600')
+    os.environ.setdefault('QR_WATCH_INTERVAL', '3600')
+    if args.inbound:
+        os.environ['INBOUND_POLL_INTERVAL'] = str(args.inbound)
+    sys.path.insert(0, REPO_DIR)
+
+    import main as app_module
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        app_module.logger.setLevel(logging.WARNING)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    if not app_module.SELENIUM_AVAILABLE:
+        print(f"Selenium is required to run the benchmark: {app_module.SELENIUM_IMPORT_ERROR}")
+        return 1
+
+    benchmark = Benchmark(app_module, args, stub)
+    if args.inbound:
+        for bot in app_module.pool.bots.values():
+            bot.inbound.ensure_started()
+    if stub:
+        stub.config['known_chats'] = benchmark.known_chats()
+
+    try:
+        results = benchmark.run()
+    finally:
+        app_module.pool.shutdown()
+        if stub:
+            stub.stop()
+
+    baseline = None
+    if args.baseline:
+        with open(os.path.join(REPO_DIR, args.baseline) if not os.path.isabs(args.baseline) else args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    print(f"driver={args.driver} rtt={args.rtt}s page_load={args.page_load}s send_delay={args.send_delay}s")
+    print_table(results, baseline)
+    if benchmark.profile and benchmark.profile['launches']:
+        launches = benchmark.profile['launches']
+        ready = [launch['ready_seconds'] for launch in launches if launch['ready_seconds'] is not None]
+        restore = benchmark.profile['restore_seconds']
+        print(f"profile={benchmark.profile['mode']} restore={'-' if restore is None else f'{restore}s'} "
+              f"launch_mean={statistics.mean(launch['launch_seconds'] for launch in launches):.3f}s "
+              f"ready_mean={statistics.mean(ready) if ready else 0.0:.3f}s")
+
+    if args.save:
+        path = args.save if os.path.isabs(args.save) else os.path.join(REPO_DIR, args.save)
+        with open(path, 'w') as f:
+            json.dump({'config': vars(args), 'results': results}, f, indent=2)
+        print(f"Saved results to {path}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""Gunicorn settings: many HTTP workers sharing one browser-owner process
+
+    gunicorn -c gunicorn.conf.py main:app
+
+The master starts `python main.py owner` before forking workers. That
+process holds the only Chrome (and profile) per account; workers reach it
+over BROWSER_OWNER_ADDRESS instead of launching browsers of their own. If the
+owner exits, the master restarts it with backoff (BROWSER_OWNER_RESTART_BACKOFF
+doubling up to BROWSER_OWNER_RESTART_BACKOFF_MAX seconds); /readyz reports 503
+while it is down.
+"""
+
+import os
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# Threads keep long-lived requests (SSE, QR long-poll, bulk sends) from starving a worker
+worker_class = 'gthread'
+# SSE streams hold their thread until the client leaves; keep half of each worker for everything else
+os.environ.setdefault('SSE_MAX_CONNECTIONS', str(max(1, threads // 2)))
+timeout = 120
+
+# Inherited by the browser owner and every worker
+os.environ.setdefault('BROWSER_OWNER_ADDRESS', os.path.join(tempfile.gettempdir(), 'whatsapp-browser-owner.sock'))
+os.environ.setdefault('BROWSER_OWNER_AUTHKEY', secrets.token_hex(16))
+
+browser_owner = None
+stopping = threading.Event()
+
+
+def start_browser_owner(server):
+    global browser_owner
+    main_py = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main.py')
+    browser_owner = subprocess.Popen([sys.executable, main_py, 'owner'])
+    server.log.info(f"Started browser owner (pid {browser_owner.pid}) on {os.environ['BROWSER_OWNER_ADDRESS']}")
+
+
+def supervise_browser_owner(server):
+    """Restart the owner whenever it exits, backing off while it keeps crashing"""
+    base = float(os.environ.get('BROWSER_OWNER_RESTART_BACKOFF', 1))
+    backoff_max = float(os.environ.get('BROWSER_OWNER_RESTART_BACKOFF_MAX', 60))
+    backoff = base
+    while not stopping.is_set():
+        started = time.monotonic()
+        code = browser_owner.wait()
+        if stopping.is_set():
+            return
+        # A run that lasted a while was not a crash loop
+        if time.monotonic() - started > backoff_max:
+            backoff = base
+        server.log.error(f"Browser owner exited with code {code}; restarting in {backoff:g}s")
+        if stopping.wait(backoff):
+            return
+        backoff = min(backoff * 2, backoff_max)
+        start_browser_owner(server)
+
+
+def on_starting(server):
+    start_browser_owner(server)
+    threading.Thread(target=supervise_browser_owner, args=(server,), name='browser-owner-supervisor', daemon=True).start()
+
+
+def on_exit(server):
+    stopping.set()
+    if browser_owner and browser_owner.poll() is None:
+        browser_owner.terminate()
+        try:
+            browser_owner.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            browser_owner.kill()
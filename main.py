@@ -1,33 +1,1002 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, Request, render_template, request, jsonify, Response, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import time
 import threading
 import atexit
+import bisect
 import json
-from urllib.parse import quote
+from urllib.parse import quote, urlsplit
+import urllib.error
+import urllib.request
 import logging
 import sys
 from pathlib import Path
-import base64
-from io import BytesIO
+import hashlib
+import csv
+import io
+import heapq
+import inspect
+import itertools
+import math
+import random
+import re
+import uuid
+import queue
+import signal
+import sqlite3
+import string
+import tempfile
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+import attachments
+import profiles
+import recipients
+import storage
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Selenium is imported once here rather than inside every hot-path method
+try:
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.common.keys import Keys
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.common.exceptions import TimeoutException, StaleElementReferenceException
+    SELENIUM_AVAILABLE = True
+    SELENIUM_IMPORT_ERROR = None
+except ImportError as e:
+    webdriver = Options = Keys = WebDriverWait = None
+    TimeoutException = StaleElementReferenceException = Exception
+    SELENIUM_AVAILABLE = False
+    SELENIUM_IMPORT_ERROR = e
+
+# Optional: measures the Chrome process tree's memory; /proc is read directly when it is missing
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Installed with selenium 4; lean browsing speaks DevTools over them to block requests by type
+try:
+    import trio
+    import trio_websocket
+except ImportError:
+    trio = trio_websocket = None
+
+PROCESS_STARTED_AT = time.time()
+
+# Overridable so the bot can be pointed at a local stub page (see benchmark.py)
+WHATSAPP_WEB_URL = os.environ.get('WHATSAPP_WEB_URL', 'https://web.whatsapp.com').rstrip('/')
+WHATSAPP_WEB_HOST = urlsplit(WHATSAPP_WEB_URL).netloc
+# Button text of the "WhatsApp is open in another window" popup; override for non-English UIs
+USE_HERE_TEXT = re.compile(os.environ.get('USE_HERE_TEXT', r'use here'), re.IGNORECASE)
+
 app = Flask(__name__)
 
-class WhatsAppBot:
+class Metrics:
+    """In-process counters, gauges and histograms rendered in Prometheus text format
+    
+    An update is one dict lookup under a short-lived lock, cheap enough to
+    leave on in production.
+    """
+    
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30, 60)
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.meta = OrderedDict()
+        self.values = {}
+    
+    def describe(self, name, kind, help_text, buckets=None):
+        self.meta[name] = {'kind': kind, 'help': help_text, 'buckets': tuple(buckets or self.DEFAULT_BUCKETS)}
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.values[key] = value
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.meta[name]['buckets']
+        index = bisect.bisect_left(buckets, value)
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    @contextmanager
+    def timer(self, name, **labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+    
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (
+            (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for key, value in pairs
+        )
+        return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+    
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self.lock:
+            snapshot = {
+                key: [list(value[0]), value[1], value[2]] if isinstance(value, list) else value
+                for key, value in self.values.items()
+            }
+        
+        lines = []
+        for name, meta in self.meta.items():
+            lines.append(f"# HELP {name} {meta['help']}")
+            lines.append(f"# TYPE {name} {meta['kind']}")
+            for (metric, labels), value in sorted(snapshot.items(), key=lambda item: item[0]):
+                if metric != name:
+                    continue
+                if meta['kind'] != 'histogram':
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+                    continue
+                
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(list(meta['buckets']) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self.format_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_sum{self.format_labels(labels)} {round(total, 6)}")
+                lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('whatsapp_send_phase_seconds', 'histogram', 'Time spent in each phase of sending a message')
+metrics.describe('whatsapp_send_seconds', 'histogram', 'End-to-end time to send one message')
+metrics.describe('whatsapp_messages_total', 'counter', 'Messages attempted, by result and path')
+metrics.describe('whatsapp_wait_seconds', 'histogram', 'Duration of named browser waits')
+metrics.describe('whatsapp_lock_wait_seconds', 'histogram', 'Time spent waiting for the browser lock',
+                 buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 5, 15, 30, 60, 120))
+metrics.describe('whatsapp_driver_restarts_total', 'counter', 'Browser driver restarts')
+metrics.describe('whatsapp_qr_captures_total', 'counter', 'QR code captures, by whether new pixels were read')
+metrics.describe('whatsapp_browser_recycles_total', 'counter', 'Planned browser recycles, by reason')
+metrics.describe('whatsapp_browser_rss_bytes', 'gauge', 'Resident memory of the Chrome process tree')
+metrics.describe('whatsapp_blocked_requests_total', 'counter', 'Requests blocked by the lean browsing policy, by resource type')
+metrics.describe('whatsapp_browser_loaded_bytes_total', 'counter', 'Bytes the browser downloaded while lean browsing is on')
+metrics.describe('whatsapp_send_queue_depth', 'gauge', 'Jobs waiting in the async send queue')
+metrics.describe('whatsapp_logged_in', 'gauge', 'Whether the account is logged in (1) or not (0)')
+metrics.describe('whatsapp_receipts_total', 'counter', 'Message status ticks observed, by status')
+metrics.describe('whatsapp_receipt_seconds', 'histogram', 'Time from submitting a message to each observed status',
+                 buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600, 14400))
+metrics.describe('whatsapp_browser_launch_seconds', 'histogram', 'Time to start Chrome, by where its profile lives',
+                 buckets=(0.25, 0.5, 1, 2, 3, 5, 10, 20, 30, 60))
+metrics.describe('whatsapp_browser_ready_seconds', 'histogram',
+                 'Time from starting Chrome to the first logged-in page, by where its profile lives',
+                 buckets=(1, 2, 3, 5, 7.5, 10, 15, 20, 30, 60, 120))
+metrics.describe('whatsapp_inbound_messages_total', 'counter', 'Incoming messages captured, by where they were seen')
+metrics.describe('whatsapp_webhook_deliveries_total', 'counter', 'Inbound webhook batch deliveries, by result')
+
+# Every CSS selector the bot relies on, grouped by what it locates. When
+# WhatsApp Web changes its DOM this is the one place to update.
+SELECTORS = {
+    'app_loaded': [
+        "[data-testid='side']",
+        "#side",
+        "div[data-testid='chat-list']",
+        "header[data-testid='chatlist-header']",
+        "[data-testid='chat-list-search']"
+    ],
+    'logged_in': [
+        "[data-testid='side']",
+        "[data-testid='chat-list']",
+        "div[data-testid='chatlist-header']",
+        "#side",
+        "div[role='textbox']"
+    ],
+    'qr': [
+        "[data-testid='qr-code']",
+        "canvas[role='img']",
+        "canvas"
+    ],
+    'send_button': [
+        "[data-testid='send']",
+        "[data-icon='send']",
+        "button[data-testid='send']",
+        "span[data-testid='send']",
+        "button[aria-label='Send']",
+        "span[data-icon='send']",
+        "button[title='Send']"
+    ],
+    'message_input': [
+        "[data-testid='conversation-compose-box-input']",
+        "div[contenteditable='true'][data-tab='10']",
+        "[data-testid='compose-box-input']"
+    ],
+    'invalid_number': [
+        "div[data-animate-modal-popup='true']",
+        "[data-testid='popup-contents']",
+        "div[role='dialog']"
+    ],
+    'chat_search': [
+        "[data-testid='chat-list-search']",
+        "div[contenteditable='true'][data-tab='3']",
+        "#side div[contenteditable='true']"
+    ],
+    # Title of the open conversation, used to confirm which chat the compose box belongs to
+    'chat_header': [
+        "[data-testid='conversation-info-header-chat-title']",
+        "#main header span[dir='auto'][title]",
+        "#main header span[dir='auto']"
+    ],
+    # Outgoing message rows and their status tick, watched by ReceiptTracker's observer
+    'outgoing_message': [
+        "[data-id^='true_']"
+    ],
+    'message_status': [
+        "span[data-icon^='msg-']",
+        "[data-testid^='msg-'][data-icon]"
+    ],
+    # Incoming rows of the open conversation and chat list entries, watched by InboundListener's observer
+    'incoming_message': [
+        "[data-id^='false_']"
+    ],
+    # Carries "[time, date] Sender: " in data-pre-plain-text
+    'message_meta': [
+        "[data-pre-plain-text]"
+    ],
+    'message_text': [
+        "[data-testid='msg-text']",
+        "span.selectable-text",
+        ".copyable-text span[dir]"
+    ],
+    'chat_list_item': [
+        "[data-testid='cell-frame-container']",
+        "#pane-side [role='listitem']",
+        "#pane-side [role='row']"
+    ],
+    'chat_list_title': [
+        "[data-testid='cell-frame-title'] span[title]",
+        "span[title][dir='auto']"
+    ],
+    'chat_list_preview': [
+        "[data-testid='last-msg-status'] span[title]",
+        "[data-testid='cell-frame-secondary'] span[title]"
+    ],
+    'unread_badge': [
+        "[data-testid='icon-unread-count']",
+        "span[aria-label*='unread message']"
+    ],
+    # Time of a chat list entry's last message ("10:32", "Yesterday")
+    'chat_list_time': [
+        "[data-testid='cell-frame-primary-detail']"
+    ],
+    # The only subtrees InboundListener observes: the open conversation and the chat list
+    'message_pane': [
+        "#main"
+    ],
+    'chat_list_pane': [
+        "#pane-side"
+    ],
+    'attach_button': [
+        "[data-testid='clip']",
+        "span[data-icon='clip']",
+        "span[data-icon='plus']",
+        "span[data-icon='plus-rounded']",
+        "div[title='Attach']",
+        "button[title='Attach']"
+    ],
+    # Hidden <input type=file> elements the attach menu renders; found without a visibility check
+    'media_input': [
+        "input[type='file'][accept*='image']",
+        "input[type='file'][accept*='video']"
+    ],
+    'document_input': [
+        "input[type='file'][accept='*']",
+        "input[type='file']:not([accept*='image'])",
+        "input[type='file']"
+    ],
+    'media_send_button': [
+        "div[role='button'][aria-label='Send']",
+        "[data-testid='media-send']",
+        "span[data-icon='send']",
+        "span[data-icon='wds-ic-send-filled']"
+    ],
+    'media_caption': [
+        "[data-testid='media-caption-input-container'] div[contenteditable='true']",
+        "div[aria-label='Add a caption'][contenteditable='true']",
+        "div[contenteditable='true'][data-tab='undefined']"
+    ]
+}
+
+class DomProbe:
+    """Evaluate whole selector groups in a single execute_script round trip
+    
+    Each probe reports, per group, which selectors matched and whether the
+    element is visible and enabled. The selector that last produced an
+    actionable match is tried first next time.
+    """
+    
+    PROBE_SCRIPT = """
+        var groups = arguments[0], stopAtFirst = arguments[1], textGroups = arguments[2] || [], result = {};
+        Object.keys(groups).forEach(function (name) {
+            var hits = [], selectors = groups[name];
+            for (var i = 0; i < selectors.length; i++) {
+                var element = null;
+                try { element = document.querySelector(selectors[i]); } catch (e) {}
+                if (!element) continue;
+                var visible = !!(element.offsetWidth || element.offsetHeight || element.getClientRects().length)
+                    && window.getComputedStyle(element).visibility !== 'hidden';
+                var enabled = !element.disabled && element.getAttribute('aria-disabled') !== 'true';
+                var hit = {selector: selectors[i], visible: visible, enabled: enabled, element: element};
+                if (textGroups.indexOf(name) !== -1) hit.text = (element.innerText || '').slice(0, 300);
+                hits.push(hit);
+                if (stopAtFirst && visible && enabled) break;
+            }
+            result[name] = hits;
+        });
+        return result;
+    """
+    
+    def __init__(self, bot):
+        self.bot = bot
+        self.preferred = {}
+        self.round_trips = 0
+    
+    def ordered(self, group):
+        selectors = SELECTORS[group]
+        preferred = self.preferred.get(group)
+        if preferred:
+            return [preferred] + [selector for selector in selectors if selector != preferred]
+        return selectors
+    
+    def run(self, *groups, stop_at_first=True, text_groups=()):
+        """Probe the named groups; returns {group: [{'selector', 'visible', 'enabled', 'element'}, ...]}
+        
+        Hits in text_groups also carry the element's (truncated) innerText.
+        """
+        self.round_trips += 1
+        result = self.bot.driver.execute_script(
+            self.PROBE_SCRIPT,
+            {group: self.ordered(group) for group in groups},
+            stop_at_first,
+            list(text_groups)
+        ) or {}
+        
+        for group in groups:
+            result.setdefault(group, [])
+            hit = self.first_hit(result[group], actionable=True)
+            if hit:
+                self.preferred[group] = hit['selector']
+        return result
+    
+    @staticmethod
+    def first_hit(hits, actionable=False, visible=False):
+        for hit in hits:
+            if actionable and not (hit['visible'] and hit['enabled']):
+                continue
+            if visible and not hit['visible']:
+                continue
+            return hit
+        return None
+    
+    @classmethod
+    def element(cls, result, group, actionable=True, visible=False):
+        """Element of the first matching hit in a probe result, or None"""
+        hit = cls.first_hit(result.get(group, []), actionable=actionable, visible=visible)
+        return hit['element'] if hit else None
+    
+    def stats(self):
+        return {'round_trips': self.round_trips, 'preferred': dict(self.preferred)}
+
+class ResourcePolicy:
+    """Optional lean browsing (LEAN_BROWSING=1): Chrome skips images, media and fonts a send bot never looks at"""
+    
+    RESOURCE_TYPES = ('Image', 'Media', 'Font')
+    # 1x1 transparent GIF served for blocked images, so the page sees them load
+    BLANK_GIF = 'R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'
+    
     def __init__(self):
+        self.enabled = os.environ.get('LEAN_BROWSING', '').lower() in ('1', 'true', 'yes')
+        configured = [t.strip() for t in os.environ.get('BLOCK_RESOURCE_TYPES', 'Image,Media,Font').split(',') if t.strip()]
+        for resource_type in configured:
+            if resource_type not in self.RESOURCE_TYPES:
+                logger.warning(f"Lean browsing cannot block resource type {resource_type}, ignoring it")
+        self.resource_types = [t for t in configured if t in self.RESOURCE_TYPES]
+        # Extra URL patterns, blocked through Network.setBlockedURLs whatever their type
+        self.patterns = [p.strip() for p in os.environ.get('BLOCK_URL_PATTERNS', '').split(',') if p.strip()]
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        self.session_started = time.time()
+        self.blocked = {}
+        self.requests_loaded = 0
+        self.bytes_loaded = 0
+        self.intercepting = False
+    
+    def configure(self, options):
+        """Ask chromedriver for network events in the performance log"""
+        if not self.enabled:
+            return
+        options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+    
+    def apply(self, driver):
+        """Start blocking on a freshly started browser, before it loads WhatsApp Web"""
+        if not self.enabled:
+            return
+        self.reset()
+        try:
+            driver.execute_cdp_cmd('Network.enable', {})
+            if self.patterns:
+                driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': self.patterns})
+        except Exception as e:
+            logger.warning(f"Could not install the URL block list: {e}")
+        if self.resource_types:
+            self.start_interceptor(driver)
+        logger.info(f"Lean browsing: blocking {', '.join(self.resource_types) or 'no resource types'}"
+                    f" and {len(self.patterns)} URL patterns")
+    
+    def start_interceptor(self, driver):
+        """Pause requests of the blocked types over a DevTools connection of our own and answer them
+        
+        execute_cdp_cmd cannot receive the Fetch.requestPaused events, so a
+        thread holds a second DevTools session on the page. If it goes away,
+        Chrome drops the interception with it and requests load normally.
+        """
+        if not trio_websocket:
+            logger.warning("Lean browsing needs trio-websocket (installed with selenium 4) to block by resource type")
+            return
+        try:
+            address = driver.capabilities['goog:chromeOptions']['debuggerAddress']
+            with urllib.request.urlopen(f"http://{address}/json/list", timeout=5) as response:
+                targets = json.load(response)
+            ws_url = next(target['webSocketDebuggerUrl'] for target in targets if target.get('type') == 'page')
+        except Exception as e:
+            logger.warning(f"Could not reach the page's DevTools endpoint, resource types are not blocked: {e}")
+            return
+        
+        ready = threading.Event()
+        threading.Thread(target=self.intercept, args=(ws_url, ready), name='resource-interceptor', daemon=True).start()
+        if not ready.wait(5) or not self.intercepting:
+            logger.warning("Resource interception did not start; resource types are not blocked")
+    
+    def intercept(self, ws_url, ready):
+        try:
+            trio.run(self.serve_interception, ws_url, ready)
+        except Exception as e:
+            # Normally the browser quitting and closing the connection
+            logger.debug(f"Resource interception ended: {e}")
+        finally:
+            self.intercepting = False
+            ready.set()
+    
+    async def serve_interception(self, ws_url, ready):
+        async with trio_websocket.open_websocket_url(ws_url) as ws:
+            # http* leaves data: and blob: URLs (such as attachment previews) alone
+            patterns = [{'urlPattern': 'http*', 'resourceType': t, 'requestStage': 'Request'} for t in self.resource_types]
+            await ws.send_message(json.dumps({'id': 0, 'method': 'Fetch.enable', 'params': {'patterns': patterns}}))
+            command_id = 0
+            while True:
+                message = json.loads(await ws.get_message())
+                if message.get('id') == 0:
+                    if 'error' in message:
+                        raise RuntimeError(message['error'].get('message'))
+                    self.intercepting = True
+                    ready.set()
+                elif message.get('method') == 'Fetch.requestPaused':
+                    command_id += 1
+                    await ws.send_message(json.dumps(self.block(command_id, message['params'])))
+    
+    def block(self, command_id, paused):
+        """DevTools command answering one paused request: a blank image, or a failure for media and fonts"""
+        resource_type = paused.get('resourceType', 'Other')
+        with self.lock:
+            self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+        metrics.inc('whatsapp_blocked_requests_total', type=resource_type)
+        if resource_type == 'Image':
+            return {'id': command_id, 'method': 'Fetch.fulfillRequest', 'params': {
+                'requestId': paused['requestId'],
+                'responseCode': 200,
+                'responseHeaders': [{'name': 'Content-Type', 'value': 'image/gif'}],
+                'body': self.BLANK_GIF
+            }}
+        return {'id': command_id, 'method': 'Fetch.failRequest',
+                'params': {'requestId': paused['requestId'], 'errorReason': 'BlockedByClient'}}
+    
+    def collect(self, driver):
+        """Drain the performance log into the counters (caller holds the bot lock)"""
+        if not self.enabled:
+            return
+        try:
+            entries = driver.get_log('performance')
+        except Exception as e:
+            logger.debug(f"Could not read performance log: {e}")
+            return
+        
+        for entry in entries:
+            try:
+                event = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            method, params = event.get('method'), event.get('params', {})
+            if method == 'Network.loadingFinished':
+                loaded = int(params.get('encodedDataLength') or 0)
+                self.requests_loaded += 1
+                self.bytes_loaded += loaded
+                metrics.inc('whatsapp_browser_loaded_bytes_total', loaded)
+            elif method == 'Network.loadingFailed' and params.get('blockedReason') == 'inspector':
+                # Matched BLOCK_URL_PATTERNS; requests blocked by type are counted in block()
+                resource_type = params.get('type', 'Other')
+                with self.lock:
+                    self.blocked[resource_type] = self.blocked.get(resource_type, 0) + 1
+                metrics.inc('whatsapp_blocked_requests_total', type=resource_type)
+    
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'resource_types': self.resource_types,
+            'intercepting': self.intercepting,
+            'patterns': len(self.patterns),
+            'session_seconds': round(time.time() - self.session_started, 3),
+            'requests_blocked': sum(self.blocked.values()),
+            'blocked_by_type': dict(self.blocked),
+            'requests_loaded': self.requests_loaded,
+            'bytes_loaded': self.bytes_loaded
+        }
+
+# Read at import so web workers and the browser owner agree on whether receipts exist
+RECEIPT_TRACKING = os.environ.get('RECEIPT_TRACKING', '').lower() in ('1', 'true', 'yes')
+
+class ReceiptTracker:
+    """Delivery ticks of sent messages, buffered in the page by a MutationObserver (RECEIPT_TRACKING=1)"""
+    
+    STATUSES = ('pending', 'sent', 'delivered', 'read')
+    # data-icon of the tick, and aria-label where WhatsApp sets one
+    ICONS = {'msg-time': 'pending', 'msg-check': 'sent', 'msg-dblcheck': 'delivered', 'msg-dblcheck-ack': 'read'}
+    LABELS = {'pending': 'pending', 'sent': 'sent', 'delivered': 'delivered', 'read': 'read'}
+    
+    # WhatsApp Web only renders the open chat, so ticks are seen while it is on screen
+    DRAIN_SCRIPT = """
+        var config = arguments[0], state = window.__whatsappReceipts;
+        if (!state) {
+            state = window.__whatsappReceipts = {events: [], seen: {}};
+            var statusOf = function (row) {
+                var icon = row.querySelector(config.status);
+                if (!icon) return null;
+                var label = (icon.getAttribute('aria-label') || '').trim().toLowerCase();
+                return config.labels[label] || config.icons[icon.getAttribute('data-icon')] || null;
+            };
+            var visit = function (row) {
+                var id = row.getAttribute('data-id'), status = statusOf(row);
+                if (!id || !status || state.seen[id] === status) return;
+                var event = {id: id, status: status, at: Date.now()};
+                if (!(id in state.seen)) event.text = (row.innerText || '').slice(0, 500);
+                state.seen[id] = status;
+                state.events.push(event);
+                if (state.events.length > config.maxEvents) state.events.shift();
+            };
+            var scan = function (node) {
+                if (node.matches && node.matches(config.message)) visit(node);
+                if (node.querySelectorAll) Array.prototype.forEach.call(node.querySelectorAll(config.message), visit);
+            };
+            scan(document.body);
+            new MutationObserver(function (mutations) {
+                mutations.forEach(function (mutation) {
+                    var element = mutation.target.nodeType === 1 ? mutation.target : mutation.target.parentElement;
+                    var row = element && element.closest(config.message);
+                    if (row) visit(row);
+                    Array.prototype.forEach.call(mutation.addedNodes, function (node) {
+                        if (node.nodeType === 1) scan(node);
+                    });
+                });
+            }).observe(document.body, {childList: true, subtree: true, attributes: true,
+                                       attributeFilter: ['data-icon', 'aria-label']});
+        }
+        var events = state.events;
+        state.events = [];
+        return events;
+    """
+    
+    def __init__(self, bot, limit=None):
+        self.bot = bot
+        self.enabled = RECEIPT_TRACKING
+        self.limit = limit or int(os.environ.get('RECEIPT_HISTORY', 5000))
+        # Sends not yet matched to a message row are given up on after this long
+        self.match_window = float(os.environ.get('RECEIPT_MATCH_WINDOW', 600))
+        self.lock = threading.Lock()
+        self.receipts = OrderedDict()
+        self.by_message = {}
+        self.unmatched = deque()
+        self.drains = 0
+        self.events = 0
+        self.config = {
+            'message': ', '.join(SELECTORS['outgoing_message']),
+            'status': ', '.join(SELECTORS['message_status']),
+            'icons': self.ICONS,
+            'labels': self.LABELS,
+            'maxEvents': 1000
+        }
+    
+    @staticmethod
+    def normalize_text(text):
+        return ' '.join((text or '').split())
+    
+    def track(self, receipt_id, phone_number, message):
+        """Start tracking a message that was just submitted"""
+        if not self.enabled:
+            return
+        now = time.time()
+        with self.lock:
+            self.receipts[receipt_id] = {
+                'id': receipt_id,
+                'phone_number': phone_number,
+                'text': self.normalize_text(message)[:100],
+                'message_id': None,
+                'status': 'pending',
+                'timestamps': {'pending': now},
+                'updated_at': now
+            }
+            self.unmatched.append(receipt_id)
+            while len(self.receipts) > self.limit:
+                _, evicted = self.receipts.popitem(last=False)
+                self.by_message.pop(evicted['message_id'], None)
+    
+    def drain(self):
+        """Collect buffered tick changes from the page in one round trip (caller holds the bot lock)"""
+        if not self.enabled or not self.bot.driver:
+            return 0
+        try:
+            events = self.bot.driver.execute_script(self.DRAIN_SCRIPT, self.config) or []
+        except Exception as e:
+            logger.debug(f"Receipt drain failed: {e}")
+            return 0
+        self.apply(events)
+        return len(events)
+    
+    def apply(self, events):
+        with self.lock:
+            self.drains += 1
+            self.events += len(events)
+            rows = [event for event in events if 'text' in event and event['id'] not in self.by_message]
+            if rows and self.unmatched:
+                self.match(rows)
+            for event in events:
+                receipt = self.receipts.get(self.by_message.get(event['id']))
+                if receipt:
+                    self.advance(receipt, event['status'], event['at'] / 1000.0)
+            self.expire()
+    
+    def match(self, events):
+        """Bind new outgoing rows (in page order) to unmatched sends, oldest first (caller holds the lock)
+        
+        When there are more candidate rows than waiting sends, as when the
+        first scan of a page also finds older messages with the same text,
+        the newest rows are the ones paired.
+        """
+        rows = []
+        for event in events:
+            chat = event['id'].split('_')[1].split('@')[0] if event['id'].count('_') >= 2 else ''
+            rows.append((event, chat, self.normalize_text(event.get('text'))))
+        
+        for receipt_id in list(self.unmatched):
+            receipt = self.receipts.get(receipt_id)
+            if not receipt:
+                continue
+            key = (recipients.digits(receipt['phone_number']), receipt['text'])
+            candidates = [row for row in rows if row[1] == key[0] and key[1] in row[2]]
+            if not candidates:
+                continue
+            waiting = sum(
+                1 for other_id in self.unmatched
+                if other_id in self.receipts and (recipients.digits(self.receipts[other_id]['phone_number']),
+                                                  self.receipts[other_id]['text']) == key
+            )
+            row = candidates[-min(len(candidates), waiting)]
+            receipt['message_id'] = row[0]['id']
+            self.by_message[row[0]['id']] = receipt_id
+            self.unmatched.remove(receipt_id)
+            rows.remove(row)
+    
+    def advance(self, receipt, status, observed_at):
+        """Move a receipt forward to status; ticks never go backwards (caller holds the lock)"""
+        if status not in self.STATUSES or self.STATUSES.index(status) <= self.STATUSES.index(receipt['status']):
+            return
+        # A tick can be first seen already past earlier states (e.g. read before sent was drained)
+        for reached in self.STATUSES[self.STATUSES.index(receipt['status']) + 1:self.STATUSES.index(status) + 1]:
+            receipt['timestamps'][reached] = observed_at
+            metrics.inc('whatsapp_receipts_total', account=self.bot.account_id, status=reached)
+            metrics.observe('whatsapp_receipt_seconds', max(0.0, observed_at - receipt['timestamps']['pending']),
+                            account=self.bot.account_id, status=reached)
+        receipt['status'] = status
+        receipt['updated_at'] = time.time()
+    
+    def expire(self):
+        now = time.time()
+        while self.unmatched:
+            receipt = self.receipts.get(self.unmatched[0])
+            if receipt and now - receipt['timestamps']['pending'] < self.match_window:
+                break
+            self.unmatched.popleft()
+    
+    def get(self, receipt_id):
+        with self.lock:
+            receipt = self.receipts.get(receipt_id)
+            return self.view(receipt) if receipt else None
+    
+    @staticmethod
+    def view(receipt):
+        return {
+            'id': receipt['id'],
+            'phone_number': receipt['phone_number'],
+            'status': receipt['status'],
+            'observed': receipt['message_id'] is not None,
+            'timestamps': dict(receipt['timestamps'])
+        }
+    
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        with self.lock:
+            counts = {status: 0 for status in self.STATUSES}
+            for receipt in self.receipts.values():
+                counts[receipt['status']] += 1
+            return {
+                'enabled': True,
+                'tracked': len(self.receipts),
+                'unmatched': len(self.unmatched),
+                'by_status': counts,
+                'drains': self.drains,
+                'events': self.events
+            }
+
+class SessionStore:
+    """Debounced, atomic, change-aware persistence of one bot's cookie jar
+    
+    The send path only marks the jar dirty. A timer then reads the cookies
+    once, and writes them as JSON through a temp file + rename, and only when
+    their hash differs from what is already on disk.
+    """
+    
+    def __init__(self, bot, path, debounce=None):
+        self.bot = bot
+        self.path = path
+        # Cookie jars written by older versions, read once and migrated to JSON
+        self.legacy_path = os.path.splitext(path)[0] + '.pkl'
+        self.debounce = debounce if debounce is not None else float(os.environ.get('COOKIE_SAVE_DEBOUNCE', 30))
+        self.lock = threading.Lock()
+        self.timer = None
+        self.dirty = False
+        self.last_hash = None
+        self.writes = 0
+        self.unchanged = 0
+        self.last_write = None
+    
+    @staticmethod
+    def fingerprint(cookies):
+        return hashlib.sha256(json.dumps(cookies, sort_keys=True).encode('utf-8')).hexdigest()
+    
+    def mark_dirty(self):
+        """Schedule a flush in `debounce` seconds; repeated calls coalesce into one write"""
+        with self.lock:
+            self.dirty = True
+            if self.timer:
+                return
+            self.timer = threading.Timer(self.debounce, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+    
+    def flush(self, blocking=False):
+        """Persist the cookies now if they changed; retried later if a send owns the driver"""
+        with self.lock:
+            self.timer = None
+        
+        if not self.bot.lock.acquire(blocking=blocking):
+            self.mark_dirty()
+            return False
+        try:
+            return self.capture()
+        finally:
+            self.bot.lock.release()
+    
+    def capture(self):
+        """Read the jar from the driver and persist it (caller holds the bot lock)"""
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+            self.dirty = False
+        
+        if not self.bot.driver:
+            return False
+        try:
+            return self.write(self.bot.driver.get_cookies())
+        except Exception as e:
+            logger.error(f"Error saving cookies: {e}")
+            return False
+    
+    def write(self, cookies):
+        cookie_hash = self.fingerprint(cookies)
+        if cookie_hash == self.last_hash:
+            self.unchanged += 1
+            return False
+        
+        storage.atomic_write_json(self.path, cookies)
+        
+        self.last_hash = cookie_hash
+        self.writes += 1
+        self.last_write = time.time()
+        logger.info("Cookies saved successfully")
+        return True
+    
+    def load(self):
+        """Saved cookies, or an empty list"""
+        try:
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    cookies = json.load(f)
+            elif os.path.exists(self.legacy_path):
+                import pickle
+                with open(self.legacy_path, 'rb') as f:
+                    cookies = pickle.load(f)
+                self.write(cookies)
+                logger.info(f"Migrated {self.legacy_path} to {self.path}")
+            else:
+                return []
+        except Exception as e:
+            logger.error(f"Error reading cookies: {e}")
+            return []
+        
+        self.last_hash = self.fingerprint(cookies)
+        return cookies
+    
+    def stats(self):
+        return {
+            'dirty': self.dirty,
+            'writes': self.writes,
+            'unchanged': self.unchanged,
+            'last_write': self.last_write
+        }
+
+class WhatsAppBot:
+    # The QR container carries the encoded login payload in data-ref, which changes on every rotation
+    QR_FINGERPRINT_SCRIPT = """
+        var element = arguments[0];
+        var holder = element.closest('[data-ref]');
+        return {
+            ref: holder ? holder.getAttribute('data-ref') : null,
+            canvas: element.tagName === 'CANVAS' ? element : element.querySelector('canvas')
+        };
+    """
+    
+    DISMISS_POPUP_SCRIPT = """
+        var button = document.querySelector("div[data-animate-modal-popup='true'] button, div[role='dialog'] button");
+        if (button) button.click();
+    """
+    
+    # Clicks the popup button whose text matches arguments[0], making this tab the active WhatsApp Web tab
+    TAKE_OVER_SCRIPT = """
+        var pattern = new RegExp(arguments[0], 'i');
+        var buttons = document.querySelectorAll("div[data-animate-modal-popup='true'] button, div[role='dialog'] button");
+        for (var i = 0; i < buttons.length; i++) {
+            if (pattern.test(buttons[i].innerText || '')) { buttons[i].click(); return true; }
+        }
+        return false;
+    """
+    
+    # Inserts text the way a paste would, for captions ChromeDriver cannot type (emoji outside the BMP)
+    INSERT_TEXT_SCRIPT = """
+        arguments[0].focus();
+        document.execCommand('insertText', false, arguments[1]);
+    """
+    
+    # Clicks the search result titled with exactly the number (names, groups and partial
+    # digit runs never match); otherwise returns the titles shown, so the caller can tell
+    # when the results have settled without a match
+    CLICK_CHAT_RESULT_SCRIPT = """
+        var digits = arguments[0], config = arguments[1];
+        var rows = document.querySelectorAll(config.rows), titles = [];
+        for (var i = 0; i < rows.length; i++) {
+            var title = rows[i].querySelector(config.title);
+            var text = title ? (title.getAttribute('title') || title.innerText || '').trim() : '';
+            titles.push(text);
+            if (/^\\+?[\\d\\s().-]+$/.test(text) && text.replace(/\\D/g, '') === digits) {
+                ['mousedown', 'mouseup', 'click'].forEach(function (type) {
+                    rows[i].dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, view: window}));
+                });
+                return {clicked: true, titles: ''};
+            }
+        }
+        return {clicked: false, titles: titles.join('\\n')};
+    """
+    
+    def __init__(self, account_id='default', user_data_dir=None, cookies_file=None):
+        self.account_id = account_id
         self.driver = None
         self.wait = None
         self.is_logged_in = False
         self.lock = threading.Lock()
         self.session_file = "whatsapp_session.json"
-        self.user_data_dir = os.path.join(os.getcwd(), 'chrome_user_data')
-        self.cookies_file = "whatsapp_cookies.pkl"
+        self.user_data_dir = user_data_dir or os.path.join(os.getcwd(), 'chrome_user_data')
+        self.cookies_file = cookies_file or "whatsapp_cookies.json"
+        self.profile = profiles.ProfileSnapshot(self.user_data_dir)
+        self.session_store = SessionStore(self, self.cookies_file)
+        self.resource_policy = ResourcePolicy()
+        self.receipts = ReceiptTracker(self)
+        self.inbound = InboundListener(self)
         self.last_phone_number = None
         self.cloud_environment = self.detect_cloud_environment()
+        self.probe = DomProbe(self)
+        self.login_watcher = None
+        self.supervisor = None
+        self.invalid_numbers = None
+        self.attachments = None
+        self.outbox = None
+        self.governor = None
+        self.driver_started_at = None
+        # The last restart_driver launch failed, so the next one is a retry that backs off
+        self.launch_failed = False
+        self.warmup = {'stage': 'idle', 'started_at': None, 'finished_at': None, 'error': None, 'timings': {}}
+        # Last captured QR; the image is only re-encoded when the fingerprint changes
+        self.qr_state = {'fingerprint': None, 'image': None, 'captured_at': None, 'rotations': 0}
+        
+        # Upper bounds (seconds) for readiness waits; each wait returns as soon as the page is ready
+        self.wait_poll_interval = float(os.environ.get('WAIT_POLL_INTERVAL', 0.25))
+        self.wait_timeouts = {
+            'page_load': float(os.environ.get('WAIT_PAGE_LOAD_TIMEOUT', 30)),
+            'login': float(os.environ.get('WAIT_LOGIN_TIMEOUT', 30)),
+            'qr': float(os.environ.get('WAIT_QR_TIMEOUT', 20)),
+            'compose': float(os.environ.get('WAIT_COMPOSE_TIMEOUT', 30)),
+            'send_confirm': float(os.environ.get('WAIT_SEND_CONFIRM_TIMEOUT', 10)),
+            # Covers the preview opening and the upload finishing after send
+            'attachment': float(os.environ.get('WAIT_ATTACHMENT_TIMEOUT', 60))
+        }
+        # How long the compose box may sit without a send button before typing manually
+        self.send_button_grace = float(os.environ.get('WAIT_SEND_BUTTON_GRACE', 2))
+        self.wait_stats = {}
+        self.wait_stats_lock = threading.Lock()
+        
+        # Open chats inside the loaded app instead of reloading WhatsApp Web per message
+        self.fast_chat_switch = os.environ.get('FAST_CHAT_SWITCH', '1').lower() not in ('0', 'false', 'no')
+        self.wait_timeouts['chat_search'] = float(os.environ.get('WAIT_CHAT_SEARCH_TIMEOUT', 5))
+        # Results unchanged this long without an exact match count as a miss
+        self.chat_search_settle = float(os.environ.get('WAIT_CHAT_SEARCH_SETTLE', 0.75))
+        # Only numbers whose chat is titled with the number are searched; the rest navigate by URL
+        chat_index_path = os.environ.get('CHAT_INDEX_PATH', 'whatsapp_chat_index.json')
+        if chat_index_path and account_id != 'default':
+            root, ext = os.path.splitext(chat_index_path)
+            chat_index_path = f"{root}_{account_id}{ext}"
+        self.chat_index = recipients.ChatIndex(chat_index_path)
+        self.search_config = {
+            'rows': ', '.join(SELECTORS['chat_list_item']),
+            'title': ', '.join(SELECTORS['chat_list_title'])
+        }
+        self.chat_switch_stats = {'in_app': 0, 'navigation': 0, 'in_app_failures': 0, 'open_chat': 0}
+        self.send_path = None
+        # Called just before the message is submitted, so callers can journal that it may be on its way
+        self.on_submit = None
+        
+        # Type straight into the chat the previous send left open when the next message has the same recipient
+        self.chat_affinity = os.environ.get('CHAT_AFFINITY', '1').lower() not in ('0', 'false', 'no')
+        # State of last_phone_number's chat after a confirmed send: {'title': header text}, or None if unknown
+        self.open_chat = None
+        self.chat_title = None
         
     def detect_cloud_environment(self):
         """Detect if running in cloud environment"""
@@ -53,20 +1022,8 @@ class WhatsAppBot:
         
     def setup_driver(self):
         """Setup Chrome driver with proper cloud/local detection"""
-        try:
-            # Import selenium modules
-            from selenium import webdriver
-            from selenium.webdriver.chrome.options import Options
-            from selenium.webdriver.common.by import By
-            from selenium.webdriver.support.ui import WebDriverWait
-            from selenium.webdriver.support import expected_conditions as EC
-            from selenium.common.exceptions import TimeoutException, WebDriverException, NoSuchElementException
-            from selenium.webdriver.common.keys import Keys
-            from selenium.webdriver.common.action_chains import ActionChains
-            import pickle
-            
-        except ImportError as e:
-            logger.error(f"Selenium not installed: {e}")
+        if not SELENIUM_AVAILABLE:
+            logger.error(f"Selenium not installed: {SELENIUM_IMPORT_ERROR}")
             return False
         
         options = Options()
@@ -103,28 +1060,40 @@ class WhatsAppBot:
         options.add_experimental_option("excludeSwitches", ["enable-automation"])
         options.add_experimental_option('useAutomationExtension', False)
         
-        # Session persistence
-        if not os.path.exists(self.user_data_dir):
-            os.makedirs(self.user_data_dir)
+        # Session persistence (restored onto tmpfs when PROFILE_SNAPSHOT=1)
+        user_data_dir = self.profile.launch_dir()
+        if not os.path.exists(user_data_dir):
+            os.makedirs(user_data_dir)
         
-        options.add_argument(f'--user-data-dir={self.user_data_dir}')
+        options.add_argument(f'--user-data-dir={user_data_dir}')
         options.add_argument('--profile-directory=WhatsAppBot')
         
         # User agent
         options.add_argument('--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
         
+        self.resource_policy.configure(options)
+        
         try:
+            self.profile.launching()
             self.driver = webdriver.Chrome(options=options)
             self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
+            metrics.observe('whatsapp_browser_launch_seconds', self.profile.launched(),
+                            account=self.account_id, profile=self.profile.mode)
+            self.resource_policy.apply(self.driver)
             
-            # Import WebDriverWait here after driver is created
-            from selenium.webdriver.support.ui import WebDriverWait
             wait_time = 30 if self.cloud_environment else 15
-            self.wait = WebDriverWait(self.driver, wait_time)
+            self.wait = WebDriverWait(
+                self.driver,
+                wait_time,
+                poll_frequency=self.wait_poll_interval,
+                ignored_exceptions=[StaleElementReferenceException]
+            )
             
             # Set page load timeout
             self.driver.set_page_load_timeout(60)
             
+            self.driver_started_at = time.time()
+            
             # Load saved cookies if they exist
             self.load_cookies()
             
@@ -136,27 +1105,18 @@ class WhatsAppBot:
             return False
     
     def save_cookies(self):
-        """Save cookies to maintain session"""
-        try:
-            import pickle
-            if self.driver:
-                cookies = self.driver.get_cookies()
-                with open(self.cookies_file, 'wb') as f:
-                    pickle.dump(cookies, f)
-                logger.info("Cookies saved successfully")
-        except Exception as e:
-            logger.error(f"Error saving cookies: {e}")
+        """Mark the session dirty; the session store persists it in the background"""
+        with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='cookie_save'):
+            self.session_store.mark_dirty()
     
     def load_cookies(self):
         """Load saved cookies"""
         try:
-            import pickle
-            if os.path.exists(self.cookies_file) and self.driver:
-                self.driver.get("https://web.whatsapp.com")
-                time.sleep(2)
-                
-                with open(self.cookies_file, 'rb') as f:
-                    cookies = pickle.load(f)
+            cookies = self.session_store.load()
+            if cookies and self.driver:
+                self.open_chat = None
+                self.driver.get(WHATSAPP_WEB_URL)
+                self.wait_until('page_load', self.document_ready)
                 
                 for cookie in cookies:
                     try:
@@ -168,53 +1128,161 @@ class WhatsAppBot:
         except Exception as e:
             logger.error(f"Error loading cookies: {e}")
     
-    def is_whatsapp_loaded(self):
-        """Check if WhatsApp is loaded and ready"""
+    def wait_until(self, name, condition, timeout=None):
+        """Wait for condition(driver) to become truthy, bounded by the named timeout
+        
+        Returns the condition's value, or None on timeout. Every wait records how
+        long it actually took so the bounds can be tuned from /wait_stats.
+        """
+        timeout = timeout or self.wait_timeouts.get(name)
+        if timeout:
+            waiter = WebDriverWait(
+                self.driver,
+                timeout,
+                poll_frequency=self.wait_poll_interval,
+                ignored_exceptions=[StaleElementReferenceException]
+            )
+        else:
+            waiter = self.wait
+        
+        started = time.time()
         try:
-            from selenium.webdriver.common.by import By
-            indicators = [
-                "[data-testid='side']",
-                "#side",
-                "div[data-testid='chat-list']",
-                "header[data-testid='chatlist-header']",
-                "[data-testid='chat-list-search']"
-            ]
+            result = waiter.until(condition)
+        except TimeoutException:
+            result = None
+        elapsed = time.time() - started
+        
+        self.record_wait(name, elapsed, result is not None)
+        if result is None:
+            logger.warning(f"Wait '{name}' timed out after {elapsed:.2f}s")
+        return result
+    
+    def record_wait(self, name, elapsed, satisfied):
+        """Keep a bounded history of wait durations per wait name"""
+        with self.wait_stats_lock:
+            stats = self.wait_stats.get(name)
+            if not stats:
+                stats = self.wait_stats[name] = {'durations': deque(maxlen=200), 'count': 0, 'timeouts': 0}
+            stats['durations'].append(elapsed)
+            stats['count'] += 1
+            if not satisfied:
+                stats['timeouts'] += 1
+        metrics.observe('whatsapp_wait_seconds', elapsed, account=self.account_id, wait=name)
+    
+    def wait_summary(self):
+        """Count, timeouts and p50/p95/max durations for each named wait"""
+        summary = {}
+        with self.wait_stats_lock:
+            for name, stats in self.wait_stats.items():
+                durations = sorted(stats['durations'])
+                summary[name] = {
+                    'count': stats['count'],
+                    'timeouts': stats['timeouts'],
+                    'timeout_bound': self.wait_timeouts.get(name),
+                    'p50': round(durations[len(durations) // 2], 3),
+                    'p95': round(durations[min(len(durations) - 1, int(len(durations) * 0.95))], 3),
+                    'max': round(durations[-1], 3)
+                }
+        return summary
+    
+    @staticmethod
+    def document_ready(driver):
+        return driver.execute_script("return document.readyState") == 'complete'
+    
+    def find_actionable(self, group):
+        """First visible and enabled element for a selector group, or None"""
+        return DomProbe.element(self.probe.run(group), group)
+    
+    def login_state(self, driver):
+        """'logged_in' or 'qr' once WhatsApp Web has rendered either screen, else False"""
+        found = self.probe.run('logged_in', 'qr')
+        if found['logged_in']:
+            return 'logged_in'
+        if DomProbe.element(found, 'qr', actionable=False, visible=True):
+            return 'qr'
+        return False
+    
+    def compose_ready(self, prefilled=True):
+        """Condition for a freshly opened chat: ('send', button), ('input', box), ('invalid', None) or ('logged_out', None)
+        
+        The send button is preferred because the URL pre-fills the text. The
+        compose box alone is only accepted after send_button_grace seconds, so
+        the keyboard fallback does not type the message a second time. Chats
+        opened without text (prefilled=False) are ready as soon as the box is.
+        """
+        input_seen_at = []
+        
+        def condition(driver):
+            found = self.probe.run(
+                'send_button', 'message_input', 'qr', 'invalid_number',
+                stop_at_first=False, text_groups=('invalid_number',)
+            )
             
-            for indicator in indicators:
-                if self.driver.find_elements(By.CSS_SELECTOR, indicator):
-                    return True
+            # WhatsApp Web open in another tab or window asks this one to take over first
+            if any(USE_HERE_TEXT.search(hit.get('text') or '') for hit in found['invalid_number']):
+                driver.execute_script(self.TAKE_OVER_SCRIPT, USE_HERE_TEXT.pattern)
+                # The page reloads its state, so no previously verified chat can be trusted
+                self.open_chat = None
+                return False
+            
+            # WhatsApp answers /send?phone= for a number without an account with a popup
+            if any(recipients.is_invalid_number_notice(hit.get('text')) for hit in found['invalid_number']):
+                return 'invalid', None
+            
+            send_button = DomProbe.element(found, 'send_button')
+            if send_button:
+                return 'send', send_button
+            
+            message_input = DomProbe.element(found, 'message_input')
+            if message_input and not prefilled:
+                return 'input', message_input
+            if message_input:
+                if not input_seen_at:
+                    input_seen_at.append(time.time())
+                if time.time() - input_seen_at[0] >= self.send_button_grace:
+                    return 'input', message_input
+                return False
+            
+            # A bare <canvas> can appear inside chats too, so only trust the specific QR selectors
+            if any(hit['selector'] != 'canvas' for hit in found['qr']):
+                return 'logged_out', None
+            return False
+        
+        return condition
+    
+    def send_button_gone(self, driver):
+        """True once the send button has disappeared, i.e. the compose box was submitted
+        
+        The same probe reads the chat header, so the title is known for the next send.
+        """
+        found = self.probe.run('send_button', 'chat_header', text_groups=('chat_header',))
+        if DomProbe.element(found, 'send_button'):
             return False
+        header = DomProbe.first_hit(found['chat_header'], visible=True)
+        self.chat_title = self.header_title(header) if header else None
+        return True
+    
+    @staticmethod
+    def header_title(hit):
+        return (hit.get('text') or '').strip().split('\n')[0]
+    
+    def is_whatsapp_loaded(self):
+        """Check if WhatsApp is loaded and ready"""
+        try:
+            return bool(self.probe.run('app_loaded')['app_loaded'])
         except:
             return False
     
     def quick_login_check(self):
         """Enhanced login status check"""
         try:
-            from selenium.webdriver.common.by import By
             current_url = self.driver.current_url
-            if "web.whatsapp.com" in current_url:
-                logged_in_indicators = [
-                    "[data-testid='side']",
-                    "[data-testid='chat-list']",
-                    "div[data-testid='chatlist-header']",
-                    "#side",
-                    "div[role='textbox']"
-                ]
-                
-                for indicator in logged_in_indicators:
-                    if self.driver.find_elements(By.CSS_SELECTOR, indicator):
-                        return True
-                
-                qr_indicators = [
-                    "[data-testid='qr-code']",
-                    "canvas[role='img']",
-                    "canvas"
-                ]
-                
-                for qr_indicator in qr_indicators:
-                    if self.driver.find_elements(By.CSS_SELECTOR, qr_indicator):
-                        return False
-                
+            if WHATSAPP_WEB_HOST in current_url:
+                found = self.probe.run('logged_in', 'qr')
+                if found['logged_in']:
+                    return True
+                if found['qr']:
+                    return False
                 return True
             
             return False
@@ -225,7 +1293,7 @@ class WhatsAppBot:
     def ensure_logged_in(self):
         """Ensure we're logged in with better session handling"""
         try:
-            if not self.is_driver_alive():
+            if not self.driver_alive():
                 logger.info("Driver not alive, restarting...")
                 if not self.restart_driver():
                     return False, "Failed to restart browser driver"
@@ -237,46 +1305,37 @@ class WhatsAppBot:
             try:
                 current_url = self.driver.current_url if self.driver else ""
             except Exception as url_error:
+                # The cached heartbeat was stale and the browser is gone
                 logger.warning(f"Could not get current URL: {url_error}")
+                if not self.restart_driver():
+                    return False, "Failed to restart browser driver"
                 current_url = ""
             
-            if "web.whatsapp.com" in current_url:
-                if self.quick_login_check():
+            if WHATSAPP_WEB_HOST in current_url:
+                if self.login_state(self.driver) == 'logged_in':
                     self.is_logged_in = True
+                    self.report_login_state('logged_in', "Logged in successfully")
                     return True, "Already logged in"
-            
-            if "web.whatsapp.com" not in current_url:
+            else:
                 logger.info("Navigating to WhatsApp Web...")
+                self.open_chat = None
                 try:
-                    self.driver.get("https://web.whatsapp.com")
-                    time.sleep(5)
+                    self.driver.get(WHATSAPP_WEB_URL)
                 except Exception as nav_error:
                     logger.error(f"Navigation error: {nav_error}")
                     return False, f"Navigation error: {str(nav_error)}"
             
-            if self.quick_login_check():
+            # Wait for the chat list or the QR screen instead of judging a half-loaded page
+            state = self.wait_until('login', self.login_state)
+            
+            if state == 'logged_in':
                 self.is_logged_in = True
+                self.report_login_state('logged_in', "Logged in successfully")
                 self.save_cookies()
                 return True, "Logged in successfully"
             
-            # Check for QR code
-            from selenium.webdriver.common.by import By
-            qr_present = False
-            qr_selectors = [
-                "[data-testid='qr-code']",
-                "canvas[role='img']",
-                "canvas"
-            ]
-            
-            for selector in qr_selectors:
-                try:
-                    if self.driver.find_elements(By.CSS_SELECTOR, selector):
-                        qr_present = True
-                        break
-                except:
-                    continue
-            
-            if qr_present:
+            if state == 'qr':
+                self.report_login_state('qr', "Please scan QR code to login")
                 return False, "Please scan QR code to login"
             
             return False, "Login status unclear"
@@ -286,51 +1345,37 @@ class WhatsAppBot:
             return False, f"Login error: {str(e)}"
     
     def capture_qr_code(self):
-        """Capture QR code as base64 image"""
+        """Capture QR code as base64 image
+        
+        Only the QR element's pixels are read (canvas.toDataURL, or an element
+        screenshot), and only when its fingerprint differs from the last capture.
+        """
         try:
-            from selenium.webdriver.common.by import By
-            from PIL import Image
-            
-            qr_selectors = [
-                "[data-testid='qr-code']",
-                "canvas[role='img']",
-                "canvas"
-            ]
-            
-            qr_element = None
-            for selector in qr_selectors:
-                try:
-                    elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                    if elements and elements[0].is_displayed():
-                        qr_element = elements[0]
-                        break
-                except:
-                    continue
+            qr_element = DomProbe.element(self.probe.run('qr'), 'qr', actionable=False, visible=True)
             
             if qr_element:
-                # Get the QR code element location and size
-                location = qr_element.location
-                size = qr_element.size
-                
-                # Take a screenshot of the entire page
-                screenshot = self.driver.get_screenshot_as_png()
+                info = self.driver.execute_script(self.QR_FINGERPRINT_SCRIPT, qr_element) or {}
+                fingerprint = info.get('ref')
                 
-                # Open the screenshot with PIL
-                image = Image.open(BytesIO(screenshot))
+                if fingerprint and fingerprint == self.qr_state['fingerprint']:
+                    metrics.inc('whatsapp_qr_captures_total', account=self.account_id, result='cached')
+                    return True, self.qr_state['image']
                 
-                # Calculate the crop area
-                left = location['x']
-                top = location['y']
-                right = location['x'] + size['width']
-                bottom = location['y'] + size['height']
-                
-                # Crop the QR code area
-                qr_image = image.crop((left, top, right, bottom))
+                if info.get('canvas'):
+                    qr_base64 = self.driver.execute_script(
+                        "return arguments[0].toDataURL('image/png').split(',')[1];", info['canvas'])
+                else:
+                    qr_base64 = qr_element.screenshot_as_base64
                 
-                # Convert to base64
-                buffered = BytesIO()
-                qr_image.save(buffered, format="PNG")
-                qr_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                metrics.inc('whatsapp_qr_captures_total', account=self.account_id, result='captured')
+                fingerprint = fingerprint or hashlib.sha1(qr_base64.encode('ascii')).hexdigest()
+                if fingerprint != self.qr_state['fingerprint']:
+                    self.qr_state = {
+                        'fingerprint': fingerprint,
+                        'image': qr_base64,
+                        'captured_at': time.time(),
+                        'rotations': self.qr_state['rotations'] + 1
+                    }
                 
                 return True, qr_base64
             
@@ -340,157 +1385,688 @@ class WhatsAppBot:
             logger.error(f"Error capturing QR code: {e}")
             return False, f"Error capturing QR code: {str(e)}"
     
-    def send_message(self, phone_number, message):
-        """Send WhatsApp message with real functionality"""
+    def clear_qr(self):
+        self.qr_state = dict(self.qr_state, fingerprint=None, image=None, captured_at=None)
+    
+    def send_message(self, phone_number, message, attachment_id=None, receipt_id=None, on_submit=None):
+        """Send WhatsApp message with real functionality
+        
+        With attachment_id the stored file is sent and message becomes its caption.
+        A text sent with receipt_id can then be followed through self.receipts.
+        on_submit is called right before ENTER or the send click.
+        """
+        waiting = time.monotonic()
         with self.lock:
+            started = time.monotonic()
+            metrics.observe('whatsapp_lock_wait_seconds', started - waiting, account=self.account_id)
             try:
-                if not phone_number or not phone_number.strip():
-                    return False, "Phone number is required"
+                phone_number, phone_error = recipients.normalize(phone_number)
+                if phone_error:
+                    return False, phone_error
                 
-                phone_number = phone_number.strip()
+                session_ok, session_msg = self.prepare_session(None if attachment_id else phone_number)
+                if not session_ok:
+                    metrics.inc('whatsapp_messages_total', account=self.account_id, result='session_error', path='none')
+                    return False, session_msg
                 
-                # Import required modules
-                from selenium.webdriver.common.by import By
-                from selenium.webdriver.common.keys import Keys
-                from selenium.webdriver.common.action_chains import ActionChains
-                from selenium.webdriver.support.ui import WebDriverWait
-                from selenium.webdriver.support import expected_conditions as EC
+                success, result = self.deliver_message(phone_number, message, attachment_id=attachment_id,
+                                                       receipt_id=receipt_id, on_submit=on_submit)
+                metrics.observe('whatsapp_send_seconds', time.monotonic() - started, account=self.account_id)
+                return success, result
                 
-                if not self.is_driver_alive():
-                    logger.info("Driver not alive, restarting...")
-                    if not self.restart_driver():
-                        return False, "Failed to restart browser driver"
-                
-                login_success, login_msg = self.ensure_logged_in()
-                if not login_success:
-                    return False, login_msg
-                
-                # Clean and encode the message and phone number
-                clean_number = phone_number.replace("+", "").replace(" ", "").replace("-", "").replace("(", "").replace(")", "")
-                encoded_message = quote(message)
-                api_url = f"https://web.whatsapp.com/send?phone={clean_number}&text={encoded_message}"
+            except Exception as e:
+                logger.error(f"Error in send_message: {e}")
+                return False, f"Error: {str(e)}"
+    
+    def send_bulk(self, rows, attachment_id=None, idempotency_key=None):
+        """Send many messages through one logged-in session, yielding a result per row
+        
+        rows yields dicts with 'row', 'phone_number', 'message' and optionally an
+        'error' from validation. Liveness and login are checked once up front and
+        only re-checked after a row fails, instead of once per message. An
+        attachment_id sends the same stored file to every row, captioned with
+        the row's message. With an outbox every row is journalled like a queued
+        job, keyed by the row's own idempotency_key or "<idempotency_key>:<row>",
+        and rows whose key is already held are skipped as duplicates.
+        """
+        waiting = time.monotonic()
+        with self.lock:
+            metrics.observe('whatsapp_lock_wait_seconds', time.monotonic() - waiting, account=self.account_id)
+            session_ready = False
+            sent = failed = duplicates = 0
+            started = time.time()
+            
+            for row in rows:
+                result = {'row': row.get('row'), 'phone_number': row.get('phone_number')}
                 
-                logger.info(f"Navigating to: {api_url}")
+                if row.get('error'):
+                    result.update(status='error', message=row['error'])
+                    failed += 1
+                    yield result
+                    continue
                 
+                row_started = time.time()
+                journalled = False
+                submitted = []
                 try:
-                    self.driver.get(api_url)
-                    time.sleep(5)
-                except Exception as nav_error:
-                    logger.error(f"Navigation error: {nav_error}")
-                    return False, f"Navigation error: {str(nav_error)}"
-                
-                # Check if we're still logged in
-                if not self.quick_login_check():
-                    return False, "Lost login session - please login again"
-                
-                # Wait for page to load
-                time.sleep(3)
-                
-                # Enhanced send button detection
-                send_button_selectors = [
-                    "[data-testid='send']",
-                    "[data-icon='send']",
-                    "button[data-testid='send']",
-                    "span[data-testid='send']",
-                    "button[aria-label='Send']",
-                    "span[data-icon='send']",
-                    "button[title='Send']"
-                ]
-                
-                send_button = None
-                for selector in send_button_selectors:
-                    try:
-                        elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                        if elements:
-                            send_button = elements[0]
-                            if send_button.is_displayed() and send_button.is_enabled():
-                                break
-                    except:
-                        continue
-                
-                if send_button:
-                    try:
-                        # Try JavaScript click first
-                        self.driver.execute_script("arguments[0].click();", send_button)
-                        time.sleep(2)
-                        
-                        self.last_phone_number = phone_number
-                        self.save_cookies()
-                        logger.info(f"Message sent successfully to {phone_number}")
-                        return True, f"Message sent successfully to {phone_number}"
-                        
-                    except Exception as click_error:
-                        logger.error(f"Error clicking send button: {click_error}")
-                
-                # Fallback: keyboard method
-                message_input_selectors = [
-                    "[data-testid='conversation-compose-box-input']",
-                    "div[contenteditable='true'][data-tab='10']",
-                    "[data-testid='compose-box-input']"
-                ]
-                
-                message_input = None
-                for selector in message_input_selectors:
-                    try:
-                        elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                        if elements:
-                            message_input = elements[0]
-                            if message_input.is_displayed() and message_input.is_enabled():
-                                break
-                    except:
+                    if self.supervisor and self.supervisor.recycle_reason:
+                        session_ready = False
+                    if not session_ready:
+                        session_ready, session_msg = self.prepare_session()
+                        if not session_ready:
+                            metrics.inc('whatsapp_messages_total', account=self.account_id,
+                                        result='session_error', path='none')
+                            result.update(status='error', message=session_msg)
+                            failed += 1
+                            yield result
+                            continue
+                    
+                    recipient_error = self.recipient_error(row['phone_number'])
+                    if recipient_error:
+                        result.update(status='error', message=recipient_error)
+                        failed += 1
+                        yield result
                         continue
+                    
+                    job_id = uuid.uuid4().hex
+                    if self.outbox:
+                        key = row.get('idempotency_key') or (f"{idempotency_key}:{row['row']}" if idempotency_key else None)
+                        existing_id = self.outbox.insert({
+                            'id': job_id, 'account': self.account_id, 'phone_number': row['phone_number'],
+                            'message': row['message'], 'attachment_id': attachment_id, 'priority': 0,
+                            'status': 'sending', 'created_at': row_started
+                        }, key)
+                        if existing_id:
+                            result.update(status='duplicate', job_id=existing_id,
+                                          message='Duplicate idempotency key; message already accepted')
+                            duplicates += 1
+                            yield result
+                            continue
+                        self.outbox.update(job_id, started_at=row_started, attempts_increment=1)
+                        journalled = True
+                        result['job_id'] = job_id
+                    
+                    def on_submit(job_id=job_id, submitted=submitted):
+                        submitted.append(True)
+                        if self.outbox:
+                            self.outbox.mark_submitted(job_id)
+                    
+                    # Taken per row actually sent, so rows skipped above cost no send slot
+                    if self.governor:
+                        result['rate_wait_seconds'] = round(self.governor.acquire(row['phone_number']) or 0.0, 3)
+                    receipt_id = job_id if self.receipts.enabled and not attachment_id else None
+                    success, message = self.deliver_message(
+                        row['phone_number'], row['message'], save_session=False, attachment_id=attachment_id,
+                        receipt_id=receipt_id, on_submit=on_submit
+                    )
+                    if success and receipt_id:
+                        result['receipt_id'] = receipt_id
+                    metrics.observe('whatsapp_send_seconds', time.time() - row_started, account=self.account_id)
+                except Exception as e:
+                    logger.error(f"Error in send_bulk row {row.get('row')}: {e}")
+                    success, message = False, f"Error: {str(e)}"
                 
-                if message_input:
-                    try:
-                        message_input.clear()
-                        message_input.click()
-                        time.sleep(1)
-                        message_input.send_keys(message)
-                        time.sleep(1)
-                        message_input.send_keys(Keys.ENTER)
-                        time.sleep(2)
-                        
-                        self.last_phone_number = phone_number
-                        self.save_cookies()
-                        logger.info(f"Message sent via keyboard to {phone_number}")
-                        return True, f"Message sent successfully to {phone_number}"
-                        
-                    except Exception as input_error:
-                        logger.error(f"Error with message input: {input_error}")
-                        return False, f"Could not send message: {str(input_error)}"
+                if journalled:
+                    self.outbox.update(job_id, result=message, finished_at=time.time(),
+                                       status='sent' if success else 'unknown' if submitted else 'failed')
                 
-                return False, "Could not find message input or send button"
+                if success:
+                    sent += 1
+                else:
+                    failed += 1
+                    # Something went wrong; verify the session before the next row
+                    session_ready = False
                 
-            except Exception as e:
-                logger.error(f"Error in send_message: {e}")
-                return False, f"Error: {str(e)}"
+                result.update(
+                    status='success' if success else 'error',
+                    message=message,
+                    seconds=round(time.time() - row_started, 3)
+                )
+                yield result
+            
+            if sent:
+                self.save_cookies()
+            
+            elapsed = time.time() - started
+            yield {
+                'summary': {
+                    'sent': sent,
+                    'failed': failed,
+                    'duplicates': duplicates,
+                    'seconds': round(elapsed, 3),
+                    'messages_per_minute': round(60.0 * sent / elapsed, 2) if elapsed else None
+                }
+            }
     
-    def is_driver_alive(self):
-        """Check if driver is still alive and responsive"""
+    def prepare_session(self, recipient=None):
+        """Make sure the driver is alive and logged in (caller holds the lock)
+        
+        When recipient's chat is still open from the previous send, finding
+        its header and compose box proves both, and the login check is skipped.
+        """
+        if self.supervisor and self.supervisor.recycle_reason and self.driver:
+            self.recycle_driver()
+        
+        if recipient and self.driver:
+            message_input = self.open_chat_input(recipient)
+            if message_input:
+                self.open_chat['input'] = message_input
+                return True, "Chat already open"
+        
+        with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='liveness'):
+            alive = self.driver_alive()
+        if not alive:
+            logger.info("Driver not alive, restarting...")
+            if not self.restart_driver():
+                return False, "Failed to restart browser driver"
+        
+        with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='login'):
+            return self.ensure_logged_in()
+    
+    def deliver_message(self, phone_number, message, save_session=True, attachment_id=None, receipt_id=None,
+                        on_submit=None):
+        """Open the chat for phone_number and send message (caller holds the lock and a ready session)"""
+        self.send_path = 'navigation'
+        # Collect ticks of the previous message while its chat is still on screen
+        self.receipts.drain()
+        if self.inbound.due():
+            self.inbound.drain()
+        self.on_submit = on_submit
         try:
-            if not self.driver:
-                return False
-            self.driver.current_url
-            return True
-        except:
+            success, result = self.deliver_message_once(phone_number, message, save_session, attachment_id)
+        finally:
+            self.on_submit = None
+        if success and self.supervisor:
+            self.supervisor.mark_alive()
+        if success and receipt_id and not attachment_id:
+            self.receipts.track(receipt_id, recipients.normalize(phone_number)[0], message)
+            # Installs the observer on this page and matches the new message row
+            self.receipts.drain()
+        metrics.inc('whatsapp_messages_total', account=self.account_id,
+                    result='success' if success else 'error', path=self.send_path)
+        return success, result
+    
+    def recipient_error(self, phone_number):
+        """Why phone_number cannot be sent to, as far as is known without opening a chat, or None"""
+        phone_number, phone_error = recipients.normalize(phone_number)
+        if phone_error:
+            return phone_error
+        if self.invalid_numbers and self.invalid_numbers.contains(phone_number):
+            return f"{phone_number} is not registered on WhatsApp"
+        return None
+    
+    def deliver_message_once(self, phone_number, message, save_session, attachment_id=None):
+        recipient_error = self.recipient_error(phone_number)
+        if recipient_error:
+            return False, recipient_error
+        
+        phone_number = recipients.normalize(phone_number)[0]
+        clean_number = recipients.digits(phone_number)
+        
+        if attachment_id:
+            attachment = self.attachments.get(attachment_id) if self.attachments else None
+            if not attachment:
+                return False, f"Unknown or expired attachment: {attachment_id}"
+            return self.deliver_attachment(phone_number, clean_number, attachment, message, save_session)
+        
+        if self.can_type(message):
+            message_input = self.open_chat_input(phone_number)
+            if message_input:
+                outcome = self.submit_typed(message_input, phone_number, message)
+                if outcome is not None:
+                    self.send_path = 'open_chat'
+                    self.chat_switch_stats['open_chat'] += 1
+                    return self.finish_send(outcome, phone_number, save_session)
+                logger.warning(f"Open-chat send failed for {phone_number} before submitting, reopening the chat")
+        
+        # Whatever happens below leaves a different or unconfirmed chat open
+        self.open_chat = None
+        
+        if self.fast_chat_switch and self.chat_index.searchable(clean_number) and self.can_type(message):
+            with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='chat_switch'):
+                message_input = self.open_chat_in_app(clean_number)
+            if message_input:
+                outcome = self.submit_typed(message_input, phone_number, message)
+                if outcome is not None:
+                    self.send_path = 'in_app'
+                    self.chat_switch_stats['in_app'] += 1
+                    return self.finish_send(outcome, phone_number, save_session)
+                # Nothing was submitted, so URL navigation below is a safe retry
+                logger.warning(f"In-app send failed for {phone_number}, falling back to navigation")
+                self.chat_switch_stats['in_app_failures'] += 1
+        
+        self.chat_switch_stats['navigation'] += 1
+        api_url = self.send_url(clean_number, message)
+        
+        logger.info(f"Navigating to: {api_url}")
+        
+        try:
+            with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='navigation'):
+                self.driver.get(api_url)
+        except Exception as nav_error:
+            logger.error(f"Navigation error: {nav_error}")
+            return False, f"Navigation error: {str(nav_error)}"
+        
+        # Returns as soon as the send button (or the bare compose box) is actionable
+        with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='send_button'):
+            ready = self.wait_until('compose', self.compose_ready())
+        
+        open_error = self.chat_open_error(phone_number, ready)
+        if open_error:
+            return False, open_error
+        
+        kind, element = ready
+        if kind == 'send':
+            send_button = element
+            with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='click'):
+                outcome = self.press_send(phone_number, 'click',
+                                          lambda: self.driver.execute_script("arguments[0].click();", send_button))
+            if outcome is not None:
+                self.send_path = 'click'
+                return self.finish_send(outcome, phone_number, save_session)
+            # The button went stale before the click landed; type into the compose box instead
+            element = self.find_actionable('message_input')
+        
+        # Fallback: keyboard method
+        message_input = element
+        if not message_input:
+            return False, "Could not find message input or send button"
+        
+        try:
+            message_input.clear()
+            message_input.click()
+        except Exception as input_error:
+            logger.error(f"Error with message input: {input_error}")
+            return False, f"Could not send message: {str(input_error)}"
+        outcome = self.submit_typed(message_input, phone_number, message)
+        if outcome is None:
+            return False, "Could not type the message"
+        self.send_path = 'keyboard'
+        return self.finish_send(outcome, phone_number, save_session)
+    
+    def submit_typed(self, message_input, phone_number, message):
+        """Type message into a verified compose box and press ENTER
+        
+        Returns None when nothing was submitted, so another path may retry,
+        otherwise press_send's (success, result).
+        """
+        with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='keyboard'):
+            try:
+                self.type_message(message_input, message)
+            except Exception as input_error:
+                logger.warning(f"Typing to {phone_number} failed before submitting: {input_error}")
+                return None
+            return self.press_send(phone_number, 'ENTER', lambda: message_input.send_keys(Keys.ENTER))
+    
+    def press_send(self, phone_number, action, press):
+        """Submit the compose box once; returns (success, result), or None if press never reached the page
+        
+        Anything that fails after the press is reported and never retried,
+        since the message may already be on its way.
+        """
+        self.submitting()
+        try:
+            press()
+        except StaleElementReferenceException:
+            return None
+        except Exception as press_error:
+            logger.error(f"Error during {action} for {phone_number}: {press_error}")
+            self.open_chat = None
+            return False, f"Message to {phone_number} may have been sent ({press_error}); not retried to avoid a duplicate"
+        
+        try:
+            confirmed = self.confirm_sent(phone_number, action)
+        except Exception as confirm_error:
+            logger.error(f"Could not confirm the send to {phone_number}: {confirm_error}")
+            self.open_chat = None
+            confirmed = False
+        if not confirmed:
+            return False, f"Message to {phone_number} was submitted but not confirmed; not retried to avoid a duplicate"
+        return True, f"Message sent successfully to {phone_number}"
+    
+    def submitting(self):
+        if self.on_submit:
+            self.on_submit()
+    
+    def finish_send(self, outcome, phone_number, save_session):
+        success, _ = outcome
+        if success:
+            if save_session:
+                self.save_cookies()
+            logger.info(f"Message sent to {phone_number} ({self.send_path})")
+        return outcome
+    
+    def confirm_sent(self, phone_number, action):
+        """Wait for the compose box to clear; a confirmed send leaves phone_number's chat reusable"""
+        self.chat_title = None
+        if self.wait_until('send_confirm', self.send_button_gone):
+            self.last_phone_number = phone_number
+            self.open_chat = {'title': self.chat_title}
+            self.chat_index.learn(recipients.digits(phone_number), self.chat_title)
+            return True
+        self.open_chat = None
+        logger.warning(f"Send button still visible after {action} for {phone_number}")
+        return False
+    
+    def open_chat_input(self, phone_number):
+        """Compose box of the chat the previous send left open, if it is still phone_number's chat
+        
+        One probe reads the header and the compose box. The header must show
+        the title seen right after the previous send, or exactly the number
+        when no title was seen; anything else and the chat is opened normally.
+        A box verified by prepare_session in the same send is used without
+        probing again; navigation and tab takeovers forget the open chat.
+        """
+        open_chat = self.open_chat
+        if not self.chat_affinity or not open_chat or self.last_phone_number != phone_number:
+            return None
+        if open_chat.get('input'):
+            return open_chat.pop('input')
+        
+        try:
+            found = self.probe.run('chat_header', 'message_input', text_groups=('chat_header',))
+            header = DomProbe.first_hit(found['chat_header'], visible=True)
+            message_input = DomProbe.element(found, 'message_input')
+            if header and message_input:
+                title = self.header_title(header)
+                if open_chat['title'] is not None:
+                    matches = title == open_chat['title']
+                else:
+                    matches = recipients.title_digits(title) == recipients.digits(phone_number)
+                if matches:
+                    return message_input
+        except Exception as e:
+            logger.warning(f"Could not verify the open chat for {phone_number}: {e}")
+        
+        self.open_chat = None
+        return None
+    
+    @staticmethod
+    def send_url(clean_number, message):
+        return f"{WHATSAPP_WEB_URL}/send?phone={clean_number}&text={quote(message)}"
+    
+    def chat_open_error(self, phone_number, ready):
+        """Why a /send?phone= navigation did not reach a usable chat, or None if it did"""
+        if not ready:
+            if not self.quick_login_check():
+                self.report_login_state('qr', "Lost login session - please login again")
+                return "Lost login session - please login again"
+            return "Could not find message input or send button"
+        
+        kind, _ = ready
+        if kind == 'logged_out':
+            self.report_login_state('qr', "Lost login session - please login again")
+            return "Lost login session - please login again"
+        
+        if kind == 'invalid':
+            if self.invalid_numbers:
+                self.invalid_numbers.add(phone_number)
+            try:
+                self.driver.execute_script(self.DISMISS_POPUP_SCRIPT)
+            except Exception as e:
+                logger.warning(f"Could not dismiss invalid number popup: {e}")
+            return f"{phone_number} is not registered on WhatsApp"
+        return None
+    
+    def deliver_attachment(self, phone_number, clean_number, attachment, caption, save_session):
+        """Open the chat for phone_number and send a stored file with an optional caption"""
+        self.send_path = 'attachment'
+        self.open_chat = None
+        opened = False
+        if self.fast_chat_switch and self.chat_index.searchable(clean_number):
+            with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='chat_switch'):
+                opened = self.open_chat_in_app(clean_number) is not None
+        
+        if not opened:
+            self.chat_switch_stats['navigation'] += 1
+            try:
+                with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='navigation'):
+                    self.driver.get(f"{WHATSAPP_WEB_URL}/send?phone={clean_number}")
+            except Exception as nav_error:
+                logger.error(f"Navigation error: {nav_error}")
+                return False, f"Navigation error: {str(nav_error)}"
+            
+            ready = self.wait_until('compose', self.compose_ready(prefilled=False))
+            open_error = self.chat_open_error(phone_number, ready)
+            if open_error:
+                return False, open_error
+        else:
+            self.chat_switch_stats['in_app'] += 1
+        
+        try:
+            with metrics.timer('whatsapp_send_phase_seconds', account=self.account_id, phase='attachment'):
+                success, result = self.attach_and_send(phone_number, attachment, caption)
+        except Exception as attach_error:
+            logger.error(f"Error sending attachment to {phone_number}: {attach_error}")
+            return False, f"Could not send attachment: {str(attach_error)}"
+        
+        if not success:
+            return False, result
+        
+        self.last_phone_number = phone_number
+        # No header was read on this path, so a follow-up text is matched on the number's digits
+        self.open_chat = {'title': None}
+        if save_session:
+            self.save_cookies()
+        logger.info(f"Attachment {attachment['filename']} sent to {phone_number}")
+        return True, f"Attachment sent successfully to {phone_number}"
+    
+    def attach_and_send(self, phone_number, attachment, caption):
+        """Attach a file to the open chat through its file input and send it (caller holds the lock)
+        
+        Chrome reads the file from its path on disk, so nothing but the path
+        crosses the WebDriver connection.
+        """
+        attach_button = self.wait_until('compose', lambda driver: self.find_actionable('attach_button'))
+        if not attach_button:
+            return False, "Could not find the attach button"
+        attach_button.click()
+        
+        group = 'media_input' if attachment['kind'] == 'media' else 'document_input'
+        file_input = self.wait_until(
+            'compose',
+            lambda driver: DomProbe.element(self.probe.run(group), group, actionable=False)
+        )
+        if not file_input:
+            return False, "Could not find the file input"
+        file_input.send_keys(attachment['path'])
+        
+        send_button = self.wait_until('attachment', lambda driver: self.find_actionable('media_send_button'))
+        if not send_button:
+            return False, "Attachment preview did not open"
+        
+        if caption:
+            caption_box = self.find_actionable('media_caption')
+            if not caption_box:
+                return False, "Could not find the caption box"
+            if self.can_type(caption):
+                self.type_message(caption_box, caption)
+            else:
+                self.driver.execute_script(self.INSERT_TEXT_SCRIPT, caption_box, caption)
+        
+        self.submitting()
+        self.driver.execute_script("arguments[0].click();", send_button)
+        if not self.wait_until('attachment', lambda driver: self.find_actionable('media_send_button') is None):
+            logger.warning(f"Attachment preview still open after clicking send for {phone_number}")
+            self.open_chat = None
+            return False, f"Attachment to {phone_number} was submitted but not confirmed; not retried to avoid a duplicate"
+        return True, None
+    
+    def open_chat_in_app(self, clean_number):
+        """Switch to a chat through the chat-list search without reloading the app
+        
+        Returns the compose box of the opened chat once its header shows
+        exactly clean_number, or None when the fast path does not apply (app
+        not loaded, no exact search result, header does not match).
+        """
+        try:
+            if WHATSAPP_WEB_HOST not in self.driver.current_url:
+                return None
+            
+            search_box = self.find_actionable('chat_search')
+            if not search_box:
+                return None
+            
+            search_box.click()
+            search_box.send_keys(Keys.CONTROL, 'a')
+            search_box.send_keys(Keys.BACKSPACE)
+            search_box.send_keys(clean_number)
+            
+            result = self.wait_until('chat_search', self.search_result(clean_number))
+            if result != 'clicked':
+                self.chat_index.miss(clean_number)
+                search_box.send_keys(Keys.ESCAPE)
+                return None
+            
+            message_input = self.wait_until('chat_search', lambda driver: self.verified_chat_input(clean_number))
+            if not message_input:
+                logger.warning(f"Chat opened from search does not show {clean_number}; not typing into it")
+                self.chat_index.miss(clean_number)
+                return None
+            # Drop any unsent draft left in this chat
+            message_input.click()
+            message_input.send_keys(Keys.CONTROL, 'a')
+            message_input.send_keys(Keys.BACKSPACE)
+            return message_input
+            
+        except Exception as e:
+            logger.warning(f"In-app chat switch failed for {clean_number}: {e}")
+            self.chat_switch_stats['in_app_failures'] += 1
+            return None
+    
+    def search_result(self, clean_number):
+        """Wait condition: 'clicked' on an exact result, 'miss' once the results settle without one"""
+        seen = {}
+        
+        def condition(driver):
+            result = driver.execute_script(self.CLICK_CHAT_RESULT_SCRIPT, clean_number, self.search_config) or {}
+            if result.get('clicked'):
+                return 'clicked'
+            now = time.monotonic()
+            if seen.get('titles') != result.get('titles'):
+                seen.update(titles=result.get('titles'), since=now)
+                return False
+            return 'miss' if now - seen['since'] >= self.chat_search_settle else False
+        
+        return condition
+    
+    def verified_chat_input(self, clean_number):
+        """Compose box of the open chat if its header shows exactly clean_number, else None"""
+        found = self.probe.run('chat_header', 'message_input', text_groups=('chat_header',))
+        header = DomProbe.first_hit(found['chat_header'], visible=True)
+        message_input = DomProbe.element(found, 'message_input')
+        if header and message_input and recipients.title_digits(self.header_title(header)) == clean_number:
+            return message_input
+        return None
+    
+    @staticmethod
+    def can_type(message):
+        """ChromeDriver's send_keys only handles characters in the Basic Multilingual Plane"""
+        return all(ord(char) <= 0xFFFF for char in message)
+    
+    @staticmethod
+    def type_message(element, message):
+        """Type message into the compose box, using SHIFT+ENTER for line breaks"""
+        for index, line in enumerate(message.split('\n')):
+            if index:
+                element.send_keys(Keys.SHIFT, Keys.ENTER)
+            if line:
+                element.send_keys(line)
+    
+    def warm_up(self):
+        """Launch Chrome, restore the session and open WhatsApp Web before any request arrives"""
+        self.warmup.update(stage='launching', started_at=time.time(), finished_at=None, error=None)
+        try:
+            with self.lock:
+                started = time.time()
+                if not self.is_driver_alive():
+                    if not self.restart_driver():
+                        raise RuntimeError("Failed to start browser driver")
+                self.warmup['timings']['launch_seconds'] = round(time.time() - started, 3)
+                
+                self.warmup['stage'] = 'logging_in'
+                started = time.time()
+                logged_in, message = self.ensure_logged_in()
+                self.warmup['timings']['login_seconds'] = round(time.time() - started, 3)
+            
+            self.warmup['stage'] = 'ready' if logged_in else 'waiting_for_qr'
+            logger.info(f"Warm-up for {self.account_id} finished: {message}")
+        except Exception as e:
+            logger.error(f"Warm-up for {self.account_id} failed: {e}")
+            self.warmup.update(stage='failed', error=str(e))
+        finally:
+            self.warmup['finished_at'] = time.time()
+    
+    def is_ready(self):
+        """Whether a send could start right now, judged from cached state only"""
+        return self.driver is not None and self.is_logged_in
+    
+    def report_login_state(self, state, message=None, expected=False):
+        """Feed what the request path observed into the login watcher's cached snapshot"""
+        if state == 'logged_in':
+            ready_seconds = self.profile.ready()
+            if ready_seconds is not None:
+                metrics.observe('whatsapp_browser_ready_seconds', ready_seconds,
+                                account=self.account_id, profile=self.profile.mode)
+        if self.login_watcher:
+            self.login_watcher.publish(state, message, expected)
+    
+    def driver_alive(self):
+        """Liveness from the supervisor's cached heartbeat, falling back to a live check"""
+        if self.supervisor and self.supervisor.fresh():
+            return True
+        alive = self.is_driver_alive()
+        if alive and self.supervisor:
+            self.supervisor.mark_alive()
+        return alive
+    
+    def is_driver_alive(self):
+        """Check if driver is still alive and responsive"""
+        try:
+            if not self.driver:
+                return False
+            self.driver.current_url
+            return True
+        except:
             return False
     
-    def restart_driver(self):
-        """Restart the driver after a crash"""
+    def restart_driver(self, planned=False):
+        """Restart the driver after a crash (or for a planned recycle)"""
         try:
+            # Only replacing a crashed browser or retrying a failed launch waits out the backoff
+            relaunch = not planned and (self.driver is not None or self.launch_failed)
+            short_lived = (
+                not planned and self.driver is not None and self.driver_started_at is not None
+                and self.supervisor is not None
+                and time.time() - self.driver_started_at < self.supervisor.stable_seconds
+            )
+            if relaunch and self.supervisor and not self.supervisor.may_restart():
+                logger.warning("Driver restart skipped while backing off after repeated failures")
+                return False
+            
             logger.info("Restarting driver...")
+            metrics.inc('whatsapp_driver_restarts_total', account=self.account_id)
             
             if self.driver:
                 try:
                     self.driver.quit()
+                    # Only a recycled browser that exited cleanly leaves a consistent profile to snapshot
+                    if planned and self.is_logged_in:
+                        self.profile.sync()
                 except:
                     pass
                 
             self.driver = None
             self.wait = None
             self.is_logged_in = False
+            self.open_chat = None
             
-            if self.setup_driver():
+            restarted = self.setup_driver()
+            self.launch_failed = not restarted
+            if self.supervisor:
+                self.supervisor.restarted(restarted, short_lived)
+            
+            if restarted:
                 logger.info("Driver restarted successfully")
                 return True
             else:
@@ -501,111 +2077,2179 @@ class WhatsAppBot:
             logger.error(f"Error restarting driver: {e}")
             return False
     
+    def recycle_driver(self):
+        """Replace a healthy but bloated or old browser between sends (caller holds the lock)"""
+        reason = self.supervisor.recycle_reason
+        logger.info(f"Recycling browser for {self.account_id} ({reason})")
+        self.session_store.capture()
+        restarted = self.restart_driver(planned=True)
+        self.supervisor.recycled()
+        return restarted
+    
     def get_qr_code(self):
         """Get QR code for login with image capture"""
-        try:
-            from selenium.webdriver.common.by import By
+        with self.lock:
+            try:
+                if not self.is_driver_alive():
+                    if not self.restart_driver():
+                        return False, "Failed to restart browser driver", None
             
-            if not self.is_driver_alive():
-                if not self.restart_driver():
-                    return False, "Failed to restart browser driver", None
+                if not self.driver:
+                    if not self.setup_driver():
+                        return False, "Failed to setup driver", None
             
-            if not self.driver:
-                if not self.setup_driver():
-                    return False, "Failed to setup driver", None
+                try:
+                    if WHATSAPP_WEB_HOST not in self.driver.current_url:
+                        logger.info("Loading WhatsApp Web...")
+                        self.open_chat = None
+                        self.driver.get(WHATSAPP_WEB_URL)
+                    state = self.wait_until('qr', self.login_state)
+                except Exception as nav_error:
+                    logger.error(f"Navigation error: {nav_error}")
+                    return False, f"Failed to navigate to WhatsApp Web: {str(nav_error)}", None
             
-            logger.info("Loading WhatsApp Web...")
+                if state == 'logged_in':
+                    self.is_logged_in = True
+                    self.clear_qr()
+                    self.report_login_state('logged_in', "Logged in successfully")
+                    self.save_cookies()
+                    return True, "Already logged in - no QR code needed", None
             
-            try:
-                self.driver.get("https://web.whatsapp.com")
-                time.sleep(5)
-            except Exception as nav_error:
-                logger.error(f"Navigation error: {nav_error}")
-                return False, f"Failed to navigate to WhatsApp Web: {str(nav_error)}", None
+                if state == 'qr':
+                    self.report_login_state('qr', "Please scan QR code to login")
+                    # Capture QR code image
+                    success, qr_image_data = self.capture_qr_code()
+                    if success:
+                        if self.login_watcher:
+                            self.login_watcher.publish_qr()
+                        return True, "QR code captured successfully", qr_image_data
+                    else:
+                        return True, "QR code is ready for scanning. Please scan it with your phone.", None
+            
+                return False, "Could not find QR code. Please try again.", None
+                
+            except Exception as e:
+                logger.error(f"Error in get_qr_code: {e}")
+                return False, f"Error getting QR code: {str(e)}", None
+    
+    def check_login_status(self):
+        """Check current login status"""
+        try:
+            if not self.is_driver_alive():
+                self.report_login_state('logged_out', "Driver not active")
+                return False, "Driver not active"
             
             if self.quick_login_check():
                 self.is_logged_in = True
-                self.save_cookies()
-                return True, "Already logged in - no QR code needed", None
-            
-            # Check for QR code
-            qr_found = False
-            qr_selectors = [
-                "[data-testid='qr-code']",
-                "canvas[role='img']",
-                "canvas"
+                self.report_login_state('logged_in', "Logged in successfully")
+                return True, "Logged in successfully"
+            else:
+                self.report_login_state('qr', "Not logged in")
+                return False, "Not logged in"
+                
+        except Exception as e:
+            logger.error(f"Error checking login status: {e}")
+            return False, f"Error: {str(e)}"
+    
+    def close_session(self):
+        """Close browser session"""
+        with self.lock:
+            try:
+                self.launch_failed = False
+                if self.driver:
+                    # Persist any pending cookie changes before the browser goes away
+                    self.session_store.capture()
+                    self.driver.quit()
+                    if self.is_logged_in:
+                        self.profile.sync()
+                    self.profile.release()
+                    self.driver = None
+                    self.wait = None
+                    self.is_logged_in = False
+                    self.last_phone_number = None
+                    self.open_chat = None
+                    self.report_login_state('logged_out', "Session closed", expected=True)
+                    logger.info("Session closed successfully")
+                    return True, "Session closed successfully"
+                else:
+                    return True, "No active session to close"
+            except Exception as e:
+                logger.error(f"Error closing session: {e}")
+                return False, f"Error closing session: {str(e)}"
+
+class Outbox:
+    """Durable SQLite (WAL) journal of queued messages with idempotency keys
+    
+    Inserts are committed before a job is acknowledged. Status updates are
+    coalesced per job and written by a background thread in one transaction
+    per OUTBOX_FLUSH_INTERVAL, so the journal keeps up with the send rate;
+    only 'submitted', recorded right before ENTER or the send click, is
+    committed at once. On restart queued jobs, and jobs that were sending but
+    never submitted, are resumed; submitted jobs become 'unknown' rather than
+    sent twice. The key of a failed job may be reused for a new attempt.
+    """
+    
+    COLUMNS = ('job_id', 'idempotency_key', 'account', 'phone_number', 'message', 'attachment_id', 'priority',
+               'status', 'result', 'attempts', 'created_at', 'started_at', 'finished_at')
+    
+    def __init__(self, path=None, flush_interval=None):
+        self.path = path or os.environ.get('OUTBOX_PATH', 'whatsapp_outbox.db')
+        self.flush_interval = flush_interval or float(os.environ.get('OUTBOX_FLUSH_INTERVAL', 0.2))
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flush_event = threading.Event()
+        self.running = True
+        
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                job_id TEXT PRIMARY KEY,
+                idempotency_key TEXT UNIQUE,
+                account TEXT NOT NULL,
+                phone_number TEXT NOT NULL,
+                message TEXT NOT NULL,
+                attachment_id TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                result TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, account)")
+        # Journals created before attachments existed
+        columns = {row['name'] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+        if 'attachment_id' not in columns:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN attachment_id TEXT")
+        
+        self.writer = threading.Thread(target=self.run, name='outbox-writer', daemon=True)
+        self.writer.start()
+    
+    def insert(self, job, idempotency_key=None):
+        """Journal a new job; returns the existing job id instead if the key is held by a job that did not fail"""
+        values = (job['id'], idempotency_key, job['account'], job['phone_number'], job['message'],
+                  job['attachment_id'], job['priority'], job['status'], job['created_at'])
+        with self.lock:
+            try:
+                self.conn.execute(
+                    "INSERT INTO outbox (job_id, idempotency_key, account, phone_number, message, attachment_id, "
+                    "priority, status, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)", values
+                )
+                return None
+            except sqlite3.IntegrityError:
+                row = self.conn.execute(
+                    "SELECT job_id, status FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+                ).fetchone()
+                if not row:
+                    raise
+                status = self.pending.get(row['job_id'], {}).get('status', row['status'])
+                if status != 'failed':
+                    return row['job_id']
+                # Retry: the failed job keeps its history, the new one takes over the key
+                self.conn.execute("BEGIN")
+                try:
+                    self.conn.execute("UPDATE outbox SET idempotency_key = NULL WHERE job_id = ?", (row['job_id'],))
+                    self.conn.execute(
+                        "INSERT INTO outbox (job_id, idempotency_key, account, phone_number, message, attachment_id, "
+                        "priority, status, attempts, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?)", values
+                    )
+                    self.conn.execute("COMMIT")
+                except Exception:
+                    self.conn.execute("ROLLBACK")
+                    raise
+                return None
+    
+    def update(self, job_id, **fields):
+        """Queue a status change; consecutive changes to one job collapse into a single write"""
+        with self.lock:
+            self.pending[job_id] = self.merge(self.pending.get(job_id, {}), fields)
+        self.flush_event.set()
+    
+    @staticmethod
+    def merge(older, newer):
+        """Combine two queued changes to one job: later fields win, attempt increments add up"""
+        merged = dict(older, **newer)
+        attempts = older.get('attempts_increment', 0) + newer.get('attempts_increment', 0)
+        if attempts:
+            merged['attempts_increment'] = attempts
+        return merged
+    
+    def mark_submitted(self, job_id):
+        """Commit 'submitted' (with any coalesced changes) before the message goes out"""
+        with self.lock:
+            fields = self.pending.pop(job_id, {})
+            fields['status'] = 'submitted'
+            self.write(job_id, fields)
+    
+    def write(self, job_id, fields):
+        attempts = fields.pop('attempts_increment', 0)
+        assignments = [f"{column} = ?" for column in fields]
+        values = list(fields.values())
+        if attempts:
+            assignments.append("attempts = attempts + ?")
+            values.append(attempts)
+        self.conn.execute(f"UPDATE outbox SET {', '.join(assignments)} WHERE job_id = ?", values + [job_id])
+    
+    def run(self):
+        while self.running:
+            self.flush_event.wait()
+            if not self.running:
+                break
+            # Let a burst of updates accumulate into one transaction
+            time.sleep(self.flush_interval)
+            self.flush_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Outbox flush failed: {e}")
+    
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            if not pending:
+                return 0
+            self.conn.execute("BEGIN")
+            try:
+                for job_id, fields in pending.items():
+                    self.write(job_id, dict(fields))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                # Keep the updates for the next attempt, without overwriting newer ones
+                for job_id, fields in pending.items():
+                    self.pending[job_id] = self.merge(fields, self.pending.get(job_id, {}))
+                raise
+            return len(pending)
+    
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM outbox WHERE job_id = ?", (job_id,)).fetchone()
+            job = dict(row) if row else None
+            if job:
+                fields = dict(self.pending.get(job_id, {}))
+                job['attempts'] += fields.pop('attempts_increment', 0)
+                job.update(fields)
+        if job:
+            job['id'] = job.pop('job_id')
+        return job
+    
+    def recover(self, account_id):
+        """Jobs to resume for an account after a restart, oldest first"""
+        with self.lock:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'unknown', finished_at = ?, "
+                "result = 'Interrupted after submitting; delivery unknown' "
+                "WHERE account = ? AND status = 'submitted'",
+                (time.time(), account_id)
+            )
+            # Never reached ENTER, so sending again cannot duplicate
+            self.conn.execute(
+                "UPDATE outbox SET status = 'queued', started_at = NULL WHERE account = ? AND status = 'sending'",
+                (account_id,)
+            )
+            rows = self.conn.execute(
+                "SELECT * FROM outbox WHERE account = ? AND status = 'queued' ORDER BY created_at",
+                (account_id,)
+            ).fetchall()
+        jobs = []
+        for row in rows:
+            job = dict(row)
+            job['id'] = job.pop('job_id')
+            jobs.append(job)
+        return jobs
+    
+    def stats(self):
+        with self.lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+            return {'path': self.path, 'pending_updates': len(self.pending), 'jobs': counts}
+    
+    def close(self):
+        self.running = False
+        self.flush_event.set()
+        try:
+            self.flush()
+            with self.lock:
+                self.conn.close()
+        except Exception as e:
+            logger.error(f"Error closing outbox: {e}")
+
+class MessageTemplate:
+    """A message body with bare {name} placeholders ({{ and }} are literal), parsed once"""
+    
+    def __init__(self, text):
+        self.text = text
+        self.parts = []
+        for literal, field, spec, conversion in string.Formatter().parse(text):
+            if field is not None:
+                if not field.isidentifier():
+                    raise ValueError(f"Invalid placeholder {{{field}}}: use {{name}} with letters, digits and _")
+                if spec or conversion:
+                    raise ValueError(f"Placeholder {{{field}}} cannot have a format spec or conversion")
+            self.parts.append((literal, field))
+        self.variables = frozenset(field for _, field in self.parts if field)
+    
+    def missing(self, values):
+        """Variables that values does not provide (absent, null or blank)"""
+        missing = []
+        for name in self.variables:
+            value = values.get(name)
+            if value is None or not str(value).strip():
+                missing.append(name)
+        return sorted(missing)
+    
+    def render(self, values):
+        return ''.join(literal + (str(values[field]) if field else '') for literal, field in self.parts)
+
+@lru_cache(maxsize=256)
+def compile_template(text):
+    """Compiled template for text, cached per process (web workers compile their own copy)"""
+    return MessageTemplate(text)
+
+class TemplateStore:
+    """Registered message templates keyed by a hash of their text, persisted to TEMPLATES_PATH"""
+    
+    def __init__(self, path=None, limit=None):
+        self.path = path if path is not None else os.environ.get('TEMPLATES_PATH', 'whatsapp_templates.json')
+        self.limit = limit or int(os.environ.get('TEMPLATE_LIMIT', 1000))
+        self.lock = threading.Lock()
+        self.templates = OrderedDict()
+        self.load()
+    
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for template_id, text in json.load(f).items():
+                    self.templates[template_id] = text
+        except Exception as e:
+            logger.error(f"Error loading templates: {e}")
+    
+    def save(self):
+        """Persist the templates (caller holds the lock)"""
+        if not self.path:
+            return
+        storage.atomic_write_json(self.path, self.templates)
+    
+    def register(self, text, template_id=None):
+        """Validate and store text; returns (template view, None) or (None, error message)"""
+        try:
+            # Cached, so view() below reuses the parse
+            compile_template(text)
+        except ValueError as e:
+            return None, str(e)
+        
+        template_id = template_id or hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+        with self.lock:
+            if template_id not in self.templates and len(self.templates) >= self.limit:
+                return None, f"Template limit ({self.limit}) reached"
+            self.templates[template_id] = text
+            self.save()
+        return self.view(template_id, text), None
+    
+    def get(self, template_id):
+        with self.lock:
+            text = self.templates.get(template_id)
+        return self.view(template_id, text) if text is not None else None
+    
+    def delete(self, template_id):
+        with self.lock:
+            if self.templates.pop(template_id, None) is None:
+                return False
+            self.save()
+            return True
+    
+    def list(self):
+        with self.lock:
+            items = list(self.templates.items())
+        return [self.view(template_id, text) for template_id, text in items]
+    
+    @staticmethod
+    def view(template_id, text):
+        return {'template_id': template_id, 'text': text, 'variables': sorted(compile_template(text).variables)}
+
+class RateGovernor:
+    """Send pacing for one account: a global token bucket plus per-recipient spacing (off by default)"""
+    
+    def __init__(self, rate_per_minute=None, burst=None, recipient_interval=None, jitter=None, max_recipients=None):
+        self.rate_per_minute = rate_per_minute if rate_per_minute is not None else float(os.environ.get('RATE_LIMIT_PER_MINUTE', 0))
+        self.burst = burst if burst is not None else float(os.environ.get('RATE_LIMIT_BURST', 5))
+        self.recipient_interval = recipient_interval if recipient_interval is not None else float(os.environ.get('RECIPIENT_MIN_INTERVAL', 0))
+        self.jitter = jitter if jitter is not None else float(os.environ.get('RATE_LIMIT_JITTER', 0))
+        self.max_recipients = max_recipients or int(os.environ.get('RATE_LIMIT_MAX_RECIPIENTS', 100000))
+        self.rate = self.rate_per_minute / 60.0
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.recipients = OrderedDict()
+        self.lock = threading.Lock()
+        self.total_wait = 0.0
+        self.decisions = 0
+    
+    def refill(self, now):
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def expire(self, now):
+        """Drop recipients whose spacing window has passed, oldest first"""
+        while self.recipients:
+            recipient, last_send = next(iter(self.recipients.items()))
+            if len(self.recipients) < self.max_recipients and last_send + self.recipient_interval > now:
+                break
+            self.recipients.popitem(last=False)
+    
+    def delay_for(self, recipient, now):
+        """Seconds until recipient may be sent to (caller holds the lock)"""
+        global_wait = 0.0
+        if self.rate > 0 and self.tokens < 1:
+            global_wait = (1 - self.tokens) / self.rate
+        
+        recipient_wait = 0.0
+        last_send = self.recipients.get(recipient)
+        if last_send is not None:
+            recipient_wait = max(0.0, last_send + self.recipient_interval - now)
+        return max(global_wait, recipient_wait)
+    
+    def check(self, recipient):
+        """Delay a send to recipient would need right now, without reserving it"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            return self.delay_for(recipient, now)
+    
+    def reserve(self, recipient, max_wait=None):
+        """Reserve recipient's next send slot; returns the wait, or None (reserving nothing) if over max_wait"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            self.expire(now)
+            delay = self.delay_for(recipient, now)
+            if max_wait is not None and delay > max_wait:
+                return None
+            
+            if self.jitter:
+                delay += random.uniform(0, self.jitter)
+            if self.rate > 0:
+                self.tokens -= 1
+            if self.recipient_interval > 0:
+                self.recipients[recipient] = now + delay
+                self.recipients.move_to_end(recipient)
+            self.total_wait += delay
+            self.decisions += 1
+            return delay
+    
+    def acquire(self, recipient, max_wait=None):
+        """Block until recipient's slot; returns the seconds waited, or None if over max_wait"""
+        delay = self.reserve(recipient, max_wait)
+        if delay:
+            time.sleep(delay)
+        return delay
+    
+    def budget(self):
+        """Current budget for upstream pacing"""
+        with self.lock:
+            now = time.monotonic()
+            self.refill(now)
+            next_token = 0.0
+            if self.rate > 0 and self.tokens < 1:
+                next_token = (1 - self.tokens) / self.rate
+            return {
+                'rate_per_minute': self.rate_per_minute,
+                'burst': self.burst,
+                'tokens': round(max(self.tokens, 0.0), 3),
+                'next_token_seconds': round(next_token, 3),
+                'recipient_min_interval': self.recipient_interval,
+                'jitter': self.jitter,
+                'tracked_recipients': len(self.recipients),
+                'decisions': self.decisions,
+                'avg_wait_seconds': round(self.total_wait / self.decisions, 3) if self.decisions else 0.0
+            }
+
+class SendJobQueue:
+    """Priority queue of send jobs drained by one worker thread that owns the driver
+    
+    Queued jobs for the recipient just sent to are taken next (recipient
+    affinity), so they are typed into the chat that is still open instead of
+    each opening it again.
+    """
+    
+    def __init__(self, bot, max_depth=None, history_limit=None, outbox=None, governor=None):
+        self.bot = bot
+        self.outbox = outbox
+        self.governor = governor
+        self.max_depth = max_depth or int(os.environ.get('SEND_QUEUE_MAX_DEPTH', 100))
+        self.history_limit = history_limit or int(os.environ.get('SEND_JOB_HISTORY', 1000))
+        self.condition = threading.Condition()
+        self.heap = []
+        self.jobs = {}
+        self.finished = deque()
+        self.counter = itertools.count()
+        self.worker = None
+        self.running = False
+        # Rolling estimate of how long one send takes, used for Retry-After
+        self.avg_send_seconds = 15.0
+        # Longest run of back-to-back jobs for one recipient while others wait
+        self.affinity_max_run = int(os.environ.get('SEND_AFFINITY_MAX_RUN', 5))
+        self.last_recipient = None
+        self.recipient_run = 0
+        self.affinity_picks = 0
+    
+    def submit(self, phone_number, message, priority=0, idempotency_key=None, attachment_id=None):
+        """Queue a message; returns (job, retry_after) with job None when the queue is full
+        
+        When idempotency_key is held by a job that has not failed, that job is
+        returned with 'duplicate' set and nothing new is queued.
+        """
+        with self.condition:
+            if len(self.heap) >= self.max_depth:
+                return None, self.retry_after()
+            
+            job = {
+                'id': uuid.uuid4().hex,
+                'account': self.bot.account_id,
+                'phone_number': phone_number,
+                'message': message,
+                'attachment_id': attachment_id,
+                'priority': priority,
+                'status': 'queued',
+                'result': None,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None
+            }
+            
+            if self.outbox:
+                existing_id = self.outbox.insert(job, idempotency_key)
+                if existing_id:
+                    existing = self.jobs.get(existing_id)
+                    existing = self.job_view(existing) if existing else self.outbox.get(existing_id)
+                    existing.pop('message', None)
+                    existing['duplicate'] = True
+                    return existing, 0
+            
+            self.jobs[job['id']] = job
+            # Higher priority first, FIFO within the same priority
+            heapq.heappush(self.heap, (-priority, next(self.counter), job['id']))
+            self.ensure_worker()
+            self.condition.notify()
+            return self.job_view(job), 0
+    
+    def restore(self):
+        """Re-queue jobs journalled by a previous run that never started sending"""
+        if not self.outbox:
+            return 0
+        jobs = self.outbox.recover(self.bot.account_id)
+        with self.condition:
+            for row in jobs:
+                job = {key: row[key] for key in ('id', 'account', 'phone_number', 'message', 'attachment_id', 'priority',
+                                                 'status', 'result', 'created_at', 'started_at', 'finished_at')}
+                self.jobs[job['id']] = job
+                heapq.heappush(self.heap, (-job['priority'], next(self.counter), job['id']))
+            if jobs:
+                logger.info(f"Resumed {len(jobs)} queued messages for {self.bot.account_id}")
+                self.ensure_worker()
+                self.condition.notify()
+        return len(jobs)
+    
+    def get(self, job_id):
+        """Return a snapshot of a job or None"""
+        with self.condition:
+            job = self.jobs.get(job_id)
+            return self.job_view(job) if job else None
+    
+    def get_many(self, job_ids):
+        """Return snapshots for several jobs plus the ids that are unknown"""
+        found, missing = {}, []
+        with self.condition:
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job:
+                    found[job_id] = self.job_view(job)
+                else:
+                    missing.append(job_id)
+        return found, missing
+    
+    def depth(self):
+        with self.condition:
+            return len(self.heap)
+    
+    def stats(self):
+        """Queue depth and job counts by status"""
+        with self.condition:
+            counts = {'queued': 0, 'sending': 0, 'sent': 0, 'failed': 0, 'unknown': 0}
+            for job in self.jobs.values():
+                counts[job['status']] += 1
+            return {
+                'depth': len(self.heap),
+                'max_depth': self.max_depth,
+                'jobs': counts,
+                'avg_send_seconds': round(self.avg_send_seconds, 3),
+                'affinity_picks': self.affinity_picks
+            }
+    
+    def pop_next(self):
+        """Remove and return the id of the job to send next (caller holds the condition, heap not empty)
+        
+        The heap top decides unless a job of the same priority is queued for
+        the recipient just sent to and that recipient has had fewer than
+        SEND_AFFINITY_MAX_RUN (default 5) jobs in a row. Grouping is off when
+        the rate governor spaces messages per recipient, since back-to-back
+        sends would only wait. The scan is linear in the queue, which is
+        bounded by SEND_QUEUE_MAX_DEPTH.
+        """
+        entry = self.heap[0]
+        grouping = self.affinity_max_run > 1 and not (self.governor and self.governor.recipient_interval)
+        if grouping and self.last_recipient and self.recipient_run < self.affinity_max_run:
+            same_recipient = [
+                candidate for candidate in self.heap
+                if candidate[0] == entry[0] and self.jobs[candidate[2]]['phone_number'] == self.last_recipient
             ]
+            if same_recipient:
+                entry = min(same_recipient)
+                if entry is not self.heap[0]:
+                    self.affinity_picks += 1
+        
+        if entry is self.heap[0]:
+            heapq.heappop(self.heap)
+        else:
+            self.heap.remove(entry)
+            heapq.heapify(self.heap)
+        
+        recipient = self.jobs[entry[2]]['phone_number']
+        if recipient == self.last_recipient:
+            self.recipient_run += 1
+        else:
+            self.last_recipient, self.recipient_run = recipient, 1
+        return entry[2]
+    
+    def retry_after(self):
+        """Seconds until the queue is expected to have room again"""
+        return max(1, int(math.ceil(self.avg_send_seconds)))
+    
+    def job_view(self, job):
+        """Public copy of a job with derived timings and, once sent, its delivery receipt"""
+        view = {key: value for key, value in job.items() if key != 'message'}
+        if job['started_at']:
+            view['queue_seconds'] = round(job['started_at'] - job['created_at'], 3)
+        if job['finished_at']:
+            view['send_seconds'] = round(job['finished_at'] - job['started_at'], 3)
+        if job['status'] == 'sent':
+            receipt = self.bot.receipts.get(job['id'])
+            if receipt:
+                view['receipt'] = {'status': receipt['status'], 'timestamps': receipt['timestamps']}
+        return view
+    
+    def ensure_worker(self):
+        """Start the worker thread if it is not running (caller holds the condition)"""
+        if self.worker and self.worker.is_alive():
+            return
+        self.running = True
+        self.worker = threading.Thread(target=self.run, name=f'send-worker-{self.bot.account_id}', daemon=True)
+        self.worker.start()
+    
+    def run(self):
+        """Worker loop: pop the highest priority job and send it"""
+        logger.info("Send worker started")
+        while True:
+            with self.condition:
+                while self.running and not self.heap:
+                    self.condition.wait()
+                if not self.running:
+                    break
+                job_id = self.pop_next()
+                job = self.jobs[job_id]
+                job['status'] = 'sending'
+                job['started_at'] = time.time()
+                if self.outbox:
+                    self.outbox.update(job_id, status='sending', started_at=job['started_at'], attempts_increment=1)
             
-            # Wait for QR code
-            max_wait = 20
-            wait_interval = 1
-            elapsed = 0
+            submitted = []
             
-            while elapsed < max_wait and not qr_found:
-                for selector in qr_selectors:
-                    try:
-                        elements = self.driver.find_elements(By.CSS_SELECTOR, selector)
-                        if elements and elements[0].is_displayed():
-                            logger.info(f"QR code found with selector: {selector}")
-                            qr_found = True
-                            break
-                    except:
-                        continue
-                
-                if not qr_found:
-                    time.sleep(wait_interval)
-                    elapsed += wait_interval
+            def on_submit(job_id=job_id, submitted=submitted):
+                submitted.append(True)
+                if self.outbox:
+                    self.outbox.mark_submitted(job_id)
             
-            if qr_found:
-                # Capture QR code image
-                success, qr_image_data = self.capture_qr_code()
-                if success:
-                    return True, "QR code captured successfully", qr_image_data
+            try:
+                # A number found invalid since it was queued fails without taking a send slot
+                recipient_error = self.bot.recipient_error(job['phone_number'])
+                if recipient_error:
+                    success, message = False, recipient_error
                 else:
-                    return True, "QR code is ready for scanning. Please scan it with your phone.", None
+                    if self.governor:
+                        job['rate_wait_seconds'] = round(self.governor.acquire(job['phone_number']) or 0.0, 3)
+                    success, message = self.bot.send_message(
+                        job['phone_number'], job['message'], attachment_id=job['attachment_id'],
+                        receipt_id=job_id, on_submit=on_submit)
+            except Exception as e:
+                logger.error(f"Send worker error for job {job_id}: {e}")
+                success, message = False, f"Error: {str(e)}"
             
-            return False, "Could not find QR code. Please try again.", None
-                
+            with self.condition:
+                # A failure after submitting may still have delivered the message
+                job['status'] = 'sent' if success else 'unknown' if submitted else 'failed'
+                job['result'] = message
+                job['finished_at'] = time.time()
+                if self.outbox:
+                    self.outbox.update(job_id, status=job['status'], result=message, finished_at=job['finished_at'])
+                elapsed = job['finished_at'] - job['started_at']
+                self.avg_send_seconds = 0.8 * self.avg_send_seconds + 0.2 * elapsed
+                self.finished.append(job_id)
+                while len(self.finished) > self.history_limit:
+                    self.jobs.pop(self.finished.popleft(), None)
+        logger.info("Send worker stopped")
+    
+    def stop(self):
+        """Stop the worker after its current job"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+class EventBroadcaster:
+    """Fan out named events to Server-Sent Events subscribers, one bounded queue each"""
+    
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self.subscribers = set()
+        self.lock = threading.Lock()
+    
+    def subscribe(self, subscriber=None):
+        """Register a queue for events, or add this broadcaster to an existing one"""
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=self.max_queue)
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+    
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+    
+    def publish(self, event, data):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event, data))
+            except queue.Full:
+                # Slow client: drop its oldest event rather than block the publisher
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait((event, data))
+                except (queue.Empty, queue.Full):
+                    pass
+    
+    def stream(self, initial=(), keepalive=15, also=()):
+        """Generator of SSE frames: the initial (event, data) pairs, then live events from self and also"""
+        subscriber = self.subscribe()
+        for other in also:
+            other.subscribe(subscriber)
+        try:
+            for event, data in initial:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            while True:
+                try:
+                    event, data = subscriber.get(timeout=keepalive)
+                    yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+            for other in also:
+                other.unsubscribe(subscriber)
+
+# Read at import so web workers and the browser owner agree on whether inbound capture exists
+INBOUND_MESSAGES = os.environ.get('INBOUND_MESSAGES', '1').lower() not in ('0', 'false', 'no')
+
+class WebhookDispatcher:
+    """Posts inbound messages to INBOUND_WEBHOOK_URL as JSON batches from a background thread
+    
+    The drainer only appends to a bounded buffer (INBOUND_WEBHOOK_QUEUE
+    messages, oldest dropped when full), so a slow or failing receiver never
+    holds up the browser. Connection errors, timeouts, 408, 429 and 5xx
+    responses are retried up to INBOUND_WEBHOOK_RETRIES times with
+    exponential backoff; other 4xx responses drop the batch.
+    """
+    
+    RETRY_STATUSES = (408, 429)
+    
+    def __init__(self, url=None):
+        self.url = url if url is not None else os.environ.get('INBOUND_WEBHOOK_URL', '')
+        self.timeout = float(os.environ.get('INBOUND_WEBHOOK_TIMEOUT', 10))
+        self.retries = int(os.environ.get('INBOUND_WEBHOOK_RETRIES', 5))
+        self.backoff_base = float(os.environ.get('INBOUND_WEBHOOK_BACKOFF', 1))
+        self.backoff_max = float(os.environ.get('INBOUND_WEBHOOK_BACKOFF_MAX', 60))
+        self.batch_size = int(os.environ.get('INBOUND_WEBHOOK_BATCH', 50))
+        self.max_pending = int(os.environ.get('INBOUND_WEBHOOK_QUEUE', 1000))
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.delivered = self.failed = self.dropped = self.retried = 0
+        self.last_error = None
+        self.thread = None
+        self.running = False
+        self.stop_event = threading.Event()
+    
+    def submit(self, messages):
+        if not self.url or not messages:
+            return
+        with self.condition:
+            self.pending.extend(messages)
+            while len(self.pending) > self.max_pending:
+                self.pending.popleft()
+                self.dropped += 1
+            self.condition.notify()
+            if not (self.thread and self.thread.is_alive()):
+                self.running = True
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self.run, name='inbound-webhook', daemon=True)
+                self.thread.start()
+    
+    def run(self):
+        while self.running:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            if batch:
+                self.deliver(batch)
+    
+    def deliver(self, batch):
+        body = json.dumps({'messages': batch}).encode('utf-8')
+        for attempt in range(self.retries + 1):
+            delivered, retryable = self.post(body)
+            if delivered:
+                self.delivered += len(batch)
+                metrics.inc('whatsapp_webhook_deliveries_total', result='delivered')
+                return
+            if not retryable or attempt == self.retries or not self.running:
+                break
+            self.retried += 1
+            metrics.inc('whatsapp_webhook_deliveries_total', result='retried')
+            self.stop_event.wait(min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        self.failed += len(batch)
+        metrics.inc('whatsapp_webhook_deliveries_total', result='failed')
+        logger.warning(f"Dropped {len(batch)} inbound messages for the webhook: {self.last_error}")
+    
+    def post(self, body):
+        """One delivery attempt; returns (delivered, worth retrying)"""
+        webhook_request = urllib.request.Request(
+            self.url, data=body, method='POST',
+            headers={'Content-Type': 'application/json', 'User-Agent': 'whatsapp-bot-inbound'}
+        )
+        try:
+            with urllib.request.urlopen(webhook_request, timeout=self.timeout) as response:
+                response.read()
+            return True, False
+        except urllib.error.HTTPError as e:
+            self.last_error = f"HTTP {e.code}"
+            return False, e.code in self.RETRY_STATUSES or e.code >= 500
+        except (urllib.error.URLError, OSError) as e:
+            self.last_error = str(getattr(e, 'reason', e))
+            return False, True
+    
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.stop_event.set()
+            self.condition.notify_all()
+    
+    def stats(self):
+        if not self.url:
+            return {'enabled': False}
+        with self.condition:
+            pending = len(self.pending)
+        return {
+            'enabled': True,
+            'pending': pending,
+            'delivered': self.delivered,
+            'retried': self.retried,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'last_error': self.last_error
+        }
+
+class InboundListener:
+    """Incoming messages for one account, buffered in the page and pushed to SSE and the webhook"""
+    
+    # Observes the open conversation and the chat list; rows rendered as a chat opens are history and skipped
+    DRAIN_SCRIPT = """
+        var config = arguments[0], state = window.__whatsappInbound;
+        if (!state) {
+            state = window.__whatsappInbound = {events: [], seen: {}, chats: {}, previews: {}, panes: {}};
+            var textOf = function (element) {
+                return element ? (element.innerText || element.textContent || '').trim().slice(0, config.maxText) : '';
+            };
+            var push = function (event) {
+                event.at = Date.now();
+                state.events.push(event);
+                if (state.events.length > config.maxEvents) state.events.shift();
+            };
+            var visitMessage = function (row, quiet) {
+                var id = row.getAttribute('data-id');
+                if (!id || state.seen[id]) return;
+                state.seen[id] = 1;
+                var chat = id.split('_')[1] || '', now = Date.now();
+                // Chats on screen at install are settled; others render their history when first opened
+                if (!(chat in state.chats)) state.chats[chat] = quiet ? 0 : now;
+                if (quiet || now - state.chats[chat] < config.settleMs) return;
+                var meta = row.querySelector(config.meta);
+                push({source: 'chat', id: id, chat: chat, text: textOf(row.querySelector(config.text) || row),
+                      meta: meta ? meta.getAttribute('data-pre-plain-text') || '' : ''});
+            };
+            var visitChat = function (item, quiet) {
+                var title = item.querySelector(config.title);
+                var name = title ? title.getAttribute('title') || textOf(title) : '';
+                if (!name) return;
+                var preview = textOf(item.querySelector(config.preview)), previous = state.previews[name];
+                state.previews[name] = preview;
+                var badge = item.querySelector(config.unread);
+                if (quiet || !badge || previous === preview) return;
+                push({source: 'chat_list', chat_title: name, text: preview, time: textOf(item.querySelector(config.time)),
+                      unread: parseInt(textOf(badge), 10) || 1});
+            };
+            // A change inside one row or chat entry only revisits that entry
+            var nearest = function (element, quiet) {
+                var chat = element.closest(config.chat);
+                if (chat) return visitChat(chat, quiet) || true;
+                var row = element.closest(config.message);
+                if (row) return visitMessage(row, quiet) || true;
+                return false;
+            };
+            var scan = function (node, quiet) {
+                if (node.nodeType !== 1 || nearest(node, quiet)) return;
+                Array.prototype.forEach.call(node.querySelectorAll(config.message), function (row) { visitMessage(row, quiet); });
+                Array.prototype.forEach.call(node.querySelectorAll(config.chat), function (chat) { visitChat(chat, quiet); });
+            };
+            state.observer = new MutationObserver(function (mutations) {
+                mutations.forEach(function (mutation) {
+                    var element = mutation.target.nodeType === 1 ? mutation.target : mutation.target.parentElement;
+                    if (element && nearest(element, false)) return;
+                    Array.prototype.forEach.call(mutation.addedNodes, function (node) { scan(node, false); });
+                });
+            });
+            // (Re)observe the panes; one rendered since the last drain is scanned, history rules still apply
+            state.attach = function (quiet) {
+                var found = {}, changed = false;
+                config.panes.forEach(function (pane) {
+                    found[pane.name] = document.querySelector(pane.selector);
+                    if (found[pane.name] !== state.panes[pane.name]) changed = true;
+                });
+                if (!changed) return;
+                state.observer.disconnect();
+                config.panes.forEach(function (pane) {
+                    var element = found[pane.name];
+                    if (!element) return;
+                    if (element !== state.panes[pane.name]) scan(element, quiet);
+                    state.observer.observe(element, {childList: true, subtree: true, characterData: pane.characterData});
+                });
+                state.panes = found;
+            };
+            state.attach(true);
+        } else {
+            state.attach(false);
+        }
+        var events = state.events;
+        state.events = [];
+        return events;
+    """
+    
+    # data-pre-plain-text: "[10:32, 17/10/2026] Alice: "
+    META = re.compile(r'^\[(?P<sent_at>[^\]]*)\]\s*(?P<sender>.*?):\s*$', re.DOTALL)
+    
+    def __init__(self, bot, interval=None, webhook=None):
+        self.bot = bot
+        self.enabled = INBOUND_MESSAGES
+        self.interval = interval or float(os.environ.get('INBOUND_POLL_INTERVAL', 2))
+        self.webhook = webhook
+        self.events = EventBroadcaster(max_queue=int(os.environ.get('INBOUND_SSE_QUEUE', 500)))
+        self.recent = deque(maxlen=int(os.environ.get('INBOUND_HISTORY', 100)))
+        # Message ids already published, so a page reload does not repeat them
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+        self.drained_at = 0.0
+        self.drains = 0
+        self.received = 0
+        self.thread = None
+        self.running = False
+        self.stop_event = threading.Event()
+        self.config = {
+            'message': ', '.join(SELECTORS['incoming_message']),
+            'meta': ', '.join(SELECTORS['message_meta']),
+            'text': ', '.join(SELECTORS['message_text']),
+            'chat': ', '.join(SELECTORS['chat_list_item']),
+            'title': ', '.join(SELECTORS['chat_list_title']),
+            'preview': ', '.join(SELECTORS['chat_list_preview']),
+            'unread': ', '.join(SELECTORS['unread_badge']),
+            'time': ', '.join(SELECTORS['chat_list_time']),
+            'panes': [
+                {'name': 'messages', 'selector': ', '.join(SELECTORS['message_pane']), 'characterData': False},
+                {'name': 'chats', 'selector': ', '.join(SELECTORS['chat_list_pane']), 'characterData': True}
+            ],
+            'settleMs': int(float(os.environ.get('INBOUND_SETTLE_SECONDS', 1.5)) * 1000),
+            'maxText': 4096,
+            'maxEvents': 1000
+        }
+    
+    def ensure_started(self):
+        if not self.enabled:
+            return
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.running = True
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name=f'inbound-{self.bot.account_id}', daemon=True)
+            self.thread.start()
+    
+    def run(self):
+        while self.running:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f"Inbound drain failed: {e}")
+            self.stop_event.wait(self.interval)
+    
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+    
+    def poll(self):
+        """Drain unless a send owns the driver; the send path drains for us then"""
+        if not self.bot.driver or not self.bot.lock.acquire(blocking=False):
+            return
+        try:
+            if self.due():
+                self.drain()
+        finally:
+            self.bot.lock.release()
+    
+    def due(self):
+        return self.running and self.bot.driver is not None and time.monotonic() - self.drained_at >= self.interval
+    
+    def drain(self):
+        """Collect buffered incoming messages in one round trip and publish them (caller holds the bot lock)"""
+        self.drained_at = time.monotonic()
+        try:
+            events = self.bot.driver.execute_script(self.DRAIN_SCRIPT, self.config) or []
         except Exception as e:
-            logger.error(f"Error in get_qr_code: {e}")
-            return False, f"Error getting QR code: {str(e)}", None
+            logger.debug(f"Inbound drain failed: {e}")
+            return 0
+        self.drains += 1
+        messages = []
+        for event in events:
+            if event['source'] == 'chat_list':
+                # The same preview is seen again after a reload or when the entry re-renders
+                key = '\0'.join(str(event.get(field, '')) for field in ('chat_title', 'text', 'time', 'unread'))
+                event['id'] = 'chat_list_' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+            if event['id'] in self.seen:
+                continue
+            self.seen[event['id']] = True
+            while len(self.seen) > 5000:
+                self.seen.popitem(last=False)
+            messages.append(self.message(event))
+        if messages:
+            self.publish(messages)
+        return len(messages)
+    
+    def message(self, event):
+        """Public form of one observer event"""
+        message = {
+            'id': event['id'],
+            'account': self.bot.account_id,
+            'source': event['source'],
+            'text': event.get('text', ''),
+            'received_at': event['at'] / 1000.0
+        }
+        if event['source'] == 'chat_list':
+            message.update(chat=event['chat_title'], sender=event['chat_title'], phone_number=None,
+                           group=None, sent_at=None, unread=event['unread'])
+            return message
+        
+        # data-id is <fromMe>_<chat>_<message id>[_<participant> in groups]
+        parts = event['id'].split('_')
+        chat = event['chat']
+        participant = parts[3] if len(parts) > 3 else chat
+        number = participant.split('@')[0]
+        meta = self.META.match(event.get('meta') or '')
+        message.update(
+            chat=chat,
+            group=chat.endswith('@g.us'),
+            phone_number=f"+{number}" if participant.endswith('@c.us') and number.isdigit() else None,
+            sender=meta.group('sender') if meta else None,
+            sent_at=meta.group('sent_at') if meta else None
+        )
+        return message
+    
+    def publish(self, messages):
+        self.received += len(messages)
+        for message in messages:
+            self.recent.append(message)
+            metrics.inc('whatsapp_inbound_messages_total', account=self.bot.account_id, source=message['source'])
+            self.events.publish('message', message)
+        if self.webhook:
+            self.webhook.submit(messages)
+    
+    def replay(self, count):
+        """The last count published messages, oldest first"""
+        return list(self.recent)[-count:] if count else []
+    
+    def stats(self):
+        if not self.enabled:
+            return {'enabled': False}
+        return {
+            'enabled': True,
+            'running': self.running,
+            'interval_seconds': self.interval,
+            'drains': self.drains,
+            'received': self.received,
+            'last_drain_age_seconds': round(time.monotonic() - self.drained_at, 3) if self.drained_at else None,
+            'subscribers': len(self.events.subscribers)
+        }
+
+class LoginWatcher:
+    """Samples one bot's login/QR state in the background and caches it
+    
+    States: logged_out, loading, qr, logged_in and session_lost (a logged-in
+    session that dropped without close_session). The send path reports what
+    it sees too, so samples are skipped while the bot is busy instead of
+    competing with sends for the driver.
+    """
+    
+    def __init__(self, bot, interval=None):
+        self.bot = bot
+        self.interval = interval or float(os.environ.get('LOGIN_WATCH_INTERVAL', 5))
+        # Sample faster while a QR code is on screen so rotations reach clients quickly
+        self.qr_interval = min(self.interval, float(os.environ.get('QR_WATCH_INTERVAL', 2)))
+        self.events = EventBroadcaster()
+        self.qr_events = EventBroadcaster()
+        self.published_qr = None
+        self.lock = threading.Lock()
+        self.state = {
+            'state': 'logged_out',
+            'logged_in': False,
+            'message': 'Driver not active',
+            'updated_at': time.time()
+        }
+        self.thread = None
+        self.running = False
+        self.stop_event = threading.Event()
+    
+    def ensure_started(self):
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.running = True
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name=f'login-watcher-{self.bot.account_id}', daemon=True)
+            self.thread.start()
+    
+    def run(self):
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Login watcher sample failed: {e}")
+            interval = self.qr_interval if self.state['state'] == 'qr' else self.interval
+            self.stop_event.wait(interval)
+    
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+    
+    def sample(self):
+        """Take one reading from the driver unless a send currently owns it"""
+        if not self.bot.driver:
+            self.publish('logged_out', 'Driver not active', expected=True)
+            return
+        
+        if not self.bot.lock.acquire(blocking=False):
+            return
+        try:
+            try:
+                current_url = self.bot.driver.current_url
+            except Exception:
+                self.publish('logged_out', 'Driver not active')
+                return
+            
+            if WHATSAPP_WEB_HOST not in current_url:
+                self.publish('logged_out', 'WhatsApp Web not open')
+                return
+            
+            state = self.bot.login_state(self.bot.driver)
+            if state == 'logged_in':
+                self.bot.is_logged_in = True
+                self.publish('logged_in', 'Logged in successfully')
+            elif state == 'qr':
+                self.publish('qr', 'Please scan QR code to login')
+                self.bot.capture_qr_code()
+                self.publish_qr()
+            else:
+                self.publish('loading', 'WhatsApp Web is loading')
+        finally:
+            self.bot.lock.release()
+    
+    def publish(self, state, message=None, expected=False):
+        """Record a state reading; transitions are pushed to SSE subscribers"""
+        with self.lock:
+            previous = self.state['state']
+            if previous == 'logged_in' and state in ('qr', 'logged_out') and not expected:
+                state, message = 'session_lost', 'Login session lost - please scan the QR code again'
+            if state != 'logged_in':
+                self.bot.is_logged_in = False
+            
+            changed = state != previous
+            self.state = {
+                'state': state,
+                'logged_in': state == 'logged_in',
+                'message': message or self.state['message'],
+                'updated_at': time.time()
+            }
+            snapshot = dict(self.state)
+        
+        if changed:
+            logger.info(f"Login state for {self.bot.account_id}: {previous} -> {state}")
+            snapshot.update(account=self.bot.account_id, previous=previous)
+            self.events.publish('login_state', snapshot)
+            if state != 'qr' and self.published_qr:
+                self.bot.clear_qr()
+                self.published_qr = None
+                self.qr_events.publish('qr_cleared', {'account': self.bot.account_id, 'state': state})
+    
+    def publish_qr(self):
+        """Push the current QR to subscribers if it rotated since the last push"""
+        qr = self.current_qr()
+        if qr['fingerprint'] and qr['fingerprint'] != self.published_qr:
+            self.published_qr = qr['fingerprint']
+            self.qr_events.publish('qr', qr)
+    
+    def current_qr(self):
+        qr_state = self.bot.qr_state
+        return {
+            'account': self.bot.account_id,
+            'fingerprint': qr_state['fingerprint'],
+            'qr_image': qr_state['image'],
+            'captured_at': qr_state['captured_at'],
+            'rotations': qr_state['rotations']
+        }
+    
+    def snapshot(self):
+        """Cached state with its age in seconds"""
+        with self.lock:
+            snapshot = dict(self.state)
+        snapshot['age_seconds'] = round(time.time() - snapshot['updated_at'], 3)
+        return snapshot
+
+class DriverSupervisor:
+    """Heartbeats one bot's browser in the background and recycles it before it bloats
+    
+    The send path reads the cached liveness flag instead of paying a
+    current_url round trip per message. Chrome is recycled between sends
+    once its process tree exceeds DRIVER_MAX_RSS_MB or it is older than
+    DRIVER_MAX_AGE. Restarts back off exponentially while they keep failing
+    or the new browser dies again within DRIVER_STABLE_SECONDS.
+    """
+    
+    def __init__(self, bot, interval=None):
+        self.bot = bot
+        self.interval = interval if interval is not None else float(os.environ.get('DRIVER_HEARTBEAT_INTERVAL', 10))
+        self.max_staleness = self.interval * 2
+        self.max_rss = float(os.environ.get('DRIVER_MAX_RSS_MB', 1500)) * 1024 * 1024
+        self.max_age = float(os.environ.get('DRIVER_MAX_AGE', 6 * 3600))
+        self.stable_seconds = float(os.environ.get('DRIVER_STABLE_SECONDS', 120))
+        self.backoff_base = float(os.environ.get('DRIVER_RESTART_BACKOFF', 2))
+        self.backoff_max = float(os.environ.get('DRIVER_RESTART_BACKOFF_MAX', 300))
+        self.alive = False
+        self.checked_at = 0.0
+        self.checked_driver = None
+        self.rss = None
+        self.recycle_reason = None
+        self.recycles = 0
+        self.restart_failures = 0
+        self.next_restart_at = 0.0
+        self.thread = None
+        self.running = False
+        self.stop_event = threading.Event()
+    
+    def start(self):
+        if self.interval <= 0 or (self.thread and self.thread.is_alive()):
+            return
+        self.running = True
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name=f'driver-supervisor-{self.bot.account_id}', daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
+    
+    def run(self):
+        while self.running:
+            try:
+                self.tick()
+            except Exception as e:
+                logger.warning(f"Driver supervisor check failed: {e}")
+            self.stop_event.wait(self.interval)
+    
+    def tick(self):
+        driver = self.bot.driver
+        if not driver:
+            self.alive = False
+            return
+        
+        self.rss = self.process_tree_rss(driver)
+        if self.rss is not None:
+            metrics.set('whatsapp_browser_rss_bytes', self.rss, account=self.bot.account_id)
+        self.check_recycle()
+        
+        # Never compete with a send for the driver; its own progress proves liveness
+        if not self.bot.lock.acquire(blocking=False):
+            return
+        try:
+            if self.bot.driver is not driver:
+                return
+            if self.bot.is_driver_alive():
+                self.mark_alive()
+                self.bot.resource_policy.collect(self.bot.driver)
+                self.bot.receipts.drain()
+                if self.recycle_reason and self.bot.recycle_driver():
+                    # Reopen WhatsApp Web now so the next send finds a ready session
+                    self.bot.ensure_logged_in()
+            else:
+                self.alive = False
+                logger.warning(f"Browser for {self.bot.account_id} stopped responding, restarting...")
+                self.bot.restart_driver()
+        finally:
+            self.bot.lock.release()
+    
+    def mark_alive(self):
+        """Record that the current driver just answered a command"""
+        self.alive = True
+        self.checked_at = time.monotonic()
+        self.checked_driver = self.bot.driver
+        started_at = self.bot.driver_started_at
+        if self.restart_failures and started_at and time.time() - started_at > self.stable_seconds:
+            self.restart_failures = 0
+    
+    def fresh(self):
+        """True if the cached heartbeat vouches for the current driver"""
+        return (
+            self.alive
+            and self.checked_driver is not None
+            and self.checked_driver is self.bot.driver
+            and time.monotonic() - self.checked_at < self.max_staleness
+        )
+    
+    def check_recycle(self):
+        """Flag the browser for a recycle at the next send boundary"""
+        started_at = self.bot.driver_started_at
+        if self.max_rss and self.rss and self.rss > self.max_rss:
+            self.recycle_reason = 'memory'
+        elif self.max_age and started_at and time.time() - started_at > self.max_age:
+            self.recycle_reason = 'age'
+        return self.recycle_reason
+    
+    def recycled(self):
+        metrics.inc('whatsapp_browser_recycles_total', account=self.bot.account_id, reason=self.recycle_reason)
+        self.recycles += 1
+        self.recycle_reason = None
+        self.rss = None
+    
+    def may_restart(self):
+        """False while backing off after failed or short-lived restarts"""
+        return time.monotonic() >= self.next_restart_at
+    
+    def restarted(self, success, short_lived=False):
+        """Back off exponentially after a failed launch or a browser that died within stable_seconds"""
+        self.alive = False
+        if success and not short_lived:
+            return
+        self.restart_failures += 1
+        delay = min(self.backoff_max, self.backoff_base * (2 ** (self.restart_failures - 1)))
+        self.next_restart_at = time.monotonic() + delay
+        if not success:
+            logger.warning(f"Browser restart for {self.bot.account_id} failed; next attempt in {delay:.0f}s")
+    
+    @staticmethod
+    def process_tree_rss(driver):
+        """Resident bytes of chromedriver and every process below it, or None if unknown"""
+        try:
+            root = driver.service.process.pid
+        except Exception:
+            return None
+        
+        if psutil:
+            try:
+                parent = psutil.Process(root)
+                return sum(process.memory_info().rss for process in [parent] + parent.children(recursive=True))
+            except psutil.Error:
+                return None
+        
+        if not os.path.isdir('/proc'):
+            return None
+        
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces, so split after its closing parenthesis
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(entry))
+        
+        total, pending = 0, [root]
+        while pending:
+            pid = pending.pop()
+            pending.extend(children.get(pid, []))
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+            except (OSError, IndexError, ValueError):
+                continue
+        return total
+    
+    def stats(self):
+        started_at = self.bot.driver_started_at
+        return {
+            'alive': self.alive,
+            'heartbeat_age_seconds': round(time.monotonic() - self.checked_at, 3) if self.checked_at else None,
+            'browser_age_seconds': round(time.time() - started_at, 3) if started_at and self.bot.driver else None,
+            'rss_mb': round(self.rss / 1024 / 1024, 1) if self.rss else None,
+            'max_rss_mb': round(self.max_rss / 1024 / 1024, 1),
+            'recycle_pending': self.recycle_reason,
+            'recycles': self.recycles,
+            'restart_failures': self.restart_failures,
+            'restart_backoff_seconds': round(max(0.0, self.next_restart_at - time.monotonic()), 3)
+        }
+
+class BotPool:
+    """One WhatsAppBot, Chrome profile, cookie file and send queue per WhatsApp account
+    
+    Accounts come from WHATSAPP_ACCOUNTS (comma separated). Sends are routed by
+    account key, or by POOL_ROUTING ('least_loaded' or 'round_robin') when the
+    caller does not name one.
+    """
+    
+    def __init__(self, account_ids=None, strategy=None):
+        if account_ids is None:
+            account_ids = [a.strip() for a in os.environ.get('WHATSAPP_ACCOUNTS', 'default').split(',') if a.strip()]
+        self.strategy = strategy or os.environ.get('POOL_ROUTING', 'least_loaded')
+        self.bots = OrderedDict()
+        self.queues = {}
+        self.watchers = {}
+        self.governors = {}
+        self.route_lock = threading.Lock()
+        self.round_robin = itertools.cycle(account_ids or ['default'])
+        outbox_path = os.environ.get('OUTBOX_PATH', 'whatsapp_outbox.db')
+        self.outbox = Outbox(outbox_path) if outbox_path else None
+        self.templates = TemplateStore()
+        self.invalid_numbers = recipients.InvalidNumberCache()
+        self.attachments = attachments.AttachmentStore()
+        self.webhook = WebhookDispatcher()
+        
+        for account_id in account_ids or ['default']:
+            if not re.match(r'^[A-Za-z0-9_-]+$', account_id):
+                raise ValueError(f"Invalid account id: {account_id}")
+            
+            if account_id == 'default':
+                # Keep the original single-account profile and cookie paths
+                bot = WhatsAppBot(account_id)
+            else:
+                bot = WhatsAppBot(
+                    account_id,
+                    user_data_dir=os.path.join(os.getcwd(), f'chrome_user_data_{account_id}'),
+                    cookies_file=f"whatsapp_cookies_{account_id}.json"
+                )
+            self.bots[account_id] = bot
+            self.governors[account_id] = RateGovernor()
+            self.queues[account_id] = SendJobQueue(bot, outbox=self.outbox, governor=self.governors[account_id])
+            self.watchers[account_id] = bot.login_watcher = LoginWatcher(bot)
+            bot.supervisor = DriverSupervisor(bot)
+            bot.invalid_numbers = self.invalid_numbers
+            bot.attachments = self.attachments
+            bot.outbox = self.outbox
+            bot.governor = self.governors[account_id]
+            bot.inbound.webhook = self.webhook
+            bot.supervisor.start()
+            if self.webhook.url:
+                bot.inbound.ensure_started()
+        
+        for send_queue in self.queues.values():
+            send_queue.restore()
+    
+    def get(self, account_id=None):
+        """Bot for account_id, the first account when None, or None if unknown"""
+        if account_id is None:
+            return next(iter(self.bots.values()))
+        return self.bots.get(account_id)
+    
+    def route(self, account_id=None):
+        """Pick the account that should send the next message, or None if account_id is unknown"""
+        if account_id:
+            return account_id if account_id in self.bots else None
+        
+        if len(self.bots) == 1:
+            return next(iter(self.bots))
+        
+        with self.route_lock:
+            if self.strategy == 'round_robin':
+                return next(self.round_robin)
+            
+            # least_loaded: logged-in accounts first, then fewest queued or in-flight sends
+            def load(account_id):
+                bot = self.bots[account_id]
+                busy = 1 if bot.lock.locked() else 0
+                return (0 if bot.is_logged_in else 1, self.queues[account_id].depth() + busy)
+            
+            return min(self.bots, key=load)
+    
+    def find_job(self, job_id):
+        for send_queue in self.queues.values():
+            job = send_queue.get(job_id)
+            if job:
+                return job
+        if self.outbox:
+            # Older jobs age out of memory but stay in the journal
+            job = self.outbox.get(job_id)
+            if job:
+                job.pop('message', None)
+            return job
+        return None
+    
+    def find_jobs(self, job_ids):
+        """Look up several job ids across every account queue"""
+        found, missing = {}, list(job_ids)
+        for send_queue in self.queues.values():
+            if not missing:
+                break
+            queue_found, missing = send_queue.get_many(missing)
+            found.update(queue_found)
+        if self.outbox and missing:
+            still_missing = []
+            for job_id in missing:
+                job = self.outbox.get(job_id)
+                if job:
+                    job.pop('message', None)
+                    found[job_id] = job
+                else:
+                    still_missing.append(job_id)
+            missing = still_missing
+        return found, missing
+    
+    def find_receipt(self, receipt_id):
+        for bot in self.bots.values():
+            receipt = bot.receipts.get(receipt_id)
+            if receipt:
+                return dict(receipt, account=bot.account_id)
+        return None
+    
+    def health(self):
+        """Per-account login, driver and queue state without touching the browsers"""
+        accounts = {}
+        for account_id, bot in self.bots.items():
+            accounts[account_id] = {
+                'logged_in': bot.is_logged_in,
+                'login_state': self.watchers[account_id].snapshot()['state'],
+                'driver_running': bot.driver is not None,
+                'busy': bot.lock.locked(),
+                'chat_switch': dict(bot.chat_switch_stats),
+                'chat_index': bot.chat_index.stats(),
+                'probe': bot.probe.stats(),
+                'session_store': bot.session_store.stats(),
+                'supervisor': bot.supervisor.stats(),
+                'resource_policy': bot.resource_policy.stats(),
+                'receipts': bot.receipts.stats(),
+                'inbound': bot.inbound.stats(),
+                'profile': bot.profile.stats(),
+                'rate_limit': self.governors[account_id].budget(),
+                'queue': self.queues[account_id].stats()
+            }
+        return {
+            'strategy': self.strategy,
+            'size': len(self.bots),
+            'logged_in': sum(1 for bot in self.bots.values() if bot.is_logged_in),
+            'queue_depth': sum(send_queue.depth() for send_queue in self.queues.values()),
+            'invalid_numbers': self.invalid_numbers.stats(),
+            'attachments': self.attachments.stats(),
+            'webhook': self.webhook.stats(),
+            'accounts': accounts
+        }
+    
+    def queue_stats(self):
+        return {account_id: send_queue.stats() for account_id, send_queue in self.queues.items()}
+    
+    def rate_budgets(self, account_ids=None):
+        return {account_id: self.governors[account_id].budget() for account_id in account_ids or self.governors}
+    
+    def wait_summaries(self):
+        return {account_id: bot.wait_summary() for account_id, bot in self.bots.items()}
+    
+    def render_metrics(self):
+        """Refresh the sampled gauges and render every metric"""
+        for account_id, bot in self.bots.items():
+            metrics.set('whatsapp_send_queue_depth', self.queues[account_id].depth(), account=account_id)
+            metrics.set('whatsapp_logged_in', 1 if bot.is_logged_in else 0, account=account_id)
+        return metrics.render()
+    
+    def close_sessions(self):
+        return [bot.close_session() for bot in self.bots.values()]
+    
+    def warm_up(self):
+        """Prime every account's browser in the background (WARM_START=1)"""
+        for account_id, bot in self.bots.items():
+            bot.warmup['stage'] = 'pending'
+            threading.Thread(target=bot.warm_up, name=f'warm-up-{account_id}', daemon=True).start()
+            self.watchers[account_id].ensure_started()
+    
+    def readiness(self):
+        accounts = {}
+        for account_id, bot in self.bots.items():
+            accounts[account_id] = dict(bot.warmup, ready=bot.is_ready())
+        return {
+            'ready': any(account['ready'] for account in accounts.values()),
+            'accounts': accounts
+        }
+    
+    def shutdown(self):
+        for watcher in self.watchers.values():
+            watcher.stop()
+        for bot in self.bots.values():
+            bot.supervisor.stop()
+            bot.inbound.stop()
+        self.webhook.stop()
+        for send_queue in self.queues.values():
+            send_queue.stop()
+        for bot in self.bots.values():
+            bot.close_session()
+            bot.chat_index.flush()
+        self.invalid_numbers.flush()
+        if self.outbox:
+            self.outbox.close()
+
+# Argument markers on the browser-owner channel. Plain tuples rather than classes,
+# so unpickling never has to import this module in the owner (where it runs as __main__).
+REMOTE_REF = '__browser_owner_ref__'
+REMOTE_ITERATOR = '__browser_owner_iterator__'
+
+class BrowserOwner:
+    """Serves the BotPool to web workers over a local socket (multiprocessing.connection)"""
+    
+    # Requests are (op, ref, name, args, kwargs, releases); anything not plain is returned as a reference
+    PLAIN_TYPES = (type(None), bool, int, float, str, bytes)
+    
+    def __init__(self, address, roots, authkey=None):
+        if isinstance(address, tuple) and not authkey:
+            raise ValueError("BROWSER_OWNER_AUTHKEY must be set when BROWSER_OWNER_ADDRESS is host:port")
+        self.address = address
+        self.authkey = authkey
+        self.lock = threading.Lock()
+        self.roots = dict(roots)
+        # client id -> {'connections': open connections, 'refs': {ref id: [object, outstanding references]}}
+        self.clients = {}
+        self.methods = {}
+        self.local = threading.local()
+    
+    def serve_forever(self):
+        from multiprocessing.connection import Listener
+        
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            # Create the socket owner-only from the start rather than chmod it after bind
+            previous_umask = os.umask(0o177)
+            try:
+                listener = Listener(self.address, authkey=self.authkey)
+            finally:
+                os.umask(previous_umask)
+        else:
+            listener = Listener(self.address, authkey=self.authkey)
+        logger.info(f"Browser owner listening on {self.address}")
+        
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"Rejected browser-owner connection: {e}")
+                    continue
+                threading.Thread(target=self.handle, args=(conn,), name='browser-owner-conn', daemon=True).start()
+        finally:
+            listener.close()
+    
+    def handle(self, conn):
+        try:
+            hello, client_id = conn.recv()
+            if hello != 'hello':
+                raise ValueError(f"expected hello, got {hello!r}")
+        except Exception as e:
+            logger.warning(f"Dropped browser-owner connection without a hello: {e}")
+            conn.close()
+            return
+        with self.lock:
+            client = self.clients.setdefault(client_id, {'connections': 0, 'refs': {}})
+            client['connections'] += 1
+        self.local.conn = conn
+        self.local.client = client
+        try:
+            while True:
+                try:
+                    op, ref_id, name, args, kwargs, releases = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self.release(releases)
+                try:
+                    reply = self.dispatch(op, ref_id, name, args, kwargs)
+                except StopIteration:
+                    reply = ('stop',)
+                except Exception as e:
+                    reply = ('error', e if self.is_plain(e) else RuntimeError(repr(e)))
+                try:
+                    conn.send(reply)
+                except (EOFError, OSError):
+                    return
+        finally:
+            conn.close()
+            self.disconnect(client_id, client)
+    
+    def disconnect(self, client_id, client):
+        """Drop a client's references once its last connection has closed"""
+        with self.lock:
+            client['connections'] -= 1
+            if client['connections'] > 0:
+                return
+            if self.clients.get(client_id) is client:
+                del self.clients[client_id]
+            orphans = [obj for obj, _ in client['refs'].values()]
+            client['refs'].clear()
+        for obj in orphans:
+            if inspect.isgenerator(obj):
+                try:
+                    obj.close()
+                except Exception as e:
+                    logger.warning(f"Error closing an orphaned browser-owner generator: {e}")
+        if orphans:
+            logger.info(f"Released {len(orphans)} browser-owner references of a disconnected client")
+    
+    def lookup(self, ref_id):
+        if ref_id in self.roots:
+            return self.roots[ref_id]
+        return self.local.client['refs'][ref_id][0]
+    
+    def dispatch(self, op, ref_id, name, args, kwargs):
+        target = self.lookup(ref_id)
+        if op == 'call':
+            args = [self.unwrap(arg) for arg in args]
+            kwargs = {key: self.unwrap(value) for key, value in kwargs.items()}
+            return self.wrap(getattr(target, name)(*args, **kwargs))
+        if op == 'getattr':
+            value = getattr(target, name)
+            if callable(value) and not self.is_plain(value):
+                return ('method',)
+            return self.wrap(value)
+        if op == 'getitem':
+            return self.wrap(target[self.unwrap(name)])
+        if op == 'contains':
+            return ('ok', self.unwrap(name) in target)
+        if op == 'next':
+            return self.wrap(next(target))
+        raise ValueError(f"Unknown browser-owner operation: {op}")
+    
+    def is_plain(self, value):
+        if isinstance(value, self.PLAIN_TYPES):
+            return True
+        if isinstance(value, BaseException):
+            return all(self.is_plain(arg) for arg in value.args)
+        if isinstance(value, (list, tuple)):
+            return all(self.is_plain(item) for item in value)
+        if isinstance(value, dict):
+            return all(self.is_plain(key) and self.is_plain(item) for key, item in value.items())
+        return False
+    
+    def wrap(self, value):
+        if self.is_plain(value):
+            return ('ok', value)
+        if isinstance(value, tuple):
+            # (success, message, <object>) style returns keep their shape
+            return ('tuple', [self.wrap(item) for item in value])
+        
+        ref_id = id(value)
+        with self.lock:
+            entry = self.local.client['refs'].setdefault(ref_id, [value, 0])
+            entry[1] += 1
+        
+        kind = type(value)
+        if kind not in self.methods:
+            self.methods[kind] = [
+                attr for attr in dir(kind)
+                if not attr.startswith('_') and callable(getattr(kind, attr, None))
+            ]
+        return ('ref', ref_id, self.methods[kind], hasattr(value, '__next__'))
+    
+    def unwrap(self, value):
+        if isinstance(value, tuple) and len(value) == 2:
+            if value[0] == REMOTE_REF:
+                return self.lookup(value[1])
+            if value[0] == REMOTE_ITERATOR:
+                return self.pull(value[1])
+        return value
     
-    def check_login_status(self):
-        """Check current login status"""
-        try:
-            if not self.is_driver_alive():
-                return False, "Driver not active"
-            
-            if self.quick_login_check():
-                self.is_logged_in = True
-                return True, "Logged in successfully"
-            else:
-                return False, "Not logged in"
-                
-        except Exception as e:
-            logger.error(f"Error checking login status: {e}")
-            return False, f"Error: {str(e)}"
+    def pull(self, arg_id):
+        """Iterate a client-side argument, fetching chunks over the connection serving the current call"""
+        while True:
+            conn = self.local.conn
+            conn.send(('pull', arg_id))
+            chunk = conn.recv()
+            if not chunk:
+                return
+            yield from chunk
     
-    def close_session(self):
-        """Close browser session"""
+    def release(self, ref_ids):
+        if not ref_ids:
+            return
+        refs = self.local.client['refs']
         with self.lock:
+            for ref_id in ref_ids:
+                entry = refs.get(ref_id)
+                if entry:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del refs[ref_id]
+
+class BrowserOwnerClient:
+    """Web-worker side of the browser-owner channel, with one pooled connection per concurrent call"""
+    
+    def __init__(self, address, authkey=None, chunk_size=None, connect_timeout=None):
+        if isinstance(address, tuple) and not authkey:
+            raise ValueError("BROWSER_OWNER_AUTHKEY must be set when BROWSER_OWNER_ADDRESS is host:port")
+        self.address = address
+        self.authkey = authkey
+        self.chunk_size = chunk_size or int(os.environ.get('BROWSER_OWNER_CHUNK_SIZE', 100))
+        self.connect_timeout = connect_timeout or float(os.environ.get('BROWSER_OWNER_CONNECT_TIMEOUT', 60))
+        self.client_id = uuid.uuid4().hex
+        # Held open, never used for calls: while it lives the owner keeps this worker's references
+        self.session = None
+        self.connections = queue.LifoQueue()
+        self.arguments = {}
+        self.argument_ids = itertools.count()
+        self.pending_releases = []
+        self.lock = threading.Lock()
+    
+    def root(self, name):
+        return RemoteObject(self, name, None, False)
+    
+    def connect(self):
+        from multiprocessing.connection import Client
+        
+        deadline = time.time() + self.connect_timeout
+        while True:
             try:
-                if self.driver:
-                    self.driver.quit()
-                    self.driver = None
-                    self.wait = None
-                    self.is_logged_in = False
-                    self.last_phone_number = None
-                    logger.info("Session closed successfully")
-                    return True, "Session closed successfully"
-                else:
-                    return True, "No active session to close"
-            except Exception as e:
-                logger.error(f"Error closing session: {e}")
-                return False, f"Error closing session: {str(e)}"
+                conn = Client(self.address, authkey=self.authkey)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # The owner may still be starting up
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        conn.send(('hello', self.client_id))
+        
+        with self.lock:
+            # The owner never writes to the session connection, so readable means it was closed
+            if self.session is not None and self.session.poll():
+                self.session.close()
+                self.session = None
+            if self.session is None:
+                self.session = Client(self.address, authkey=self.authkey)
+                self.session.send(('hello', self.client_id))
+        return conn
+    
+    def request(self, op, ref_id, name=None, args=(), kwargs=None):
+        with self.lock:
+            releases, self.pending_releases = self.pending_releases, []
+        
+        wrapped_args = [self.wrap_argument(arg) for arg in args]
+        wrapped_kwargs = {key: self.wrap_argument(value) for key, value in (kwargs or {}).items()}
+        
+        try:
+            conn = self.connections.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+        
+        try:
+            conn.send((op, ref_id, name, wrapped_args, wrapped_kwargs, releases))
+            while True:
+                reply = conn.recv()
+                if reply[0] != 'pull':
+                    break
+                conn.send(self.next_chunk(reply[1]))
+        except Exception:
+            conn.close()
+            raise
+        self.connections.put(conn)
+        return self.unwrap(reply)
+    
+    def wrap_argument(self, value):
+        if isinstance(value, RemoteObject):
+            return (REMOTE_REF, value._ref_id)
+        if hasattr(value, '__next__'):
+            arg_id = next(self.argument_ids)
+            self.arguments[arg_id] = value
+            return (REMOTE_ITERATOR, arg_id)
+        return value
+    
+    def next_chunk(self, arg_id):
+        iterator = self.arguments.get(arg_id)
+        chunk = list(itertools.islice(iterator, self.chunk_size)) if iterator else []
+        if not chunk:
+            self.arguments.pop(arg_id, None)
+        return chunk
+    
+    def unwrap(self, reply):
+        kind = reply[0]
+        if kind == 'ok':
+            return reply[1]
+        if kind == 'tuple':
+            return tuple(self.unwrap(item) for item in reply[1])
+        if kind == 'ref':
+            return RemoteObject(self, reply[1], reply[2], reply[3])
+        if kind == 'method':
+            return ('method',)
+        if kind == 'stop':
+            raise StopIteration
+        if kind == 'error':
+            raise reply[1]
+        raise ValueError(f"Unexpected browser-owner reply: {kind}")
+    
+    def release(self, ref_id):
+        with self.lock:
+            self.pending_releases.append(ref_id)
+
+class RemoteObject:
+    """Client-side proxy for an object living in the browser-owner process"""
+    
+    def __init__(self, client, ref_id, methods, iterator):
+        self._client = client
+        self._ref_id = ref_id
+        self._methods = set(methods) if methods is not None else None
+        self._iterator = iterator
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._methods is not None and name in self._methods:
+            return self._method(name)
+        
+        value = self._client.request('getattr', self._ref_id, name)
+        if value == ('method',):
+            return self._method(name)
+        return value
+    
+    def _method(self, name):
+        def call(*args, **kwargs):
+            return self._client.request('call', self._ref_id, name, args, kwargs)
+        return call
+    
+    def __getitem__(self, key):
+        return self._client.request('getitem', self._ref_id, key)
+    
+    def __contains__(self, key):
+        return self._client.request('contains', self._ref_id, key)
+    
+    def __iter__(self):
+        if self._iterator:
+            return self
+        return self._client.request('call', self._ref_id, '__iter__')
+    
+    def __next__(self):
+        return self._client.request('next', self._ref_id)
+    
+    def __bool__(self):
+        return True
+    
+    def __del__(self):
+        if self._methods is not None:
+            self._client.release(self._ref_id)
+
+def browser_owner_address():
+    """BROWSER_OWNER_ADDRESS as a Unix socket path, or a (host, port) tuple for host:port"""
+    address = os.environ.get('BROWSER_OWNER_ADDRESS', '')
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit() and '/' not in address:
+        return (host, int(port))
+    return address or None
+
+def browser_owner_authkey():
+    authkey = os.environ.get('BROWSER_OWNER_AUTHKEY')
+    return authkey.encode('utf-8') if authkey else None
+
+# Global bot pool; `bot` is the first (or only) account. With BROWSER_OWNER_ADDRESS set,
+# web workers proxy to the one process that owns the browsers (python main.py owner).
+RUN_AS_BROWSER_OWNER = __name__ == '__main__' and sys.argv[1:2] == ['owner']
+BROWSER_OWNER = browser_owner_address()
+BROWSER_OWNER_CLIENT = bool(BROWSER_OWNER) and not RUN_AS_BROWSER_OWNER
 
-# Global bot instance
-bot = WhatsAppBot()
+if BROWSER_OWNER_CLIENT:
+    pool = BrowserOwnerClient(BROWSER_OWNER, browser_owner_authkey()).root('pool')
+else:
+    pool = BotPool()
+bot = pool.get()
+
+if os.environ.get('WARM_START', '').lower() in ('1', 'true', 'yes') and not BROWSER_OWNER_CLIENT:
+    pool.warm_up()
+
+def open_bulk_rows(stream, fmt, template=None, invalid_numbers=None, message_required=True):
+    """Start parsing a bulk upload, checking a CSV header against template up front
+    
+    Raises ValueError when the header lacks template variables, so a bad
+    upload is rejected before anything is sent.
+    """
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    
+    if fmt == 'csv':
+        records = csv.DictReader(text_stream)
+        if template:
+            missing = sorted(template.variables - set(records.fieldnames or []))
+            if missing:
+                raise ValueError(f"CSV is missing template columns: {', '.join(missing)}")
+    else:
+        records = iter_jsonl(text_stream)
+    
+    return iter_bulk_rows(records, template, invalid_numbers, message_required)
+
+def iter_bulk_rows(records, template=None, invalid_numbers=None, message_required=True):
+    """Lazily turn parsed CSV/JSONL records into send rows, with an 'error' key on unusable ones"""
+    for index, record in enumerate(records, start=1):
+        if isinstance(record, Exception):
+            yield {'row': index, 'phone_number': None, 'error': f'Invalid JSON: {record}'}
+            continue
+        
+        raw_number = str(record.get('phone_number') or record.get('phone') or '').strip()
+        phone_number, error = recipients.normalize(raw_number)
+        phone_number = phone_number or raw_number
+        if not error and invalid_numbers and invalid_numbers.contains(phone_number):
+            error = f"{phone_number} is not registered on WhatsApp"
+        
+        if template:
+            variables = record.get('variables') if isinstance(record.get('variables'), dict) else record
+            missing = template.missing(variables)
+            if missing:
+                error = error or f"Missing template variables: {', '.join(missing)}"
+                message_text = ''
+            else:
+                message_text = template.render(variables).strip()
+        else:
+            message_text = str(record.get('message') or '').strip()
+        
+        if not error and not message_text and message_required:
+            error = 'Message text is required'
+        
+        row = {'row': index, 'phone_number': phone_number, 'message': message_text}
+        if isinstance(record.get('idempotency_key'), str) and record['idempotency_key']:
+            row['idempotency_key'] = record['idempotency_key']
+        if error:
+            row['error'] = error
+        yield row
+
+def iter_jsonl(text_stream):
+    """Yield one dict per non-empty JSONL line, or the parse exception for bad lines"""
+    for line in text_stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError('row must be a JSON object')
+            yield record
+        except ValueError as e:
+            yield e
+
+def request_template(template_id):
+    """Compiled template for template_id, or None if it is not registered"""
+    view = pool.templates.get(template_id)
+    return compile_template(view['text']) if view else None
+
+def unknown_template_response(template_id):
+    return jsonify({
+        'status': 'error',
+        'message': f'Unknown template: {template_id}'
+    }), 404
+
+class AttachmentRequest(Request):
+    """Request that streams attachment file parts into the spool directory, where Chrome can read them"""
+    
+    ATTACHMENT_ENDPOINTS = ('upload_attachment', 'send_message')
+    # Room for the form fields and part headers around the file itself
+    MULTIPART_OVERHEAD = 64 * 1024
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.spooled_paths = []
+    
+    def accepts_attachment(self):
+        return self.endpoint in self.ATTACHMENT_ENDPOINTS and self.mimetype == 'multipart/form-data'
+    
+    @property
+    def max_content_length(self):
+        if self.accepts_attachment():
+            return attachments.ATTACHMENT_MAX_BYTES + self.MULTIPART_OVERHEAD
+        return super().max_content_length
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if not self.accepts_attachment():
+            return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+        spooled = tempfile.NamedTemporaryFile(dir=attachments.spool_dir(), prefix='upload-', delete=False)
+        self.spooled_paths.append(spooled.name)
+        return spooled
+
+app.request_class = AttachmentRequest
+
+@app.teardown_request
+def remove_spooled_uploads(error=None):
+    for path in getattr(request, 'spooled_paths', ()):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+def store_upload(upload):
+    """Hand a spooled multipart file to the attachment store; returns (attachment, None) or (None, error)"""
+    if not isinstance(getattr(upload.stream, 'name', None), str):
+        return None, 'Attachments must be uploaded as multipart/form-data'
+    upload.stream.flush()
+    spooled_path = upload.stream.name
+    upload.close()
+    return pool.attachments.adopt(spooled_path, upload.filename, upload.mimetype)
+
+def attachment_too_large_response():
+    return jsonify({
+        'status': 'error',
+        'message': f'Attachment is larger than {attachments.ATTACHMENT_MAX_BYTES} bytes'
+    }), 413
+
+def unknown_attachment_response(attachment_id):
+    return jsonify({
+        'status': 'error',
+        'message': f'Unknown or expired attachment: {attachment_id}'
+    }), 404
+
+def request_account():
+    """Account key from the JSON body, form or query string, or None"""
+    data = request.get_json(silent=True) or {}
+    account_id = data.get('account') or request.values.get('account')
+    return account_id.strip() if isinstance(account_id, str) and account_id.strip() else None
+
+def unknown_account_response(account_id):
+    return jsonify({
+        'status': 'error',
+        'message': f'Unknown account: {account_id}'
+    }), 404
 
 @app.route('/')
 def index():
@@ -614,12 +4258,18 @@ def index():
 @app.route('/setup_qr', methods=['POST'])
 def setup_qr():
     try:
-        success, message, qr_image = bot.get_qr_code()
+        account_id = request_account()
+        account_bot = pool.get(account_id)
+        if not account_bot:
+            return unknown_account_response(account_id)
+        
+        success, message, qr_image = account_bot.get_qr_code()
         
         if success:
             response_data = {
                 'status': 'success',
-                'message': message
+                'message': message,
+                'account': account_bot.account_id
             }
             
             # Include QR code image if available
@@ -643,12 +4293,26 @@ def setup_qr():
 @app.route('/check_login', methods=['GET'])
 def check_login():
     try:
-        success, message = bot.check_login_status()
+        account_id = request_account()
+        account_bot = pool.get(account_id)
+        if not account_bot:
+            return unknown_account_response(account_id)
         
+        watcher = pool.watchers[account_bot.account_id]
+        watcher.ensure_started()
+        
+        if request.args.get('live') in ('1', 'true', 'yes'):
+            # Explicit live check against the driver (the pre-watcher behaviour)
+            account_bot.check_login_status()
+        
+        snapshot = watcher.snapshot()
         return jsonify({
-            'status': 'success' if success else 'error',
-            'message': message,
-            'logged_in': success
+            'status': 'success' if snapshot['logged_in'] else 'error',
+            'message': snapshot['message'],
+            'logged_in': snapshot['logged_in'],
+            'state': snapshot['state'],
+            'age_seconds': snapshot['age_seconds'],
+            'account': account_bot.account_id
         })
         
     except Exception as e:
@@ -659,10 +4323,135 @@ def check_login():
             'logged_in': False
         }), 500
 
+# Each open SSE stream pins a worker thread for as long as the client stays connected
+SSE_SLOTS = threading.BoundedSemaphore(int(os.environ.get('SSE_MAX_CONNECTIONS', 4)))
+
+def sse_response(stream):
+    """Stream SSE frames, or 503 when SSE_MAX_CONNECTIONS streams are already open in this process"""
+    if not SSE_SLOTS.acquire(blocking=False):
+        logger.warning("Rejected an event stream: SSE_MAX_CONNECTIONS reached")
+        return jsonify({
+            'status': 'error',
+            'message': 'Too many open event streams, retry later'
+        }), 503, {'Retry-After': '5'}
+    response = Response(
+        stream,
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    response.call_on_close(SSE_SLOTS.release)
+    return response
+
+@app.route('/events/login', methods=['GET'])
+def login_events():
+    """Server-Sent Events stream of login state transitions for one account; ?qr=1 adds the QR events"""
+    account_id = request_account()
+    account_bot = pool.get(account_id)
+    if not account_bot:
+        return unknown_account_response(account_id)
+    
+    watcher = pool.watchers[account_bot.account_id]
+    watcher.ensure_started()
+    initial = [('login_state', dict(watcher.snapshot(), account=account_bot.account_id))]
+    also = ()
+    # One stream per dashboard instead of two, since each holds an SSE slot
+    if request.args.get('qr') in ('1', 'true', 'yes'):
+        qr = watcher.current_qr()
+        if qr['fingerprint']:
+            initial.append(('qr', qr))
+        also = (watcher.qr_events,)
+    
+    return sse_response(watcher.events.stream(initial, also=also))
+
+@app.route('/events/inbound', methods=['GET'])
+def inbound_events():
+    """Server-Sent Events stream of incoming messages for one account; ?replay=N first resends the last N"""
+    account_id = request_account()
+    account_bot = pool.get(account_id)
+    if not account_bot:
+        return unknown_account_response(account_id)
+    
+    inbound = account_bot.inbound
+    if not inbound.enabled:
+        return jsonify({'status': 'error', 'message': 'Inbound messages are disabled (INBOUND_MESSAGES=0)'}), 404
+    inbound.ensure_started()
+    try:
+        replay = max(0, int(request.args.get('replay', 0)))
+    except ValueError:
+        replay = 0
+    initial = [('message', message) for message in inbound.replay(replay)]
+    
+    return sse_response(inbound.events.stream(initial))
+
+@app.route('/qr', methods=['GET'])
+def current_qr():
+    """Long-poll for the QR code: returns at once if it differs from ?since=<fingerprint>,
+    otherwise waits up to ?timeout seconds for the next rotation"""
+    account_id = request_account()
+    account_bot = pool.get(account_id)
+    if not account_bot:
+        return unknown_account_response(account_id)
+    
+    watcher = pool.watchers[account_bot.account_id]
+    watcher.ensure_started()
+    since = request.args.get('since')
+    try:
+        timeout = min(float(request.args.get('timeout', 25)), 60)
+    except ValueError:
+        timeout = 25
+    
+    qr = watcher.current_qr()
+    if since and qr['fingerprint'] == since:
+        subscriber = watcher.qr_events.subscribe()
+        try:
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                try:
+                    subscriber.get(timeout=max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                qr = watcher.current_qr()
+                if qr['fingerprint'] != since:
+                    break
+        finally:
+            watcher.qr_events.unsubscribe(subscriber)
+    
+    return jsonify(dict(
+        qr,
+        status='success',
+        changed=qr['fingerprint'] != since,
+        login_state=watcher.snapshot()['state']
+    ))
+
+@app.route('/events/qr', methods=['GET'])
+def qr_events():
+    """Server-Sent Events stream that pushes a QR image only when it rotates"""
+    account_id = request_account()
+    account_bot = pool.get(account_id)
+    if not account_bot:
+        return unknown_account_response(account_id)
+    
+    watcher = pool.watchers[account_bot.account_id]
+    watcher.ensure_started()
+    qr = watcher.current_qr()
+    initial = [('qr', qr)] if qr['fingerprint'] else []
+    
+    return sse_response(watcher.qr_events.stream(initial))
+
 @app.route('/send_message', methods=['POST'])
 def send_message():
+    """Send a text message, or a file captioned with the message
+    
+    Accepts JSON, or multipart/form-data with the same fields plus the file
+    under 'file'. A previously uploaded file is sent by attachment_id.
+    """
     try:
-        data = request.get_json()
+        upload = None
+        if request.mimetype == 'multipart/form-data':
+            data = request.form.to_dict()
+            upload = request.files.get('file')
+        else:
+            data = request.get_json()
         
         if not data:
             return jsonify({
@@ -679,53 +4468,469 @@ def send_message():
                 'message': 'Phone number is required'
             }), 400
         
-        if not message_text:
+        template_id = data.get('template_id')
+        if template_id:
+            template = request_template(template_id)
+            if not template:
+                return unknown_template_response(template_id)
+            
+            variables = data.get('variables') or {}
+            if isinstance(variables, str):
+                # Multipart forms carry variables as a JSON string
+                try:
+                    variables = json.loads(variables)
+                except ValueError:
+                    variables = None
+            missing = template.missing(variables) if isinstance(variables, dict) else sorted(template.variables)
+            if missing:
+                return jsonify({
+                    'status': 'error',
+                    'message': f"Missing template variables: {', '.join(missing)}"
+                }), 400
+            message_text = template.render(variables).strip()
+        
+        attachment_id = data.get('attachment_id') or None
+        if not message_text and not attachment_id and not upload:
             return jsonify({
                 'status': 'error',
                 'message': 'Message text is required'
             }), 400
         
-        if not phone_number.startswith('+'):
+        phone_number, phone_error = recipients.normalize(phone_number)
+        if phone_error:
             return jsonify({
                 'status': 'error',
-                'message': 'Phone number must include country code (e.g., +91xxxxxxxxxx)'
+                'message': phone_error
             }), 400
         
-        clean_number = phone_number.replace('+', '').replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-        if len(clean_number) < 8 or len(clean_number) > 15:
+        if pool.invalid_numbers.contains(phone_number):
             return jsonify({
                 'status': 'error',
-                'message': 'Invalid phone number length'
+                'message': f'{phone_number} is not registered on WhatsApp'
             }), 400
         
-        success, message = bot.send_message(phone_number, message_text)
+        if upload:
+            attachment, attachment_error = store_upload(upload)
+            if attachment_error:
+                return jsonify({
+                    'status': 'error',
+                    'message': attachment_error
+                }), 400
+            attachment_id = attachment['id']
+        elif attachment_id and not pool.attachments.describe(attachment_id):
+            return unknown_attachment_response(attachment_id)
         
-        if success:
+        account_id = pool.route(request_account())
+        if not account_id:
+            return unknown_account_response(request_account())
+        
+        async_mode = data.get('async', request.args.get('async', ''))
+        if async_mode in (True, 1, '1', 'true', 'yes'):
+            try:
+                priority = int(data.get('priority', 0))
+            except (TypeError, ValueError):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Priority must be an integer'
+                }), 400
+            
+            idempotency_key = data.get('idempotency_key') or request.headers.get('Idempotency-Key')
+            if idempotency_key is not None and not isinstance(idempotency_key, str):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'idempotency_key must be a string'
+                }), 400
+            
+            job, retry_after = pool.queues[account_id].submit(
+                phone_number, message_text, priority, idempotency_key, attachment_id=attachment_id)
+            if not job:
+                response = jsonify({
+                    'status': 'error',
+                    'message': 'Send queue is full, retry later',
+                    'retry_after': retry_after
+                })
+                response.headers['Retry-After'] = str(retry_after)
+                return response, 429
+            
+            if job.get('duplicate'):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'Duplicate idempotency key; message already accepted',
+                    'job_id': job['id'],
+                    'job': job
+                }), 409
+            
             return jsonify({
-                'status': 'success',
-                'message': message
+                'status': 'queued',
+                'message': 'Message queued for sending',
+                'job_id': job['id'],
+                'job': job
+            }), 202
+        
+        max_wait = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 30))
+        if pool.governors[account_id].acquire(phone_number, max_wait=max_wait) is None:
+            retry_after = max(1, int(math.ceil(pool.governors[account_id].check(phone_number))))
+            response = jsonify({
+                'status': 'error',
+                'message': 'Send rate limit reached, retry later',
+                'retry_after': retry_after,
+                'account': account_id
             })
+            response.headers['Retry-After'] = str(retry_after)
+            return response, 429
+        
+        receipt_id = uuid.uuid4().hex if RECEIPT_TRACKING and not attachment_id else None
+        success, message = pool.get(account_id).send_message(
+            phone_number, message_text, attachment_id=attachment_id, receipt_id=receipt_id)
+        
+        result = {
+            'status': 'success' if success else 'error',
+            'message': message,
+            'account': account_id
+        }
+        if attachment_id:
+            result['attachment_id'] = attachment_id
+        if success and receipt_id:
+            # Follow delivery with GET /receipts/<receipt_id>
+            result['receipt_id'] = receipt_id
+        return (jsonify(result), 200) if success else (jsonify(result), 400)
+    
+    except RequestEntityTooLarge:
+        return attachment_too_large_response()
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/send_bulk', methods=['POST'])
+def send_bulk():
+    """Stream a CSV or JSONL recipient list through one browser session, answering with NDJSON"""
+    try:
+        upload = request.files.get('file')
+        content_type = (upload.mimetype if upload else request.mimetype) or ''
+        fmt = request.args.get('format', '').lower()
+        if not fmt:
+            fmt = 'csv' if 'csv' in content_type or (upload and upload.filename.lower().endswith('.csv')) else 'jsonl'
+        
+        if fmt not in ('csv', 'jsonl'):
+            return jsonify({
+                'status': 'error',
+                'message': 'Format must be csv or jsonl'
+            }), 400
+        
+        account_id = pool.route(request.args.get('account'))
+        if not account_id:
+            return unknown_account_response(request.args.get('account'))
+        
+        template = None
+        template_id = request.args.get('template_id')
+        if template_id:
+            template = request_template(template_id)
+            if not template:
+                return unknown_template_response(template_id)
+        
+        # One stored file for every recipient; each row's message becomes its caption
+        attachment_id = request.args.get('attachment_id')
+        if attachment_id and not pool.attachments.describe(attachment_id):
+            return unknown_attachment_response(attachment_id)
+        
+        try:
+            rows = open_bulk_rows(upload.stream if upload else request.stream, fmt, template, pool.invalid_numbers,
+                                  message_required=not attachment_id)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        
+        # Row keys default to "<key>:<row number>", so resending a batch skips the rows already accepted
+        idempotency_key = request.args.get('idempotency_key') or request.headers.get('Idempotency-Key')
+        
+        account_bot = pool.get(account_id)
+        
+        def generate():
+            for result in account_bot.send_bulk(rows, attachment_id=attachment_id, idempotency_key=idempotency_key):
+                yield json.dumps(result) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        logger.error(f"Send bulk route error: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/receipts/<receipt_id>', methods=['GET'])
+def receipt_status(receipt_id):
+    """Delivery state (pending/sent/delivered/read, with timestamps) of a sent message
+    
+    receipt_id is the receipt_id of a synchronous or bulk send, or the job id of an async one.
+    """
+    receipt = pool.find_receipt(receipt_id)
+    if not receipt:
+        return jsonify({
+            'status': 'error',
+            'message': f'Unknown receipt: {receipt_id}'
+        }), 404
+    return jsonify({
+        'status': 'success',
+        'receipt': receipt
+    })
+
+@app.route('/attachments', methods=['POST'])
+def upload_attachment():
+    """Upload a file (multipart field 'file') once, to send by attachment_id to any number of recipients"""
+    try:
+        upload = request.files.get('file')
+        if not upload:
+            return jsonify({
+                'status': 'error',
+                'message': "Upload the file as multipart/form-data field 'file'"
+            }), 400
+        
+        attachment, error = store_upload(upload)
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 400
+        
+        return jsonify({
+            'status': 'success',
+            'attachment_id': attachment['id'],
+            'attachment': attachment
+        }), 200 if attachment.get('reused') else 201
+    
+    except RequestEntityTooLarge:
+        return attachment_too_large_response()
+    except Exception as e:
+        logger.error(f"Attachment upload error: {e}")
+        return jsonify({
+            'status': 'error',
+            'message': f'Server error: {str(e)}'
+        }), 500
+
+@app.route('/attachments/<attachment_id>', methods=['GET', 'DELETE'])
+def attachment_detail(attachment_id):
+    if request.method == 'DELETE':
+        if not pool.attachments.delete(attachment_id):
+            return unknown_attachment_response(attachment_id)
+        return jsonify({
+            'status': 'success',
+            'message': f'Attachment {attachment_id} deleted'
+        })
+    
+    attachment = pool.attachments.describe(attachment_id)
+    if not attachment:
+        return unknown_attachment_response(attachment_id)
+    return jsonify({
+        'status': 'success',
+        'attachment': attachment
+    })
+
+@app.route('/templates', methods=['GET', 'POST'])
+def templates():
+    """List templates, or register one from {"text": ..., "template_id": optional}"""
+    if request.method == 'GET':
+        return jsonify({
+            'status': 'success',
+            'templates': pool.templates.list()
+        })
+    
+    data = request.get_json(silent=True) or {}
+    text = data.get('text')
+    template_id = data.get('template_id')
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({
+            'status': 'error',
+            'message': 'Template text is required'
+        }), 400
+    
+    if template_id is not None and not (isinstance(template_id, str) and re.match(r'^[A-Za-z0-9_-]{1,64}$', template_id)):
+        return jsonify({
+            'status': 'error',
+            'message': 'template_id must be 1-64 letters, digits, _ or -'
+        }), 400
+    
+    template, error = pool.templates.register(text, template_id)
+    if error:
+        return jsonify({
+            'status': 'error',
+            'message': error
+        }), 400
+    
+    return jsonify(dict(template, status='success')), 201
+
+@app.route('/templates/<template_id>', methods=['GET', 'DELETE'])
+def template_detail(template_id):
+    if request.method == 'DELETE':
+        if not pool.templates.delete(template_id):
+            return unknown_template_response(template_id)
+        return jsonify({
+            'status': 'success',
+            'message': f'Template {template_id} deleted'
+        })
+    
+    template = pool.templates.get(template_id)
+    if not template:
+        return unknown_template_response(template_id)
+    return jsonify(dict(template, status='success'))
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = pool.find_job(job_id)
+    if not job:
+        return jsonify({
+            'status': 'error',
+            'message': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'job': job
+    })
+
+@app.route('/jobs', methods=['GET', 'POST'])
+def jobs_status():
+    """Bulk status: ?ids=a,b or {"ids": [...]}; queue stats when no ids are given"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            job_ids = data.get('ids') or []
         else:
+            job_ids = [job_id for job_id in request.args.get('ids', '').split(',') if job_id]
+        
+        if not isinstance(job_ids, list):
             return jsonify({
                 'status': 'error',
-                'message': message
+                'message': 'ids must be a list of job ids'
             }), 400
-            
+        
+        found, missing = pool.find_jobs(job_ids)
+        return jsonify({
+            'status': 'success',
+            'jobs': found,
+            'missing': missing,
+            'queues': pool.queue_stats()
+        })
+        
     except Exception as e:
+        logger.error(f"Jobs route error: {e}")
         return jsonify({
             'status': 'error',
             'message': f'Server error: {str(e)}'
         }), 500
 
+@app.route('/invalid_numbers/<phone_number>', methods=['DELETE'])
+def forget_invalid_number(phone_number):
+    """Drop a number from the not-on-WhatsApp cache (e.g. after its owner signed up)"""
+    normalized, phone_error = recipients.normalize(phone_number)
+    if phone_error:
+        return jsonify({
+            'status': 'error',
+            'message': phone_error
+        }), 400
+    
+    if not pool.invalid_numbers.discard(normalized):
+        return jsonify({
+            'status': 'error',
+            'message': f'{normalized} is not in the invalid number cache'
+        }), 404
+    
+    return jsonify({
+        'status': 'success',
+        'message': f'{normalized} removed from the invalid number cache'
+    })
+
+@app.route('/rate_limit', methods=['GET'])
+def rate_limit():
+    """Current send budget per account (or ?account=) so upstream systems can pace themselves"""
+    account_id = request.args.get('account')
+    if account_id and not pool.route(account_id):
+        return unknown_account_response(account_id)
+    
+    return jsonify({
+        'status': 'success',
+        'rate_limit': pool.rate_budgets([account_id] if account_id else None)
+    })
+
+@app.route('/wait_stats', methods=['GET'])
+def wait_stats():
+    return jsonify({
+        'status': 'success',
+        'waits': pool.wait_summaries()
+    })
+
+@app.route('/pool', methods=['GET'])
+def pool_status():
+    return jsonify({
+        'status': 'success',
+        'pool': pool.health()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(pool.render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({
+        'status': 'ok',
+        'uptime_seconds': round(time.time() - PROCESS_STARTED_AT, 3),
+        'selenium_available': SELENIUM_AVAILABLE
+    })
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: 200 once an account (or ?account=) is logged in and can send immediately"""
+    account_id = request.args.get('account')
+    try:
+        readiness = pool.readiness()
+    except Exception as e:
+        if not BROWSER_OWNER_CLIENT:
+            raise
+        logger.warning(f"Browser owner unreachable: {e}")
+        return jsonify({'status': 'not_ready', 'ready': False, 'message': f'Browser owner unreachable: {e}'}), 503
+    
+    if account_id:
+        if account_id not in readiness['accounts']:
+            return unknown_account_response(account_id)
+        readiness = {
+            'ready': readiness['accounts'][account_id]['ready'],
+            'accounts': {account_id: readiness['accounts'][account_id]}
+        }
+    
+    return jsonify(dict(readiness, status='ready' if readiness['ready'] else 'not_ready')), \
+        200 if readiness['ready'] else 503
+
 @app.route('/close_session', methods=['POST'])
 def close_session():
     try:
-        success, message = bot.close_session()
+        account_id = request_account()
+        if account_id:
+            account_bot = pool.get(account_id)
+            if not account_bot:
+                return unknown_account_response(account_id)
+            success, message = account_bot.close_session()
+        else:
+            results = pool.close_sessions()
+            failures = [message for ok, message in results if not ok]
+            success = not failures
+            if failures:
+                message = failures[0] if len(results) == 1 else \
+                    f"{len(failures)} of {len(results)} sessions failed to close: {failures[0]}"
+            else:
+                message = results[0][1] if len(results) == 1 else f"Closed {len(results)} account sessions"
         
-        return jsonify({
-            'status': 'success',
+        result = {
+            'status': 'success' if success else 'error',
             'message': message
-        })
+        }
+        return (jsonify(result), 200) if success else (jsonify(result), 500)
         
     except Exception as e:
         return jsonify({
@@ -733,15 +4938,25 @@ def close_session():
             'message': f'Server error: {str(e)}'
         }), 500
 
-# Clean up on exit
+# Clean up on exit; in a web worker the browser-owner process does this
 def cleanup():
-    bot.close_session()
+    if not BROWSER_OWNER_CLIENT:
+        pool.shutdown()
 
 atexit.register(cleanup)
 
-if __name__ == '__main__':
+if __name__ == '__main__' and RUN_AS_BROWSER_OWNER:
+    if not BROWSER_OWNER:
+        sys.exit("BROWSER_OWNER_ADDRESS must be set to run the browser owner")
+    if isinstance(BROWSER_OWNER, tuple) and not browser_owner_authkey():
+        sys.exit("BROWSER_OWNER_AUTHKEY must be set when BROWSER_OWNER_ADDRESS is host:port")
+    # Exit through atexit (and pool.shutdown) when the supervisor terminates us
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    BrowserOwner(BROWSER_OWNER, {'pool': pool}, browser_owner_authkey()).serve_forever()
+
+elif __name__ == '__main__':
     print("Starting WhatsApp Bot Flask Service...")
-    print("Make sure you have installed: pip install selenium pillow")
+    print("Make sure you have installed: pip install selenium")
     print("And Chrome browser is installed on your system")
     print("Server will be available at: http://localhost:5000")
     
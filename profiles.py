@@ -0,0 +1,228 @@
+"""Chrome profiles restored from a trimmed snapshot onto tmpfs, with session state synced back to disk"""
+
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tarfile
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Caches Chrome and WhatsApp Web rebuild on their own. Everything else (IndexedDB
+# with the WhatsApp keys, Local Storage, Cookies, Service Worker registrations) is kept.
+DEFAULT_TRIM = (
+    'Cache', 'Code Cache', 'GPUCache', 'ShaderCache', 'GrShaderCache', 'GraphiteDawnCache',
+    'DawnGraphiteCache', 'DawnWebGPUCache', 'Service Worker/CacheStorage', 'Service Worker/ScriptCache',
+    'optimization_guide_model_store', 'Crashpad', 'component_crx_cache', 'BrowserMetrics',
+    'Safe Browsing', 'segmentation_platform', 'Download Service', 'blob_storage'
+)
+
+# Files tied to the running Chrome instance; copying them makes the next launch think the profile is in use
+VOLATILE = ('SingletonLock', 'SingletonCookie', 'SingletonSocket', 'RunningChromeVersion', 'BrowserMetrics-spare.pma')
+
+
+def trimmed(relpath, trim):
+    """True if relpath (posix, relative to the profile root) falls under one of the trim paths"""
+    wrapped = f"/{relpath}/"
+    return any(f"/{path}/" in wrapped for path in trim)
+
+
+def iter_profile(root, trim):
+    """(relpath, path, stat) for every file that belongs in a snapshot of root"""
+    for directory, dirnames, filenames in os.walk(root):
+        reldir = os.path.relpath(directory, root).replace(os.sep, '/')
+        reldir = '' if reldir == '.' else reldir + '/'
+        dirnames[:] = sorted(name for name in dirnames if not trimmed(reldir + name, trim))
+        for name in sorted(filenames):
+            relpath = reldir + name
+            path = os.path.join(directory, name)
+            if name in VOLATILE or trimmed(relpath, trim) or os.path.islink(path):
+                continue
+            try:
+                yield relpath, path, os.stat(path)
+            except OSError:
+                # Chrome deleted it while we were walking
+                continue
+
+
+def fingerprint(root, trim):
+    """Hash of the names, sizes and mtimes of the files a snapshot would contain"""
+    digest = hashlib.sha256()
+    for relpath, _, stat in iter_profile(root, trim):
+        digest.update(f"{relpath}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8', 'surrogateescape'))
+    return digest.hexdigest()
+
+
+def profile_size(root, trim):
+    return sum(stat.st_size for _, _, stat in iter_profile(root, trim))
+
+
+class ProfileSnapshot:
+    """One bot's Chrome profile, run from tmpfs and persisted as a trimmed tar snapshot (PROFILE_SNAPSHOT=1)"""
+
+    def __init__(self, user_data_dir, enabled=None, tmpfs=None, trim=None):
+        self.user_data_dir = os.path.abspath(user_data_dir)
+        if enabled is None:
+            enabled = os.environ.get('PROFILE_SNAPSHOT', '0').lower() in ('1', 'true', 'yes')
+        self.enabled = enabled
+        self.tmpfs = tmpfs or os.environ.get('PROFILE_TMPFS', '/dev/shm')
+        if trim is None:
+            configured = os.environ.get('PROFILE_TRIM')
+            trim = configured.split(',') if configured else DEFAULT_TRIM
+        self.trim = tuple(path.strip().strip('/') for path in trim if path.strip())
+        self.headroom = float(os.environ.get('PROFILE_TMPFS_HEADROOM_MB', 256)) * 1024 * 1024
+        self.snapshot_path = f"{self.user_data_dir}.snapshot.tar"
+        self.runtime_dir = os.path.join(self.tmpfs, f"whatsapp-{os.path.basename(self.user_data_dir)}")
+        self.lock = threading.Lock()
+        self.mode = 'disk'
+        self.restored = False
+        self.synced_fingerprint = None
+        self.syncs = self.unchanged_syncs = self.failed_syncs = 0
+        self.restore_seconds = None
+        self.sync_seconds = None
+        self.launch_started = None
+        self.awaiting_ready = False
+        self.launches = deque(maxlen=20)
+
+    def launch_dir(self):
+        """The --user-data-dir for the next Chrome launch, restoring onto tmpfs first when enabled"""
+        if not self.enabled:
+            self.mode = 'disk'
+            return self.user_data_dir
+        with self.lock:
+            if not self.restored:
+                try:
+                    self.restore()
+                except Exception as e:
+                    logger.error(f"Could not restore profile onto {self.tmpfs}, using {self.user_data_dir}: {e}")
+                    shutil.rmtree(self.runtime_dir, ignore_errors=True)
+                    self.mode = 'disk'
+            return self.runtime_dir if self.mode == 'tmpfs' else self.user_data_dir
+
+    def restore(self):
+        """Populate runtime_dir from the snapshot, or from a trimmed copy of the disk profile (caller holds the lock)"""
+        started = time.monotonic()
+        has_snapshot = os.path.exists(self.snapshot_path)
+        if has_snapshot:
+            needed = os.path.getsize(self.snapshot_path)
+        elif os.path.isdir(self.user_data_dir):
+            needed = profile_size(self.user_data_dir, self.trim)
+        else:
+            needed = 0
+
+        if not os.path.isdir(self.tmpfs):
+            raise OSError(f"{self.tmpfs} does not exist")
+        free = shutil.disk_usage(self.tmpfs).free
+        if free < needed + self.headroom:
+            raise OSError(f"only {free // (1024 * 1024)} MB free, need {(needed + self.headroom) // (1024 * 1024)} MB")
+
+        shutil.rmtree(self.runtime_dir, ignore_errors=True)
+        os.makedirs(self.runtime_dir)
+        if has_snapshot:
+            with tarfile.open(self.snapshot_path, 'r') as tar:
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extractall(self.runtime_dir, filter='data')
+                else:
+                    tar.extractall(self.runtime_dir)
+        elif needed:
+            for relpath, path, _ in iter_profile(self.user_data_dir, self.trim):
+                target = os.path.join(self.runtime_dir, *relpath.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                try:
+                    shutil.copy2(path, target)
+                except OSError:
+                    continue
+
+        self.synced_fingerprint = fingerprint(self.runtime_dir, self.trim) if has_snapshot else None
+        self.restore_seconds = round(time.monotonic() - started, 3)
+        self.mode = 'tmpfs'
+        self.restored = True
+        source = self.snapshot_path if has_snapshot else self.user_data_dir
+        logger.info(f"Restored profile from {source} to {self.runtime_dir} "
+                    f"({needed // 1024} KB in {self.restore_seconds}s)")
+
+    def sync(self):
+        """Write runtime_dir back as the snapshot if its session state changed; returns True if written
+
+        Only call this after driver.quit() of a logged-in browser, so the snapshot is consistent and known-good.
+        """
+        if self.mode != 'tmpfs' or not self.restored:
+            return False
+        with self.lock:
+            started = time.monotonic()
+            try:
+                current = fingerprint(self.runtime_dir, self.trim)
+                if current == self.synced_fingerprint:
+                    self.unchanged_syncs += 1
+                    return False
+                tmp_path = f"{self.snapshot_path}.tmp"
+                with tarfile.open(tmp_path, 'w') as tar:
+                    for relpath, path, stat in iter_profile(self.runtime_dir, self.trim):
+                        try:
+                            with open(path, 'rb') as f:
+                                data = f.read()
+                        except OSError:
+                            continue
+                        info = tarfile.TarInfo(relpath)
+                        info.size = len(data)
+                        info.mtime = stat.st_mtime
+                        info.mode = stat.st_mode & 0o777
+                        tar.addfile(info, io.BytesIO(data))
+                    tar.fileobj.flush()
+                    os.fsync(tar.fileobj.fileno())
+                os.replace(tmp_path, self.snapshot_path)
+                self.synced_fingerprint = current
+                self.syncs += 1
+                self.sync_seconds = round(time.monotonic() - started, 3)
+                logger.info(f"Synced profile snapshot {self.snapshot_path} in {self.sync_seconds}s")
+                return True
+            except Exception as e:
+                self.failed_syncs += 1
+                logger.error(f"Error syncing profile snapshot: {e}")
+                return False
+
+    def release(self):
+        """Free the tmpfs copy after the browser has exited; the next launch restores it again"""
+        with self.lock:
+            if self.restored:
+                shutil.rmtree(self.runtime_dir, ignore_errors=True)
+                self.restored = False
+
+    def launching(self):
+        self.launch_started = time.monotonic()
+
+    def launched(self):
+        """Record that Chrome is up; returns the launch time in seconds"""
+        seconds = round(time.monotonic() - self.launch_started, 3)
+        self.launches.append({'mode': self.mode, 'launch_seconds': seconds, 'ready_seconds': None, 'at': time.time()})
+        self.awaiting_ready = True
+        return seconds
+
+    def ready(self):
+        """Record the first logged-in page since the last launch; returns seconds since launch started, or None"""
+        if not self.awaiting_ready or not self.launches:
+            return None
+        self.awaiting_ready = False
+        seconds = round(time.monotonic() - self.launch_started, 3)
+        self.launches[-1]['ready_seconds'] = seconds
+        return seconds
+
+    def stats(self):
+        snapshot_exists = os.path.exists(self.snapshot_path)
+        return {
+            'enabled': self.enabled,
+            'mode': self.mode,
+            'user_data_dir': self.runtime_dir if self.mode == 'tmpfs' else self.user_data_dir,
+            'snapshot_bytes': os.path.getsize(self.snapshot_path) if snapshot_exists else None,
+            'snapshot_age_seconds': round(time.time() - os.path.getmtime(self.snapshot_path), 3) if snapshot_exists else None,
+            'restore_seconds': self.restore_seconds,
+            'sync_seconds': self.sync_seconds,
+            'syncs': self.syncs,
+            'unchanged_syncs': self.unchanged_syncs,
+            'failed_syncs': self.failed_syncs,
+            'launches': list(self.launches)
+        }
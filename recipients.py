@@ -0,0 +1,233 @@
+"""Recipient phone numbers: E.164 normalization and a cache of numbers not on WhatsApp"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from storage import DebouncedJsonWriter
+
+logger = logging.getLogger(__name__)
+
+# Separators people put in phone numbers; everything else must be digits
+SEPARATORS = re.compile(r'[\s\-().]')
+
+# Text of WhatsApp Web's popup for /send?phone=<number> when the number has no account.
+# Matched as the exact sentence so other dialogs mentioning "invalid" are not mistaken for it.
+# Override for non-English UIs.
+INVALID_NUMBER_TEXT = re.compile(
+    os.environ.get('INVALID_NUMBER_TEXT', r'phone\s+number\s+shared\s+via\s+url\s+is\s+invalid'), re.IGNORECASE
+)
+
+
+def normalize(phone_number):
+    """E.164 form of phone_number as (number, None), or (None, error message)"""
+    if phone_number is None or not str(phone_number).strip():
+        return None, 'Phone number is required'
+
+    number = SEPARATORS.sub('', str(phone_number).strip())
+    if number.lower().startswith('tel:'):
+        number = number[4:]
+    if number.startswith('00'):
+        number = '+' + number[2:]
+
+    if not number.startswith('+'):
+        return None, 'Phone number must include country code (e.g., +91xxxxxxxxxx)'
+
+    digits = number[1:]
+    if not (digits.isascii() and digits.isdigit()):
+        return None, 'Phone number may only contain digits after the country code +'
+
+    if len(digits) < 8 or len(digits) > 15:
+        return None, 'Invalid phone number length'
+
+    if digits[0] == '0':
+        return None, 'Country code cannot start with 0'
+
+    return '+' + digits, None
+
+
+def digits(phone_number):
+    """Digits of a normalized number, as used in WhatsApp URLs and chat search"""
+    return phone_number.lstrip('+')
+
+
+def is_invalid_number_notice(text):
+    return bool(text) and bool(INVALID_NUMBER_TEXT.search(text))
+
+
+class InvalidNumberCache:
+    """Numbers WhatsApp reported as not registered, expired after a TTL and capped as an LRU"""
+
+    def __init__(self, path=None, ttl=None, limit=None, debounce=None):
+        self.path = path if path is not None else os.environ.get('INVALID_NUMBERS_PATH', 'whatsapp_invalid_numbers.json')
+        # People do join WhatsApp later, so a negative answer is trusted for a week by default
+        self.ttl = ttl or float(os.environ.get('INVALID_NUMBER_TTL', 7 * 24 * 3600))
+        self.limit = limit or int(os.environ.get('INVALID_NUMBER_CACHE_SIZE', 100000))
+        if debounce is None:
+            debounce = float(os.environ.get('INVALID_NUMBERS_SAVE_DEBOUNCE', 5))
+        self.lock = threading.Lock()
+        self.numbers = OrderedDict()
+        self.hits = 0
+        self.writer = DebouncedJsonWriter(self.path, self.snapshot, debounce, 'invalid number cache')
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            now = time.time()
+            for number, recorded_at in sorted(saved.items(), key=lambda item: item[1]):
+                if now - recorded_at < self.ttl:
+                    self.numbers[number] = recorded_at
+            logger.info(f"Loaded {len(self.numbers)} numbers not on WhatsApp")
+        except Exception as e:
+            logger.error(f"Error loading invalid number cache: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.numbers)
+
+    def flush(self):
+        """Write pending changes now (at shutdown)"""
+        return self.writer.flush()
+
+    def contains(self, phone_number):
+        """True if phone_number is known not to be on WhatsApp"""
+        with self.lock:
+            recorded_at = self.numbers.get(phone_number)
+            if recorded_at is None:
+                return False
+            if time.time() - recorded_at >= self.ttl:
+                del self.numbers[phone_number]
+                return False
+            self.numbers.move_to_end(phone_number)
+            self.hits += 1
+            return True
+
+    def add(self, phone_number):
+        with self.lock:
+            self.numbers[phone_number] = time.time()
+            self.numbers.move_to_end(phone_number)
+            while len(self.numbers) > self.limit:
+                self.numbers.popitem(last=False)
+            self.writer.mark_dirty()
+        logger.info(f"Recorded {phone_number} as not on WhatsApp")
+
+    def discard(self, phone_number):
+        with self.lock:
+            if self.numbers.pop(phone_number, None) is None:
+                return False
+            self.writer.mark_dirty()
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.numbers), 'limit': self.limit, 'ttl_seconds': self.ttl, 'hits': self.hits,
+                'writes': self.writer.writes
+            }
+
+
+# A chat title that is a bare phone number, i.e. the chat has no saved contact name
+PHONE_TITLE = re.compile(r'^\+?[\d\s\-().]+$')
+
+
+def title_digits(title):
+    """Digits of a chat title that is a bare phone number, or None for names and group titles"""
+    title = (title or '').strip()
+    if not PHONE_TITLE.match(title):
+        return None
+    return re.sub(r'\D', '', title) or None
+
+
+class ChatIndex:
+    """Numbers the in-app chat search can open safely, learned from sends that opened the chat by URL
+
+    A chat qualifies when WhatsApp titles it with the bare number, so the
+    search result and the open chat's header can be matched on the exact
+    number. Anything else (no chat yet, saved contact names, groups) goes
+    straight to URL navigation without searching. Numbers whose search came
+    up empty are skipped for CHAT_SEARCH_MISS_TTL seconds (default a day).
+    Changes are saved as JSON at most every CHAT_INDEX_SAVE_DEBOUNCE seconds.
+    """
+
+    def __init__(self, path=None, ttl=None, limit=None, debounce=None):
+        self.path = path
+        self.ttl = ttl or float(os.environ.get('CHAT_SEARCH_MISS_TTL', 24 * 3600))
+        self.limit = limit or int(os.environ.get('CHAT_INDEX_SIZE', 100000))
+        if debounce is None:
+            debounce = float(os.environ.get('CHAT_INDEX_SAVE_DEBOUNCE', 5))
+        self.lock = threading.Lock()
+        self.chats = OrderedDict()
+        self.misses = {}
+        self.writer = DebouncedJsonWriter(path, self.snapshot, debounce, 'chat index')
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            for number, recorded_at in sorted(saved.get('chats', {}).items(), key=lambda item: item[1]):
+                self.chats[number] = recorded_at
+            now = time.time()
+            self.misses = {number: at for number, at in saved.get('misses', {}).items() if now - at < self.ttl}
+        except Exception as e:
+            logger.error(f"Error loading chat index: {e}")
+
+    def snapshot(self):
+        with self.lock:
+            return {'chats': dict(self.chats), 'misses': dict(self.misses)}
+
+    def flush(self):
+        """Write pending changes now (at shutdown)"""
+        return self.writer.flush()
+
+    def searchable(self, number):
+        """True if number's chat is titled with the number and its last search did not miss"""
+        with self.lock:
+            if number not in self.chats:
+                return False
+            missed_at = self.misses.get(number)
+            if missed_at is None:
+                return True
+            if time.time() - missed_at >= self.ttl:
+                del self.misses[number]
+                return True
+            return False
+
+    def learn(self, number, title):
+        """Record the header title seen in number's chat after a confirmed send"""
+        with self.lock:
+            if title_digits(title) != number:
+                # Saved under a name (or not read): the search could not be matched exactly
+                if self.chats.pop(number, None) is not None:
+                    self.writer.mark_dirty()
+                return
+            known = number in self.chats and number not in self.misses
+            self.chats[number] = time.time()
+            self.chats.move_to_end(number)
+            self.misses.pop(number, None)
+            while len(self.chats) > self.limit:
+                self.chats.popitem(last=False)
+            if not known:
+                self.writer.mark_dirty()
+
+    def miss(self, number):
+        with self.lock:
+            self.misses[number] = time.time()
+            self.writer.mark_dirty()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'chats': len(self.chats), 'misses': len(self.misses), 'miss_ttl_seconds': self.ttl,
+                'writes': self.writer.writes
+            }
@@ -0,0 +1,62 @@
+"""File helpers shared by the JSON-backed stores"""
+
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def atomic_write_json(path, data):
+    """Write data to path as JSON, replacing the file only once the new copy is on disk"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class DebouncedJsonWriter:
+    """Coalesces a store's changes into one atomic write per `debounce` seconds, off the caller's thread"""
+
+    def __init__(self, path, snapshot, debounce, name='store'):
+        self.path = path
+        # Returns the data to write; takes the store's own lock, so never call flush() while holding it
+        self.snapshot = snapshot
+        self.debounce = debounce
+        self.name = name
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.timer = None
+        self.writes = 0
+
+    def mark_dirty(self):
+        """Schedule a write; safe to call while holding the store's lock"""
+        if not self.path:
+            return
+        with self.lock:
+            if self.timer:
+                return
+            self.timer = threading.Timer(self.debounce, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self):
+        """Write now if a write is pending; returns True if the file was written"""
+        with self.lock:
+            timer, self.timer = self.timer, None
+        if not timer:
+            # Let a write already under way finish before reporting nothing to do
+            with self.write_lock:
+                return False
+        timer.cancel()
+        with self.write_lock:
+            try:
+                atomic_write_json(self.path, self.snapshot())
+                self.writes += 1
+                return True
+            except Exception as e:
+                logger.error(f"Error saving {self.name}: {e}")
+                return False
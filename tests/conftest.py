@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# Keep imports of main from touching the working tree or starting background threads
+os.environ.setdefault('ATTACHMENT_DIR', tempfile.mkdtemp(prefix='whatsapp-attachments-'))
+for name in ('OUTBOX_PATH', 'CHAT_INDEX_PATH', 'TEMPLATES_PATH', 'INVALID_NUMBERS_PATH'):
+    os.environ.setdefault(name, '')
+os.environ.setdefault('DRIVER_HEARTBEAT_INTERVAL', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
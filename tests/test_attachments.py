@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import attachments
+
+PNG = b'\x89PNG\r\n\x1a\n' + b'\x00' * 32
+PDF = b'%PDF-1.7\n' + b'\x00' * 32
+MP4 = b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 32
+WEBP = b'RIFF\x00\x00\x00\x00WEBPVP8 ' + b'\x00' * 32
+
+
+@pytest.fixture
+def store(tmp_path):
+    return attachments.AttachmentStore(directory=str(tmp_path / 'store'), max_bytes=1024)
+
+
+def spool(tmp_path, data, name='upload'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('data, content_type', [
+    (PNG, 'image/png'), (PDF, 'application/pdf'), (MP4, 'video/mp4'), (WEBP, 'image/webp'),
+    (b'ID3\x03' + b'\x00' * 16, 'audio/mpeg'), (b'plain text', 'text/plain')
+])
+def test_content_matches_accepts_real_signatures(tmp_path, data, content_type):
+    assert attachments.content_matches(spool(tmp_path, data), content_type)
+
+
+@pytest.mark.parametrize('content_type', ['image/png', 'image/jpeg', 'application/pdf', 'video/mp4', 'image/webp', 'audio/mpeg'])
+def test_content_matches_rejects_mismatched_bytes(tmp_path, content_type):
+    assert not attachments.content_matches(spool(tmp_path, b'<html>not media</html>'), content_type)
+
+
+def test_adopt_rejects_spoofed_type_and_consumes_the_upload(tmp_path, store):
+    path = spool(tmp_path, PDF)
+    assert store.adopt(path, 'photo.png') == (None, 'File content does not match image/png')
+    assert not os.path.exists(path)
+    assert store.stats()['rejected'] == 1
+
+
+def test_adopt_rejects_empty_oversized_and_disallowed_files(tmp_path, store):
+    assert store.adopt(spool(tmp_path, b''), 'empty.pdf')[1] == 'Attachment is empty'
+    assert store.adopt(spool(tmp_path, PNG * 40), 'big.png')[1] == 'Attachment is larger than 1024 bytes'
+    assert store.adopt(spool(tmp_path, b'MZ'), 'tool.exe', 'application/x-msdownload')[1] == \
+        'Content type application/x-msdownload is not allowed'
+
+
+def test_adopt_stores_once_per_content(tmp_path, store):
+    first, error = store.adopt(spool(tmp_path, PNG), 'photo.png')
+    assert error is None and first['kind'] == 'media' and first['content_type'] == 'image/png'
+    second, _ = store.adopt(spool(tmp_path, PNG), 'again.png')
+    assert second['id'] == first['id'] and second['reused']
+
+    stored = store.get(first['id'])
+    assert os.path.exists(stored['path'])
+    assert attachments.AttachmentStore(directory=store.directory).describe(first['id'])['sha256'] == first['sha256']
+
+
+class Element:
+    def click(self):
+        pass
+
+    def send_keys(self, *keys):
+        pass
+
+
+class Driver:
+    def execute_script(self, script, *args):
+        pass
+
+
+def test_unconfirmed_attachment_send_is_not_reported_as_sent(tmp_path, monkeypatch):
+    import main
+    bot = main.WhatsAppBot(account_id='test', user_data_dir=str(tmp_path / 'profile'), cookies_file=str(tmp_path / 'cookies.json'))
+    bot.driver = Driver()
+    # attach button, file input and send button appear, but the preview never closes
+    waits = iter([Element(), Element(), Element(), False])
+    monkeypatch.setattr(bot, 'wait_until', lambda name, condition: next(waits))
+    submitted = []
+    bot.on_submit = lambda: submitted.append(True)
+
+    success, message = bot.attach_and_send('+14155550100', {'kind': 'document', 'path': '/tmp/a.pdf'}, None)
+    assert not success and submitted
+    assert message == 'Attachment to +14155550100 was submitted but not confirmed; not retried to avoid a duplicate'
@@ -0,0 +1,125 @@
+import os
+import tempfile
+import threading
+import time
+
+import pytest
+
+import main
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def increment(self):
+        self.value += 1
+        return self.value
+
+
+class Service:
+    def __init__(self):
+        self.counter = Counter()
+        self.lock = threading.Lock()
+
+    def shared_counter(self):
+        return self.counter
+
+    def total(self, rows):
+        return sum(rows)
+
+    def count_up(self, n):
+        yield from range(n)
+
+    def locked_rows(self):
+        # Like send_bulk: the generator holds a lock between rows
+        with self.lock:
+            while True:
+                yield 'row'
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def owner():
+    # Short path: Unix socket addresses are limited to about 100 bytes. The listener removes it at exit.
+    address = os.path.join(tempfile.mkdtemp(prefix='owner-'), 'owner.sock')
+    owner = main.BrowserOwner(address, {'service': Service()})
+    threading.Thread(target=owner.serve_forever, daemon=True).start()
+    return owner
+
+
+@pytest.fixture
+def client(owner):
+    return main.BrowserOwnerClient(owner.address, chunk_size=100)
+
+
+def disconnect(client):
+    while not client.connections.empty():
+        client.connections.get_nowait().close()
+    client.session.close()
+
+
+def refs(owner, client):
+    client_state = owner.clients.get(client.client_id)
+    return client_state['refs'] if client_state else {}
+
+
+def test_socket_is_owner_only(owner, client):
+    client.root('service').total([1])
+    assert os.stat(owner.address).st_mode & 0o777 == 0o600
+
+
+def test_references_are_counted_per_client_and_released(owner, client):
+    service = client.root('service')
+    first = service.shared_counter()
+    second = service.shared_counter()
+    assert first.increment() == 1 and second.increment() == 2
+    ref_id = first._ref_id
+    assert refs(owner, client)[ref_id][1] == 2
+
+    del first
+    service.total([])
+    assert refs(owner, client)[ref_id][1] == 1
+    del second
+    service.total([])
+    assert ref_id not in refs(owner, client)
+
+
+def test_other_clients_cannot_use_a_reference(owner, client):
+    counter = client.root('service').shared_counter()
+    other = main.BrowserOwnerClient(owner.address)
+    with pytest.raises(KeyError):
+        other.request('call', counter._ref_id, 'increment')
+
+
+def test_iterator_arguments_are_pulled_in_chunks(owner, client):
+    pulled = []
+
+    def rows():
+        for row in range(250):
+            pulled.append(row)
+            yield row
+
+    assert client.root('service').total(rows()) == sum(range(250))
+    assert len(pulled) == 250 and not client.arguments
+
+
+def test_remote_generators_are_advanced_with_next(owner, client):
+    assert list(client.root('service').count_up(3)) == [0, 1, 2]
+
+
+def test_disconnect_closes_generators_and_frees_their_locks(owner, client):
+    service = owner.roots['service']
+    rows = client.root('service').locked_rows()
+    assert next(rows) == 'row'
+    assert service.lock.locked()
+
+    disconnect(client)
+    wait_for(lambda: not service.lock.locked())
+    wait_for(lambda: client.client_id not in owner.clients)
@@ -0,0 +1,60 @@
+import pytest
+
+import main
+
+
+class Browser:
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def bot(tmp_path, monkeypatch):
+    bot = main.WhatsAppBot(account_id='test', user_data_dir=str(tmp_path / 'profile'), cookies_file=str(tmp_path / 'cookies.json'))
+    bot.supervisor = main.DriverSupervisor(bot, interval=0)
+    bot.launches_fail = False
+
+    def setup_driver():
+        if bot.launches_fail:
+            return False
+        bot.driver = Browser()
+        bot.driver_started_at = main.time.time()
+        return True
+
+    monkeypatch.setattr(bot, 'setup_driver', setup_driver)
+    monkeypatch.setattr(bot.session_store, 'capture', lambda: None)
+    return bot
+
+
+def test_launches_after_close_never_back_off(bot):
+    for _ in range(3):
+        assert bot.restart_driver()
+        assert bot.close_session()[0]
+    assert bot.supervisor.restart_failures == 0
+
+
+def test_successful_recycle_does_not_back_off(bot):
+    assert bot.restart_driver()
+    bot.driver_started_at -= 3600
+    assert bot.restart_driver(planned=True)
+    assert bot.supervisor.restart_failures == 0
+    assert bot.supervisor.may_restart()
+
+
+def test_browser_dying_within_stable_seconds_backs_off(bot):
+    assert bot.restart_driver()
+    assert bot.restart_driver()
+    assert bot.supervisor.restart_failures == 1
+    assert not bot.restart_driver()
+
+
+def test_failed_launch_backs_off_until_retry_is_due(bot):
+    bot.launches_fail = True
+    assert not bot.restart_driver()
+    assert bot.launch_failed and bot.supervisor.restart_failures == 1
+    assert not bot.restart_driver()
+
+    bot.supervisor.next_restart_at = 0
+    bot.launches_fail = False
+    assert bot.restart_driver()
+    assert not bot.launch_failed
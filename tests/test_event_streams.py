@@ -0,0 +1,38 @@
+import threading
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def watcher(monkeypatch):
+    watcher = main.pool.watchers[main.pool.get().account_id]
+    monkeypatch.setattr(watcher, 'ensure_started', lambda: None)
+    monkeypatch.setattr(main, 'SSE_SLOTS', threading.BoundedSemaphore(1))
+    return watcher
+
+
+def test_login_stream_carries_qr_events_when_asked(watcher):
+    response = main.app.test_client().get('/events/login?qr=1')
+    frames = iter(response.response)
+    assert next(frames).startswith(b'event: login_state\n')
+
+    watcher.qr_events.publish('qr', {'qr_image': 'abc'})
+    watcher.events.publish('login_state', {'state': 'qr'})
+    assert next(frames) == b'event: qr\ndata: {"qr_image": "abc"}\n\n'
+    assert next(frames) == b'event: login_state\ndata: {"state": "qr"}\n\n'
+    response.close()
+    assert not watcher.qr_events.subscribers and not watcher.events.subscribers
+
+
+def test_streams_beyond_the_cap_get_503_until_one_closes(watcher):
+    client = main.app.test_client()
+    first = client.get('/events/login')
+    rejected = client.get('/events/login')
+    assert rejected.status_code == 503 and rejected.headers['Retry-After'] == '5'
+
+    first.close()
+    reopened = client.get('/events/login')
+    assert reopened.status_code == 200
+    reopened.close()
@@ -0,0 +1,115 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    # A long flush interval leaves flushing to the tests
+    outbox = main.Outbox(str(tmp_path / 'outbox.db'), flush_interval=60)
+    yield outbox
+    outbox.close()
+
+
+def job(job_id, status='queued', account='default'):
+    return {'id': job_id, 'account': account, 'phone_number': '+14155550100', 'message': 'hi',
+            'attachment_id': None, 'priority': 0, 'status': status, 'created_at': main.time.time()}
+
+
+def test_status_changes_coalesce_until_flushed(outbox):
+    outbox.insert(job('a'))
+    outbox.update('a', status='sending', started_at=1.0, attempts_increment=1)
+    outbox.update('a', status='sent', result='ok', finished_at=2.0)
+    assert outbox.get('a')['status'] == 'sent'
+    assert outbox.stats()['jobs'] == {'queued': 1}
+
+    assert outbox.flush() == 1
+    stored = outbox.get('a')
+    assert (stored['status'], stored['result'], stored['attempts'], stored['started_at']) == ('sent', 'ok', 1, 1.0)
+    assert outbox.flush() == 0
+
+
+def test_coalesced_attempt_increments_add_up(outbox):
+    outbox.insert(job('a'))
+    outbox.update('a', attempts_increment=1)
+    outbox.update('a', attempts_increment=1)
+    assert outbox.get('a')['attempts'] == 2
+    outbox.flush()
+    assert outbox.get('a')['attempts'] == 2
+
+
+def test_submitted_is_committed_at_once_with_pending_changes(outbox):
+    outbox.insert(job('a'))
+    outbox.update('a', status='sending', attempts_increment=1)
+    outbox.mark_submitted('a')
+    stats = outbox.stats()
+    assert stats['pending_updates'] == 0 and stats['jobs'] == {'submitted': 1}
+    assert outbox.get('a')['attempts'] == 1
+
+
+def test_failed_flush_rolls_back_and_keeps_the_updates(outbox, monkeypatch):
+    outbox.insert(job('a'))
+    outbox.insert(job('b'))
+    outbox.update('a', status='sending', attempts_increment=1)
+    outbox.update('b', status='sending', attempts_increment=1)
+    write = outbox.write
+
+    def failing_write(job_id, fields):
+        if job_id == 'b':
+            raise sqlite3.OperationalError('disk I/O error')
+        write(job_id, fields)
+
+    monkeypatch.setattr(outbox, 'write', failing_write)
+    with pytest.raises(sqlite3.OperationalError):
+        outbox.flush()
+    monkeypatch.setattr(outbox, 'write', write)
+    # Nothing from the failed transaction reached the table, 'a' included
+    assert outbox.stats()['jobs'] == {'queued': 2}
+
+    outbox.update('a', status='sent', attempts_increment=1)
+    assert outbox.flush() == 2
+    assert (outbox.get('a')['status'], outbox.get('a')['attempts']) == ('sent', 2)
+    assert (outbox.get('b')['status'], outbox.get('b')['attempts']) == ('sending', 1)
+
+
+def test_idempotency_key_returns_the_live_job(outbox):
+    assert outbox.insert(job('a'), 'key-1') is None
+    assert outbox.insert(job('b'), 'key-1') == 'a'
+    outbox.update('a', status='sent')
+    assert outbox.insert(job('c'), 'key-1') == 'a'
+
+
+def test_failed_job_hands_its_key_to_a_retry(outbox):
+    outbox.insert(job('a'), 'key-1')
+    # Still pending in memory: the takeover must see the coalesced 'failed'
+    outbox.update('a', status='failed', result='boom')
+    assert outbox.insert(job('b'), 'key-1') is None
+    outbox.flush()
+    assert outbox.get('a')['idempotency_key'] is None and outbox.get('a')['status'] == 'failed'
+    assert outbox.get('b')['idempotency_key'] == 'key-1'
+    assert outbox.insert(job('c'), 'key-1') == 'b'
+
+
+def test_recover_resumes_unsent_jobs_and_never_resends_submitted_ones(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = main.Outbox(path, flush_interval=60)
+    for job_id in ('queued', 'sending', 'submitted', 'sent'):
+        outbox.insert(job(job_id))
+    outbox.insert(job('other', account='second'))
+    outbox.update('sending', status='sending', started_at=1.0)
+    outbox.update('sent', status='sent')
+    outbox.flush()
+    outbox.mark_submitted('submitted')
+    outbox.close()
+
+    restarted = main.Outbox(path, flush_interval=60)
+    try:
+        assert [recovered['id'] for recovered in restarted.recover('default')] == ['queued', 'sending']
+        assert restarted.get('sending')['started_at'] is None
+        assert restarted.get('submitted')['status'] == 'unknown'
+        assert restarted.get('sent')['status'] == 'sent'
+        assert restarted.get('other')['status'] == 'queued'
+    finally:
+        restarted.close()
@@ -0,0 +1,59 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(main.time, 'monotonic', lambda: now[0])
+    return now
+
+
+def governor(**kwargs):
+    settings = dict(rate_per_minute=0, burst=2, recipient_interval=0, jitter=0, max_recipients=100)
+    settings.update(kwargs)
+    return main.RateGovernor(**settings)
+
+
+def test_off_by_default(monkeypatch):
+    monkeypatch.delenv('RATE_LIMIT_PER_MINUTE', raising=False)
+    monkeypatch.delenv('RECIPIENT_MIN_INTERVAL', raising=False)
+    rate_governor = main.RateGovernor()
+    assert [rate_governor.reserve('+14155550100') for _ in range(20)] == [0.0] * 20
+
+
+def test_global_bucket_allows_burst_then_spaces_sends(clock):
+    rate_governor = governor(rate_per_minute=60)
+    assert rate_governor.reserve('+14155550100') == 0.0
+    assert rate_governor.reserve('+14155550101') == 0.0
+    assert rate_governor.reserve('+14155550102') == pytest.approx(1.0)
+    assert rate_governor.reserve('+14155550103') == pytest.approx(2.0)
+
+    clock[0] += 10
+    assert rate_governor.budget()['tokens'] == 2
+
+
+def test_recipient_interval_applies_per_recipient(clock):
+    rate_governor = governor(recipient_interval=30)
+    assert rate_governor.reserve('+14155550100') == 0.0
+    assert rate_governor.reserve('+14155550101') == 0.0
+    assert rate_governor.reserve('+14155550100') == pytest.approx(30.0)
+
+    clock[0] += 45
+    assert rate_governor.check('+14155550100') == pytest.approx(15.0)
+
+
+def test_reserve_over_max_wait_reserves_nothing(clock):
+    rate_governor = governor(rate_per_minute=60, burst=1)
+    rate_governor.reserve('+14155550100')
+    assert rate_governor.reserve('+14155550101', max_wait=0.5) is None
+    assert rate_governor.budget()['decisions'] == 1
+    assert rate_governor.reserve('+14155550101', max_wait=1) == pytest.approx(1.0)
+
+
+def test_tracked_recipients_stay_bounded(clock):
+    rate_governor = governor(recipient_interval=30, max_recipients=3)
+    for i in range(10):
+        rate_governor.reserve(f"+1415555{i:04d}")
+    assert rate_governor.budget()['tracked_recipients'] <= 3
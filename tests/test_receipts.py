@@ -0,0 +1,87 @@
+import types
+
+import pytest
+
+import main
+
+
+PHONE = '+14155550100'
+OTHER = '+14155550199'
+
+
+class FakeDriver:
+    def __init__(self):
+        self.pending = []
+        self.scripts = 0
+
+    def execute_script(self, script, config):
+        self.scripts += 1
+        events, self.pending = self.pending, []
+        return events
+
+
+@pytest.fixture
+def tracker():
+    bot = types.SimpleNamespace(driver=FakeDriver(), account_id='default')
+    tracker = main.ReceiptTracker(bot)
+    tracker.enabled = True
+    return tracker
+
+
+def row(message_id, phone_number, status='pending', text=None, at=1000):
+    event = {'id': f"true_{phone_number.lstrip('+')}@c.us_{message_id}", 'status': status, 'at': at}
+    if text is not None:
+        event['text'] = text
+    return event
+
+
+def test_tracking_is_opt_in():
+    assert main.RECEIPT_TRACKING is False
+    bot = types.SimpleNamespace(driver=FakeDriver(), account_id='default')
+    tracker = main.ReceiptTracker(bot)
+    tracker.track('r1', PHONE, 'hello')
+    assert tracker.drain() == 0
+    assert bot.driver.scripts == 0
+    assert tracker.get('r1') is None
+
+
+def test_rows_pair_with_oldest_unmatched_sends_in_order(tracker):
+    tracker.track('r1', PHONE, 'hello')
+    tracker.track('r2', PHONE, 'hello')
+    tracker.apply([row('A', PHONE, text='hello\n10:00'), row('B', PHONE, text='hello\n10:01')])
+    assert tracker.receipts['r1']['message_id'].endswith('_A')
+    assert tracker.receipts['r2']['message_id'].endswith('_B')
+    assert not tracker.unmatched
+
+
+def test_older_history_rows_are_skipped(tracker):
+    tracker.track('r1', PHONE, 'hello')
+    # The first scan of a page also finds earlier messages with the same text
+    tracker.apply([row('OLD', PHONE, status='read', text='hello'), row('NEW', PHONE, text='hello')])
+    assert tracker.receipts['r1']['message_id'].endswith('_NEW')
+    assert tracker.get('r1')['status'] == 'pending'
+
+
+def test_rows_only_pair_within_the_same_chat_and_text(tracker):
+    tracker.track('r1', PHONE, 'hello')
+    tracker.apply([row('A', OTHER, text='hello'), row('B', PHONE, text='goodbye')])
+    assert tracker.receipts['r1']['message_id'] is None
+    assert list(tracker.unmatched) == ['r1']
+
+    tracker.apply([row('C', PHONE, text='  hello  ')])
+    assert tracker.receipts['r1']['message_id'].endswith('_C')
+
+
+def test_ticks_advance_the_matched_receipt(tracker):
+    tracker.track('r1', PHONE, 'hello')
+    tracker.bot.driver.pending = [row('A', PHONE, text='hello')]
+    assert tracker.drain() == 1
+    tracker.bot.driver.pending = [row('A', PHONE, status='read', at=3000)]
+    tracker.drain()
+    receipt = tracker.get('r1')
+    assert receipt['observed'] and receipt['status'] == 'read'
+    assert receipt['timestamps']['sent'] == receipt['timestamps']['delivered'] == 3.0
+
+    # Ticks never move backwards
+    tracker.apply([row('A', PHONE, status='delivered', at=4000)])
+    assert tracker.get('r1')['status'] == 'read'
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+import recipients
+
+
+@pytest.mark.parametrize('raw, expected', [
+    ('+91 98765-43210', '+919876543210'),
+    ('(+1) 415.555.0100', '+14155550100'),
+    ('tel:+447700900123', '+447700900123'),
+    ('0044 7700 900123', '+447700900123'),
+])
+def test_normalize_accepts_common_formats(raw, expected):
+    assert recipients.normalize(raw) == (expected, None)
+
+
+@pytest.mark.parametrize('raw, error', [
+    (None, 'Phone number is required'),
+    ('   ', 'Phone number is required'),
+    ('9876543210', 'Phone number must include country code (e.g., +91xxxxxxxxxx)'),
+    ('+91abc43210', 'Phone number may only contain digits after the country code +'),
+    ('+9112345', 'Invalid phone number length'),
+    ('+1234567890123456', 'Invalid phone number length'),
+    ('+0123456789', 'Country code cannot start with 0'),
+])
+def test_normalize_rejects_malformed_numbers(raw, error):
+    assert recipients.normalize(raw) == (None, error)
+
+
+def test_invalid_number_notice_matches_only_the_whatsapp_popup():
+    assert recipients.is_invalid_number_notice('Phone number shared via url is invalid.\nOK')
+    assert not recipients.is_invalid_number_notice('Invalid file type')
+    assert not recipients.is_invalid_number_notice(None)
+
+
+def test_invalid_number_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(recipients.time, 'time', lambda: now[0])
+    cache = recipients.InvalidNumberCache(path='', ttl=60, limit=10)
+    cache.add('+14155550100')
+    assert cache.contains('+14155550100')
+
+    now[0] += 60
+    assert not cache.contains('+14155550100')
+    assert cache.stats()['size'] == 0
+
+
+def test_invalid_number_cache_evicts_least_recently_used():
+    cache = recipients.InvalidNumberCache(path='', ttl=60, limit=2)
+    cache.add('+14155550100')
+    cache.add('+14155550101')
+    assert cache.contains('+14155550100')
+    cache.add('+14155550102')
+
+    assert cache.contains('+14155550100')
+    assert not cache.contains('+14155550101')
+    assert cache.contains('+14155550102')
+
+
+def test_invalid_number_cache_persists_in_batches(tmp_path):
+    path = str(tmp_path / 'invalid.json')
+    cache = recipients.InvalidNumberCache(path=path, ttl=60, debounce=60)
+    for number in range(14155550100, 14155550150):
+        cache.add(f"+{number}")
+    assert cache.stats()['writes'] == 0
+
+    assert cache.flush()
+    with open(path, encoding='utf-8') as f:
+        assert len(json.load(f)) == 50
+    assert recipients.InvalidNumberCache(path=path, ttl=60).contains('+14155550100')
+
+    assert cache.discard('+14155550100')
+    cache.flush()
+    assert not recipients.InvalidNumberCache(path=path, ttl=60).contains('+14155550100')
+
+
+def test_chat_index_batches_saves_off_the_send_path(tmp_path):
+    path = str(tmp_path / 'chats.json')
+    index = recipients.ChatIndex(path, debounce=60)
+    for number in range(14155550100, 14155550200):
+        index.learn(str(number), f"+{number}")
+    index.miss('14155550100')
+    assert index.stats()['writes'] == 0
+
+    assert index.flush()
+    assert not index.flush()
+    reloaded = recipients.ChatIndex(path)
+    assert reloaded.searchable('14155550199')
+    assert not reloaded.searchable('14155550100')
+    assert not reloaded.searchable('14155550200')
@@ -0,0 +1,68 @@
+import json
+import threading
+
+import pytest
+import trio
+import trio_websocket
+
+import main
+
+
+@pytest.fixture
+def policy(monkeypatch):
+    monkeypatch.setenv('LEAN_BROWSING', '1')
+    monkeypatch.setenv('BLOCK_RESOURCE_TYPES', 'Image,Font,Script')
+    return main.ResourcePolicy()
+
+
+def test_only_known_resource_types_are_blocked(policy):
+    assert policy.resource_types == ['Image', 'Font']
+
+
+def test_images_get_a_blank_gif_and_fonts_fail(policy):
+    image = policy.block(1, {'requestId': 'r1', 'resourceType': 'Image'})
+    assert image['method'] == 'Fetch.fulfillRequest' and image['params']['responseCode'] == 200
+    font = policy.block(2, {'requestId': 'r2', 'resourceType': 'Font'})
+    assert font == {'id': 2, 'method': 'Fetch.failRequest', 'params': {'requestId': 'r2', 'errorReason': 'BlockedByClient'}}
+    assert policy.stats()['blocked_by_type'] == {'Image': 1, 'Font': 1}
+
+
+def test_interceptor_enables_fetch_by_type_and_answers_paused_requests(policy):
+    """A stand-in DevTools endpoint checks what the interceptor asks for and answers"""
+    received = []
+    port = []
+    listening = threading.Event()
+
+    async def devtools(request):
+        ws = await request.accept()
+        received.append(json.loads(await ws.get_message()))
+        await ws.send_message(json.dumps({'id': 0, 'result': {}}))
+        await ws.send_message(json.dumps({'method': 'Fetch.requestPaused',
+                                          'params': {'requestId': 'r1', 'resourceType': 'Image'}}))
+        received.append(json.loads(await ws.get_message()))
+        await ws.aclose()
+
+    async def serve():
+        async with trio.open_nursery() as nursery:
+            listeners = await nursery.start(trio_websocket.serve_websocket, devtools, '127.0.0.1', 0, None)
+            port.append(listeners.port)
+            listening.set()
+            with trio.move_on_after(5):
+                while len(received) < 2:
+                    await trio.sleep(0.01)
+            nursery.cancel_scope.cancel()
+
+    server = threading.Thread(target=trio.run, args=(serve,))
+    server.start()
+    listening.wait(5)
+
+    ready = threading.Event()
+    policy.intercept(f"ws://127.0.0.1:{port[0]}/devtools/page/1", ready)
+    server.join(5)
+
+    assert ready.is_set()
+    assert received[0]['params']['patterns'] == [
+        {'urlPattern': 'http*', 'resourceType': 'Image', 'requestStage': 'Request'},
+        {'urlPattern': 'http*', 'resourceType': 'Font', 'requestStage': 'Request'}
+    ]
+    assert received[1]['method'] == 'Fetch.fulfillRequest' and received[1]['params']['requestId'] == 'r1'
@@ -0,0 +1,94 @@
+import types
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def make_queue(monkeypatch, tmp_path):
+    monkeypatch.setattr(main.SendJobQueue, 'ensure_worker', lambda self: None)
+
+    def make_queue(**kwargs):
+        return main.SendJobQueue(types.SimpleNamespace(account_id='default'), **kwargs)
+    return make_queue
+
+
+def drain(send_queue):
+    """Phone numbers in the order the worker would send them"""
+    order = []
+    with send_queue.condition:
+        while send_queue.heap:
+            order.append(send_queue.jobs[send_queue.pop_next()]['phone_number'])
+    return order
+
+
+def test_higher_priority_first_then_fifo(make_queue):
+    send_queue = make_queue()
+    for phone_number, priority in [('+1', 0), ('+2', 5), ('+3', 0), ('+4', 5), ('+5', -1)]:
+        send_queue.submit(phone_number, 'hi', priority=priority)
+    assert drain(send_queue) == ['+2', '+4', '+1', '+3', '+5']
+
+
+def test_full_queue_rejects_with_retry_after(make_queue):
+    send_queue = make_queue(max_depth=2)
+    send_queue.avg_send_seconds = 7.2
+    assert send_queue.submit('+1', 'hi')[0]
+    assert send_queue.submit('+2', 'hi')[0]
+    assert send_queue.submit('+3', 'hi') == (None, 8)
+    assert send_queue.depth() == 2
+
+
+def test_duplicate_idempotency_key_queues_nothing(make_queue, tmp_path):
+    outbox = main.Outbox(str(tmp_path / 'outbox.db'), flush_interval=60)
+    try:
+        send_queue = make_queue(outbox=outbox)
+        first, _ = send_queue.submit('+1', 'hi', idempotency_key='key-1')
+        duplicate, retry_after = send_queue.submit('+1', 'hi', idempotency_key='key-1')
+        assert duplicate['id'] == first['id'] and duplicate['duplicate'] and retry_after == 0
+        assert send_queue.depth() == 1
+    finally:
+        outbox.close()
+
+
+def test_restore_requeues_journalled_jobs_by_priority(make_queue, tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = main.Outbox(path, flush_interval=60)
+    previous = make_queue(outbox=outbox)
+    previous.submit('+1', 'hi')
+    previous.submit('+2', 'hi', priority=3)
+    interrupted, _ = previous.submit('+3', 'hi')
+    outbox.update(interrupted['id'], status='sending')
+    outbox.close()
+
+    outbox = main.Outbox(path, flush_interval=60)
+    try:
+        send_queue = make_queue(outbox=outbox)
+        assert send_queue.restore() == 3
+        assert send_queue.get(interrupted['id'])['status'] == 'queued'
+        assert drain(send_queue) == ['+2', '+1', '+3']
+    finally:
+        outbox.close()
+
+
+def test_jobs_for_the_open_chat_are_grouped(make_queue):
+    send_queue = make_queue()
+    for phone_number in ['+1', '+2', '+1', '+3', '+1']:
+        send_queue.submit(phone_number, 'hi')
+    assert drain(send_queue) == ['+1', '+1', '+1', '+2', '+3']
+    assert send_queue.stats()['affinity_picks'] == 2
+
+
+def test_grouping_never_jumps_priority_or_exceeds_the_run_limit(make_queue):
+    send_queue = make_queue()
+    send_queue.affinity_max_run = 2
+    for phone_number, priority in [('+1', 0), ('+2', 0), ('+1', 0), ('+1', 0), ('+3', 9), ('+1', 0)]:
+        send_queue.submit(phone_number, 'hi', priority=priority)
+    assert drain(send_queue) == ['+3', '+1', '+1', '+2', '+1', '+1']
+
+
+def test_grouping_is_off_when_recipients_are_spaced(make_queue):
+    send_queue = make_queue(governor=main.RateGovernor(rate_per_minute=0, recipient_interval=30))
+    for phone_number in ['+1', '+2', '+1']:
+        send_queue.submit(phone_number, 'hi')
+    assert drain(send_queue) == ['+1', '+2', '+1']
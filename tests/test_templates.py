@@ -0,0 +1,45 @@
+import pytest
+
+import main
+
+
+def test_render_substitutes_variables_and_keeps_literal_braces():
+    template = main.MessageTemplate('Hi {name}, your order {order} ships {{soon}}')
+    assert template.variables == {'name', 'order'}
+    assert template.render({'name': 'Asha', 'order': 42, 'unused': 'x'}) == 'Hi Asha, your order 42 ships {soon}'
+
+
+def test_missing_reports_absent_null_and_blank_values():
+    template = main.MessageTemplate('{a} {b} {c} {d}')
+    assert template.missing({'a': 'x', 'b': None, 'c': '  '}) == ['b', 'c', 'd']
+
+
+@pytest.mark.parametrize('text', ['{0}', '{}', '{user.name}', '{items[0]}', '{name:>10}', '{name!r}', 'unclosed {name'])
+def test_rejects_placeholders_other_than_bare_names(text):
+    with pytest.raises(ValueError):
+        main.MessageTemplate(text)
+
+
+def test_compile_template_caches_the_parse():
+    assert main.compile_template('Hello {name}') is main.compile_template('Hello {name}')
+
+
+def test_store_ids_are_stable_and_registrations_persist(tmp_path):
+    path = str(tmp_path / 'templates.json')
+    store = main.TemplateStore(path=path)
+    view, error = store.register('Hello {name}')
+    assert error is None and view['variables'] == ['name']
+    assert store.register('Hello {name}')[0]['template_id'] == view['template_id']
+
+    assert main.TemplateStore(path=path).get(view['template_id']) == view
+    assert store.register('Hello {0}') == (None, 'Invalid placeholder {0}: use {name} with letters, digits and _')
+
+
+def test_bulk_rows_render_from_template():
+    template = main.compile_template('Hi {name}')
+    rows = list(main.iter_bulk_rows(
+        [{'phone_number': '+14155550100', 'name': 'Asha'}, {'phone_number': '+14155550101'}],
+        template=template
+    ))
+    assert rows[0]['message'] == 'Hi Asha' and 'error' not in rows[0]
+    assert rows[1]['error'] == 'Missing template variables: name'